@@ -0,0 +1,68 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import connection
+
+import hashlib
+
+# The user of each request is looked up by AuthenticationMiddleware (from
+# the user id in the session). CachedModelBackend keeps the users it looks up
+# in the shared cache (see CACHES in settings.py), which every worker process
+# reads, so most requests don't query the database for them.
+#
+# A cached user is thrown away whenever the user is saved or deleted (which
+# includes changing or resetting their password, and logging in), and when
+# they log out, see signals.py. Users changed without being saved (e.g. by
+# QuerySet.update) are only looked up again after USER_CACHE_TIMEOUT.
+
+USER_CACHE_ALIAS = "shared"
+
+# How long users are cached for, in seconds.
+USER_CACHE_TIMEOUT = 5 * 60
+
+def _get_cache():
+    return caches[USER_CACHE_ALIAS]
+
+def _user_key(userId):
+    # The database is part of the key, so that user ids of another database
+    # using the same cache (like the test database) are never mixed up.
+    database = hashlib.md5(str(connection.settings_dict["NAME"]).encode()).hexdigest()[:8]
+    return f"user:{database}:{userId}"
+
+def cache_user(user):
+    """
+    Adds a user to the cache (e.g. when they log in, as they are likely to
+    make another request soon).
+    """
+    _get_cache().set(_user_key(user.pk), user, USER_CACHE_TIMEOUT)
+
+def invalidate_user(userId):
+    """
+    Call whenever a user changes, to stop the cached copy of them being used.
+    """
+    _get_cache().delete(_user_key(userId))
+
+class CachedModelBackend(ModelBackend):
+    """
+    The default authentication backend, with the users of requests looked up
+    in the shared cache before the database (see the top of this file).
+    """
+
+    def get_user(self, user_id):
+        key = _user_key(user_id)
+        user = _get_cache().get(key)
+        if user == None:
+            user = super().get_user(user_id)
+            if user == None:
+                return None
+            _get_cache().set(key, user, USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        key = _user_key(user_id)
+        user = await _get_cache().aget(key)
+        if user == None:
+            user = await super().aget_user(user_id)
+            if user == None:
+                return None
+            await _get_cache().aset(key, user, USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .backends import cache_user, invalidate_user
+
+# Keeping the cached users (see backends.py) up to date. Changing a password
+# saves the user, so sessions using the old password stop working straight
+# away (their session hash no longer matches the user), rather than once
+# the cached user expires.
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_user_cache(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+# Connected after django.contrib.auth's receiver saving last_login (as the
+# accounts app comes after it in INSTALLED_APPS), so the user cached is the
+# one just saved.
+@receiver(user_logged_in)
+def cache_logged_in_user(sender, request, user, **kwargs):
+    cache_user(user)
+
+@receiver(user_logged_out)
+def invalidate_logged_out_user(sender, request, user, **kwargs):
+    # Nobody may be logged in.
+    if user != None:
+        invalidate_user(user.pk)
@@ -1,3 +1,76 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from .backends import CachedModelBackend
+
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", password="old-password-123")
+
+    def tearDown(self):
+        # The sessions and users cached by a test aren't left for the next.
+        caches["shared"].clear()
+
+    def test_cache_location(self):
+        # The tests don't use the shared cache of the site (see TEST_RUNNER).
+        self.assertNotEqual(settings.CACHES["shared"]["LOCATION"], settings.SHARED_CACHE_DIR)
+
+    def login(self):
+        self.client.login(username="user", password="old-password-123")
+
+    def is_logged_in(self, client):
+        # The password change page needs the user to be logged in, and
+        # doesn't query anything else.
+        return client.get(reverse("password_change")).status_code == 200
+
+    def test_cached_lookups(self):
+        self.login()
+        # Neither the session nor the user are read from the database.
+        with self.assertNumQueries(0):
+            self.assertTrue(self.is_logged_in(self.client))
+
+    def test_user_saved(self):
+        self.login()
+        self.assertTrue(self.is_logged_in(self.client))
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.is_logged_in(self.client))
+
+    def test_cached_user(self):
+        backend = CachedModelBackend()
+        self.assertEqual(backend.get_user(self.user.id), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get_user(self.user.id).username, "user")
+
+        User.objects.get(id=self.user.id).delete()
+        self.assertEqual(backend.get_user(self.user.id), None)
+
+    def test_logout(self):
+        self.login()
+        sessionId = self.client.cookies["sessionid"].value
+        self.client.post(reverse("logout"))
+
+        # The old session can't be used again.
+        self.client.cookies["sessionid"] = sessionId
+        self.assertFalse(self.is_logged_in(self.client))
+
+    def test_password_change(self):
+        self.login()
+        otherClient = self.client_class()
+        otherClient.login(username="user", password="old-password-123")
+
+        response = self.client.post(reverse("password_change"), {
+            "old_password": "old-password-123",
+            "new_password1": "new-password-456",
+            "new_password2": "new-password-456",
+        })
+        self.assertRedirects(response, reverse("password_change_done"))
+
+        # Still logged in where the password was changed, but logged out
+        # everywhere else.
+        self.assertTrue(self.is_logged_in(self.client))
+        self.assertFalse(self.is_logged_in(otherClient))
@@ -0,0 +1,83 @@
+// Keeps the task list on the view_todo page up to date with changes made by
+// anyone else viewing the todo (see todo/events.py), patching the page
+// rather than reloading it.
+(function () {
+    const taskList = document.getElementById("task-list");
+    if (taskList === null || !window.EventSource) {
+        return;
+    }
+    const numOfTasks = document.getElementById("num-of-tasks");
+    const numDone = document.getElementById("num-done");
+    const source = new EventSource(taskList.dataset.eventsUrl);
+    let reloadTimer = null;
+
+    // Fetches the page again (its task list is cached on the server) and
+    // swaps in the new task list. Several changes close together (e.g. from
+    // a batch) only fetch it once.
+    function reloadTaskList() {
+        clearTimeout(reloadTimer);
+        reloadTimer = setTimeout(function () {
+            fetch(window.location.href, { credentials: "same-origin" })
+                .then(function (response) { return response.text(); })
+                .then(function (html) {
+                    const page = new DOMParser().parseFromString(html, "text/html");
+                    const newTaskList = page.getElementById("task-list");
+                    const newNumOfTasks = page.getElementById("num-of-tasks");
+                    const newNumDone = page.getElementById("num-done");
+                    if (newTaskList !== null) {
+                        taskList.innerHTML = newTaskList.innerHTML;
+                    }
+                    if (newNumOfTasks !== null) {
+                        numOfTasks.textContent = newNumOfTasks.textContent;
+                    }
+                    if (newNumDone !== null) {
+                        numDone.textContent = newNumDone.textContent;
+                    }
+                });
+        }, 100);
+    }
+
+    // Adds to the number of done tasks shown.
+    function addToNumDone(amount) {
+        numDone.textContent = parseInt(numDone.textContent, 10) + amount;
+    }
+
+    source.addEventListener("task", function (message) {
+        const task = JSON.parse(message.data);
+        const element = document.getElementById("task-" + task.id);
+        // Whether the task was done, if it is on this page.
+        const wasDone = element !== null && element.querySelector(".task-done").textContent === "True";
+
+        if (task.action === "deleted") {
+            if (element !== null) {
+                element.remove();
+            }
+            numOfTasks.textContent = parseInt(numOfTasks.textContent, 10) - 1;
+            if (wasDone) {
+                addToNumDone(-1);
+            } else if (element === null) {
+                // The task isn't on this page, so it isn't known if it was done.
+                reloadTaskList();
+            }
+        } else if (element !== null) {
+            if (task.done !== wasDone) {
+                addToNumDone(task.done ? 1 : -1);
+            }
+            element.querySelector(".task-title").textContent = task.title;
+            element.querySelector(".task-done").textContent = task.done ? "True" : "False";
+            element.querySelector(".task-complete").textContent = task.done ? "Uncomplete" : "Complete";
+        } else {
+            // New tasks need rendering by the server.
+            reloadTaskList();
+        }
+    });
+
+    // The page missed some changes, or the users access level changed.
+    source.addEventListener("reload", reloadTaskList);
+
+    // The user can't see the todo any more (or it was removed).
+    source.addEventListener("revoked", function () {
+        source.close();
+        window.location.reload();
+    });
+})();
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 
+import os
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -42,6 +44,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Only used when METRICS_ENABLED is set (see below), first so that it
+    # times everything else.
+    "todo.metrics.MetricsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,13 +54,16 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Only used when PROFILING_ENABLED is set (see below).
+    "todo.profiling.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = 'to_do_app.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The Django backend, timing renders for todo/profiling.py.
+        'BACKEND': 'todo.profiling.ProfilingTemplates',
         "DIRS": [BASE_DIR / "templates"],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -87,6 +95,126 @@ DATABASES = {
     }
 }
 
+# Set TODO_DATABASE_PROFILE=production to use the production profile, which
+# keeps connections open between requests (checking they still work before 
+# reusing them), takes the write lock at the start of each transaction (so 
+# a read can't fail to upgrade to a write part way through), and sets the
+# pragmas in todo/sqlite.py (WAL, busy timeout etc.) on each new connection.
+# Compare the profiles with "python manage.py bench_sqlite".
+DATABASE_PROFILE = os.environ.get("TODO_DATABASE_PROFILE", "development")
+
+if DATABASE_PROFILE == "production":
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    })
+
+# Set TODO_WRITE_QUEUE=1 to have the task views hand their writes to a single
+# writer thread that commits several requests' writes at once (see
+# todo/writer.py), waiting at most WRITE_QUEUE_MAX_DELAY seconds for others
+# to join a group. Compare with "python manage.py bench_writes".
+WRITE_QUEUE_ENABLED = os.environ.get("TODO_WRITE_QUEUE") == "1"
+WRITE_QUEUE_MAX_BATCH = 64
+WRITE_QUEUE_MAX_DELAY = 0.005
+
+# Set TODO_ASYNC_VIEWS=1 to use the async versions of home, view_todo,
+# add_task and complete_task (see todo/async_views.py), which only help when
+# served through asgi.py (under wsgi.py each request would need its own event
+# loop). Compare with "python manage.py bench_asgi".
+ASYNC_VIEWS = os.environ.get("TODO_ASYNC_VIEWS") == "1"
+
+# Set TODO_LIVE_EVENTS=1 when serving the site through asgi.py to keep the
+# view_todo page up to date with changes made by anyone else (see
+# todo/events.py). Each open page holds a stream open, which under wsgi.py
+# would hold a worker thread forever, so the page and the route for its
+# stream are left out otherwise.
+LIVE_EVENTS_ENABLED = os.environ.get("TODO_LIVE_EVENTS") == "1"
+
+# Set TODO_PROFILING=1 to profile a sample of requests (the fraction in 
+# TODO_PROFILING_SAMPLE_RATE, 1% by default), see todo/profiling.py. Their DB,
+# template and total times are sent in a Server-Timing header and reported
+# by URL name at /api/v1/profile_stats (staff only).
+PROFILING_ENABLED = os.environ.get("TODO_PROFILING") == "1"
+PROFILING_SAMPLE_RATE = float(os.environ.get("TODO_PROFILING_SAMPLE_RATE", "0.01"))
+
+# Set TODO_METRICS=1 to record request latency, query and write metrics (see
+# todo/metrics.py), served in the Prometheus text format at /metrics. Set
+# TODO_METRICS_TOKEN to only serve them to requests with the header
+# "Authorization: Bearer <token>". Under a prefork server set 
+# TODO_METRICS_DIR to a directory (emptied when the server starts) for the 
+# worker processes to share their metrics through.
+METRICS_ENABLED = os.environ.get("TODO_METRICS") == "1"
+METRICS_TOKEN = os.environ.get("TODO_METRICS_TOKEN", "")
+METRICS_DIR = os.environ.get("TODO_METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = 5
+
+# Slow work (like purging deleted todos) is handed off to background jobs
+# kept in the database (see todo/jobs.py), which are run by
+# "python manage.py run_jobs" (keep it running next to the server). A job
+# that isn't finished within TODO_JOB_VISIBILITY_TIMEOUT seconds (e.g. as
+# its worker died) is run again by another worker. Jobs that raise are
+# tried JOB_MAX_ATTEMPTS times in all, waiting JOB_RETRY_DELAY seconds
+# (doubling each time) between attempts.
+JOB_VISIBILITY_TIMEOUT = float(os.environ.get("TODO_JOB_VISIBILITY_TIMEOUT", "300"))
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The default cache is used for the rendered todo fragments (see 
+# todo/cache.py). The local memory cache evicts the least recently used 
+# entries once MAX_ENTRIES is reached.
+# The shared cache is used for sessions and the users of requests (see 
+# accounts/backends.py), and is kept in files so every worker process on the
+# machine reads the same entries. Set TODO_SHARED_CACHE_DIR to change where 
+# (the cache directory of the project by default), and empty it whenever the
+# database is replaced. The entries are pickles, so the directory is only
+# readable and writable by the user running the site (Django creates it that
+# way the first time it is written to, and it shouldn't be somewhere other
+# users can write to, like /tmp). Tests use a temporary directory instead
+# (see TEST_RUNNER).
+
+SHARED_CACHE_DIR = os.environ.get("TODO_SHARED_CACHE_DIR", str(BASE_DIR / "cache"))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': SHARED_CACHE_DIR,
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/5.1/topics/http/sessions/
+# Sessions are read from the shared cache, and only from the database when 
+# they aren't in it. They are still written to both.
+
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+SESSION_CACHE_ALIAS = "shared"
+
+
+# Authentication
+# https://docs.djangoproject.com/en/5.1/topics/auth/customizing/
+# The default backend, with the users of requests cached in the shared cache.
+
+AUTHENTICATION_BACKENDS = ["accounts.backends.CachedModelBackend"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -133,3 +261,11 @@ LOGIN_REDIRECT_URL = "home"
 LOGOUT_REDIRECT_URL = "home"
 
 EMAIL_BACKEND = "django.core.mail.backends.console.EmailBackend"
+
+# Testing
+# https://docs.djangoproject.com/en/5.1/topics/testing/advanced/#defining-a-test-runner
+# The tests keep the shared cache in a temporary directory of their own, so
+# they don't leave sessions behind in (or read them from) the one a
+# development server uses.
+
+TEST_RUNNER = "to_do_app.test_runner.TestRunner"
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+import copy
+import shutil
+import tempfile
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Django's test runner, with the shared cache (see CACHES in settings.py)
+    kept in a temporary directory that is removed once the tests finish.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.sharedCacheDir = tempfile.mkdtemp(prefix="to_do_app_test_cache_")
+        cacheSettings = copy.deepcopy(settings.CACHES)
+        cacheSettings["shared"]["LOCATION"] = self.sharedCacheDir
+        self.cacheOverride = override_settings(CACHES=cacheSettings)
+        self.cacheOverride.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cacheOverride.disable()
+        shutil.rmtree(self.sharedCacheDir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,529 @@
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Q
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_http_methods
+
+import functools
+import json
+
+from .batch import apply_task_batch
+from .cache import get_cache_stats
+from .forms import ToDoForm, TaskForm, ShareForm
+from .models import ToDo, Task, User, SharedWith, AccessLevel, UserStats
+from .ordering import next_position
+from .pagination import get_keyset_page
+from .profiling import get_profile_stats
+from .purge import delete_todo
+from .search import search_todos
+from .transfer import import_records
+from .utils import resolve_todo_access, resolve_task_access, check_write_access, shared_access_subquery
+from . import views
+
+# The fields each resource can be asked for with ?fields=, and the model
+# lookup each one is read from. accessLevel is worked out from the owner and
+# the shared access level rather than read from a column.
+TODO_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "desc": "desc",
+    "owner": "user__username",
+    "position": "position",
+    "dateCreated": "dateCreated",
+    "lastModified": "lastModified",
+    "numOfTasks": "numOfTasks",
+    "numDone": "numDone",
+    "accessLevel": None,
+}
+
+TASK_FIELDS = {
+    "id": "id",
+    "title": "title",
+    "toDo": "belongsTo_id",
+    "createdBy": "createdBy__username",
+    "done": "done",
+    "position": "position",
+    "dateCreated": "dateCreated",
+    "lastModified": "lastModified",
+}
+
+SHARE_FIELDS = {
+    "userId": "user_id",
+    "username": "user__username",
+    "access": "access",
+}
+
+def _error(errorMessage, status):
+    return JsonResponse({"errorMessage": errorMessage.strip()}, status=status)
+
+def _access_error(obj, errorMessage):
+    """
+    Returns the response for a failed access check, 404 if the object doesn't
+    exist and 403 if the user can't access it.
+    """
+    return _error(errorMessage, 404 if obj == None else 403)
+
+def _read_json(request):
+    """
+    Reads the JSON object in the body of a request.
+
+    returns: (data, errorMessage)
+    """
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return (None, "Invalid JSON body.")
+    if not isinstance(data, dict):
+        return (None, "The JSON body must be an object.")
+    return (data, None)
+
+def get_fields(request, allowedFields):
+    """
+    Used to get the fields a client asked for with the comma separated
+    "fields" GET parameter, so that only those columns are fetched and sent.
+
+    Params:
+        - request: HttpRequest
+        - allowedFields: dict mapping field names to model lookups
+
+    returns: (fields, errorMessage)
+        - fields
+            - A list of the field names asked for, all of them if the client
+            didn't ask for any.
+        - errorMessage
+            - A string with the error message if a field doesn't exist.
+            - None otherwise.
+    """
+    fieldsParam = request.GET.get("fields", "")
+    if fieldsParam == "":
+        return (list(allowedFields), None)
+
+    fields = [field.strip() for field in fieldsParam.split(",") if field.strip()]
+    unknownFields = [field for field in fields if field not in allowedFields]
+    if unknownFields:
+        return (None, f"Unknown fields: {', '.join(unknownFields)}.")
+    return (fields, None)
+
+def _get_lookups(fields, allowedFields, requiredLookups=()):
+    """
+    Gets the model lookups needed to read a list of fields.
+    """
+    lookups = list(requiredLookups)
+    for field in fields:
+        lookup = allowedFields[field]
+        if lookup != None and lookup not in lookups:
+            lookups.append(lookup)
+    return lookups
+
+def _get_value(obj, lookup):
+    """
+    Reads a lookup (e.g. "user__username") from a model instance or from a
+    dictionary returned by QuerySet.values.
+    """
+    if isinstance(obj, dict):
+        return obj[lookup]
+    for attribute in lookup.split("__"):
+        obj = getattr(obj, attribute)
+    return obj
+
+def serialize(obj, fields, allowedFields, userId=None):
+    """
+    Used to turn a model instance or values dictionary into the JSON for a
+    resource, with only the fields asked for.
+    """
+    data = {}
+    for field in fields:
+        if field == "accessLevel":
+            isOwner = _get_value(obj, "user_id") == userId
+            data[field] = AccessLevel.WRITE if isOwner else _get_value(obj, "sharedAccess")
+        else:
+            data[field] = _get_value(obj, allowedFields[field])
+    return data
+
+def _get_id_list(request):
+    """
+    Gets the comma separated "ids" GET parameter, used to fetch many
+    resources with one request.
+
+    returns: (ids, errorMessage), ids is None if none were given.
+    """
+    idsParam = request.GET.get("ids", "")
+    if idsParam == "":
+        return (None, None)
+    try:
+        return ([int(id) for id in idsParam.split(",")], None)
+    except ValueError:
+        return (None, f"Invalid ids {idsParam}.")
+
+def api_login_required(view):
+    """
+    Decorator returning a 401 JSON response to users that aren't logged in,
+    rather than redirecting them to the login page.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _error("You need to be logged in to use the API.", 401)
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+@api_login_required
+@require_http_methods(["GET", "POST"])
+def todos(request):
+    """
+    GET: lists the todos the user owns or has shared with them, a page at a
+    time (see pagination.py), optionally only those in ?ids=.
+    POST: creates a todo from {"title": str, "desc": str}.
+    """
+    id = request.user.id
+
+    if request.method == "POST":
+        data, errorMessage = _read_json(request)
+        if errorMessage != None:
+            return _error(errorMessage, 400)
+
+        form = ToDoForm(data)
+        if not form.is_valid():
+            return JsonResponse({"errors": form.errors}, status=400)
+
+        title = form.cleaned_data["title"]
+        desc = form.cleaned_data["desc"]
+        toDo = ToDo(title=title, desc=desc, position=next_position(ToDo.objects.filter(user=id)),
+            user=request.user)
+        # The database makes sure the user doesn't have an identical ToDo.
+        try:
+            with transaction.atomic():
+                toDo.save()
+        except IntegrityError:
+            return _error("You already have a TODO with this title and description.", 409)
+        return JsonResponse(serialize(toDo, TODO_FIELDS, TODO_FIELDS, id), status=201)
+
+    fields, errorMessage = get_fields(request, TODO_FIELDS)
+    ids, idsErrorMessage = _get_id_list(request)
+    errorMessage = errorMessage or idsErrorMessage
+    if errorMessage != None:
+        return _error(errorMessage, 400)
+
+    toDos = ToDo.objects.filter(Q(user=id) | Q(sharedwith__user=id)).distinct()
+    if ids != None:
+        toDos = toDos.filter(id__in=ids)
+
+    # Only fetching the columns asked for (plus the sort key for the cursor).
+    requiredLookups = ["id", "position"]
+    if "accessLevel" in fields:
+        toDos = toDos.annotate(sharedAccess=shared_access_subquery(id, OuterRef("pk")))
+        requiredLookups += ["user_id", "sharedAccess"]
+    toDos = toDos.values(*_get_lookups(fields, TODO_FIELDS, requiredLookups))
+
+    toDos, nextPageQuery, errorMessage = get_keyset_page(toDos, request)
+    if errorMessage != None:
+        return _error(errorMessage, 400)
+
+    return JsonResponse({
+        "results": [serialize(toDo, fields, TODO_FIELDS, id) for toDo in toDos],
+        "next": nextPageQuery,
+    })
+
+@api_login_required
+@require_http_methods(["GET", "PATCH", "DELETE"])
+def todo(request, toDoId):
+    """
+    GET: a todo the user can access.
+    PATCH: changes the title and/or desc of a todo, needs write access.
+    DELETE: removes a todo and all of its tasks, needs write access.
+    """
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
+    if errorMessage != None:
+        return _access_error(toDo, errorMessage)
+
+    if request.method == "GET":
+        fields, errorMessage = get_fields(request, TODO_FIELDS)
+        if errorMessage != None:
+            return _error(errorMessage, 400)
+        return JsonResponse(serialize(toDo, fields, TODO_FIELDS, request.user.id))
+
+    errorMessage = check_write_access(accessLevel)
+    if errorMessage != None:
+        return _error(errorMessage, 403)
+
+    if request.method == "DELETE":
+        delete_todo(toDo)
+        return HttpResponse(status=204)
+
+    data, errorMessage = _read_json(request)
+    if errorMessage != None:
+        return _error(errorMessage, 400)
+
+    form = ToDoForm({"title": data.get("title", toDo.title), "desc": data.get("desc", toDo.desc)})
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+
+    toDo.title = form.cleaned_data["title"]
+    toDo.desc = form.cleaned_data["desc"]
+    try:
+        with transaction.atomic():
+            toDo.save()
+    except IntegrityError:
+        return _error("You already have a TODO with this title and description.", 409)
+    return JsonResponse(serialize(toDo, TODO_FIELDS, TODO_FIELDS, request.user.id))
+
+@api_login_required
+@require_http_methods(["GET", "POST"])
+def todo_tasks(request, toDoId):
+    """
+    GET: lists the tasks of a todo, a page at a time.
+    POST: adds tasks to a todo, needs write access. Takes {"title": str} for
+    one task or {"tasks": [{"title": str}, ...]} to add many at once.
+    """
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
+    if errorMessage != None:
+        return _access_error(toDo, errorMessage)
+
+    if request.method == "POST":
+        errorMessage = check_write_access(accessLevel)
+        if errorMessage != None:
+            return _error(errorMessage, 403)
+
+        data, errorMessage = _read_json(request)
+        if errorMessage != None:
+            return _error(errorMessage, 400)
+
+        newTasks = data.get("tasks", [{"title": data.get("title")}])
+        if not isinstance(newTasks, list) or not all(isinstance(task, dict) for task in newTasks):
+            return _error("tasks must be a list of objects.", 400)
+        for task in newTasks:
+            form = TaskForm({"title": task.get("title")})
+            if not form.is_valid():
+                return JsonResponse({"errors": form.errors}, status=400)
+
+        # Adding all of the tasks at once, with the same bookkeeping as the
+        # batch endpoint.
+        operations = [{"op": "add", "title": task["title"]} for task in newTasks]
+        result, errorMessage = apply_task_batch(toDo, request.user, operations)
+        if errorMessage != None:
+            return _error(errorMessage, 409)
+
+        tasks = Task.objects.filter(id__in=result["added"]).order_by("position", "id")
+        tasks = tasks.values(*_get_lookups(TASK_FIELDS, TASK_FIELDS))
+        return JsonResponse({
+            "results": [serialize(task, TASK_FIELDS, TASK_FIELDS) for task in tasks],
+        }, status=201)
+
+    fields, errorMessage = get_fields(request, TASK_FIELDS)
+    if errorMessage != None:
+        return _error(errorMessage, 400)
+
+    tasks = Task.objects.filter(belongsTo=toDoId)
+    tasks = tasks.values(*_get_lookups(fields, TASK_FIELDS, ["id", "position"]))
+    tasks, nextPageQuery, errorMessage = get_keyset_page(tasks, request)
+    if errorMessage != None:
+        return _error(errorMessage, 400)
+
+    return JsonResponse({
+        "results": [serialize(task, fields, TASK_FIELDS) for task in tasks],
+        "next": nextPageQuery,
+    })
+
+@api_login_required
+@require_http_methods(["POST"])
+def todo_tasks_batch(request, toDoId):
+    """
+    POST: applies a list of task operations to a todo (see
+    views.batch_tasks).
+    """
+    return views.batch_tasks(request, toDoId)
+
+@api_login_required
+@require_http_methods(["GET", "PATCH", "DELETE"])
+def task(request, taskId):
+    """
+    GET: a task the user can access.
+    PATCH: changes the title (needs write access) and/or done (needs access to
+    the todo, like completing a task) of a task.
+    DELETE: removes a task, needs write access.
+    """
+    task, isOwner, accessLevel, errorMessage = resolve_task_access(request, taskId)
+    if errorMessage != None:
+        return _access_error(task, errorMessage)
+
+    if request.method == "GET":
+        fields, errorMessage = get_fields(request, TASK_FIELDS)
+        if errorMessage != None:
+            return _error(errorMessage, 400)
+        return JsonResponse(serialize(task, fields, TASK_FIELDS))
+
+    if request.method == "DELETE":
+        errorMessage = check_write_access(accessLevel)
+        if errorMessage != None:
+            return _error(errorMessage, 403)
+        task.delete()
+        return HttpResponse(status=204)
+
+    data, errorMessage = _read_json(request)
+    if errorMessage != None:
+        return _error(errorMessage, 400)
+
+    if "title" in data:
+        errorMessage = check_write_access(accessLevel)
+        if errorMessage != None:
+            return _error(errorMessage, 403)
+
+        form = TaskForm({"title": data["title"]})
+        if not form.is_valid():
+            return JsonResponse({"errors": form.errors}, status=400)
+        task.title = form.cleaned_data["title"]
+
+    if "done" in data:
+        if not isinstance(data["done"], bool):
+            return _error("done must be true or false.", 400)
+        task.done = data["done"]
+
+    try:
+        with transaction.atomic():
+            task.save()
+    except IntegrityError:
+        return _error("You already have a Task with this title.", 409)
+    return JsonResponse(serialize(task, TASK_FIELDS, TASK_FIELDS))
+
+@api_login_required
+@require_http_methods(["GET", "POST"])
+def todo_shares(request, toDoId):
+    """
+    GET: lists the users a todo is shared with, only for its owner.
+    POST: shares a todo with {"username": str, "access": "R" or "W"}.
+    """
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
+    if errorMessage != None:
+        return _access_error(toDo, errorMessage)
+
+    if request.method == "GET":
+        if not isOwner:
+            return _error("Only the owner of a ToDo can see who it is shared with.", 403)
+
+        fields, errorMessage = get_fields(request, SHARE_FIELDS)
+        if errorMessage != None:
+            return _error(errorMessage, 400)
+
+        shares = SharedWith.objects.filter(todo=toDo).order_by("id")
+        shares = shares.values(*_get_lookups(fields, SHARE_FIELDS))
+        return JsonResponse({
+            "results": [serialize(share, fields, SHARE_FIELDS) for share in shares],
+        })
+
+    data, errorMessage = _read_json(request)
+    if errorMessage != None:
+        return _error(errorMessage, 400)
+
+    form = ShareForm(data)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors}, status=400)
+
+    shareUsername = form.cleaned_data["username"]
+    # Make sure the user isn't trying to share the todo with themself.
+    if shareUsername == toDo.user.username:
+        return _error("You cannot share a ToDo with yourself", 400)
+
+    try:
+        shareUser = User.objects.get(username=shareUsername)
+    except User.DoesNotExist:
+        return _error(f"There is no user with username {shareUsername}", 404)
+
+    sharedWith = SharedWith(user=shareUser, todo=toDo, access=form.cleaned_data["access"])
+    try:
+        with transaction.atomic():
+            sharedWith.save()
+    except IntegrityError:
+        return _error(f"This todo has already been shared with {shareUsername}", 409)
+    return JsonResponse(serialize(sharedWith, SHARE_FIELDS, SHARE_FIELDS), status=201)
+
+@api_login_required
+@require_http_methods(["GET"])
+def search(request):
+    """
+    GET: the todos and tasks the user can see matching ?q=, best matches 
+    first.
+    """
+    results, nextPageQuery, errorMessage = search_todos(request.user.id,
+        request.GET.get("q", ""), request)
+    if errorMessage != None:
+        return _error(errorMessage, 400)
+
+    return JsonResponse({
+        "results": results,
+        "next": nextPageQuery,
+    })
+
+@api_login_required
+@require_http_methods(["GET"])
+def export(request):
+    """
+    GET: streams an export of the users todos, tasks and shares as 
+    ?format=ndjson (the default) or csv (see views.export_todos).
+    """
+    return views.export_todos(request)
+
+@api_login_required
+@require_http_methods(["POST"])
+def import_(request):
+    """
+    POST: imports an export (the body of the request, read a line at a time)
+    as new todos, ?format=ndjson (the default) or csv.
+    """
+    result, errorMessage = import_records(request.user, request,
+        request.GET.get("format", "ndjson"))
+    if errorMessage != None:
+        return _error(errorMessage, 400)
+
+    return JsonResponse(result, status=201)
+
+@api_login_required
+@require_http_methods(["GET"])
+def stats(request):
+    """
+    GET: how many todos the user owns, and how many tasks (and done tasks)
+    they have, read from their UserStats rather than counted.
+    """
+    stats = (UserStats.objects
+        .filter(user=request.user.id)
+        .values("numOfToDos", "numOfTasks", "numDone")
+        .first())
+    if stats == None:
+        return _error("There are no stats for this user.", 404)
+    return JsonResponse(stats)
+
+@api_login_required
+@require_http_methods(["GET"])
+def cache_stats(request):
+    """
+    GET: the fragment cache hit/miss counters of this process, staff only.
+    """
+    if not request.user.is_staff:
+        return _error("Only staff can see the cache stats.", 403)
+    return JsonResponse(get_cache_stats())
+
+@api_login_required
+@require_http_methods(["GET"])
+def profile_stats(request):
+    """
+    GET: the timings of the profiled requests of this process by URL name
+    (see profiling.py), staff only.
+    """
+    if not request.user.is_staff:
+        return _error("Only staff can see the profile stats.", 403)
+    return JsonResponse(get_profile_stats())
+
+@api_login_required
+@require_http_methods(["DELETE"])
+def todo_share(request, toDoId, sharedUserId):
+    """
+    DELETE: unshares a todo with a user.
+    """
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
+    if errorMessage != None:
+        return _access_error(toDo, errorMessage)
+
+    numDeleted, _ = SharedWith.objects.filter(user=sharedUserId, todo=toDoId).delete()
+    if numDeleted == 0:
+        return _error("The todo specified is not shared with the user", 404)
+
+    return HttpResponse(status=204)
@@ -0,0 +1,20 @@
+from django.urls import path
+
+from . import api
+
+# Version 1 of the JSON API, included under api/v1/ by urls.py.
+urlpatterns = [
+    path("todos", api.todos, name="api_todos"),
+    path("todos/<int:toDoId>", api.todo, name="api_todo"),
+    path("todos/<int:toDoId>/tasks", api.todo_tasks, name="api_todo_tasks"),
+    path("todos/<int:toDoId>/tasks/batch", api.todo_tasks_batch, name="api_todo_tasks_batch"),
+    path("todos/<int:toDoId>/shares", api.todo_shares, name="api_todo_shares"),
+    path("todos/<int:toDoId>/shares/<int:sharedUserId>", api.todo_share, name="api_todo_share"),
+    path("tasks/<int:taskId>", api.task, name="api_task"),
+    path("search", api.search, name="api_search"),
+    path("export", api.export, name="api_export"),
+    path("import", api.import_, name="api_import"),
+    path("stats", api.stats, name="api_stats"),
+    path("cache_stats", api.cache_stats, name="api_cache_stats"),
+    path("profile_stats", api.profile_stats, name="api_profile_stats"),
+]
@@ -4,3 +4,23 @@ from django.apps import AppConfig
 class TodoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'todo'
+
+    def ready(self):
+        # Connecting the signal receivers.
+        from . import signals
+
+        # Setting the SQLite pragmas of the database profile on new 
+        # connections.
+        from django.db.backends.signals import connection_created
+        from .sqlite import configure_connection
+        connection_created.connect(configure_connection, 
+            dispatch_uid="todo.sqlite.configure_connection")
+
+        # Counting the queries of requests for the metrics, on the 
+        # connections of every thread (including the ones the async ORM 
+        # runs in).
+        from django.conf import settings
+        from .metrics import install_query_counter
+        if settings.METRICS_ENABLED:
+            connection_created.connect(install_query_counter,
+                dispatch_uid="todo.metrics.install_query_counter")
@@ -0,0 +1,220 @@
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import aprefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+
+import asyncio
+import datetime
+import functools
+
+from .cache import aget_cached_fragments
+from .conditional import (async_condition, aget_home_metadata, aget_todo_metadata,
+    home_etag, todo_etag)
+from .events import format_event, hub
+from .forms import TaskForm
+from .models import ToDo, Task
+from .ordering import anext_position
+from .pagination import aget_keyset_page
+from .utils import aresolve_todo_access, aresolve_task_access
+from .views import (DUPLICATE_TASK_MESSAGE, gen_home_todos, gen_shares_prefetch,
+    set_shared_access)
+from .writer import arun_write
+
+# Async versions of the busiest views in views.py, used instead of them when
+# ASYNC_VIEWS is on (see settings.py and urls.py). Under ASGI these run on
+# the event loop and use the async ORM, rather than each request being handed
+# to a thread by Django's sync adapter. Writes still go through Task.save
+# (which needs a transaction) in a thread, or the write queue (see writer.py).
+#
+# todo_events is always async, as it holds a connection open for as long as
+# the page is.
+
+# How often comments are sent down idle event streams, so that proxies don't
+# close them.
+HEARTBEAT_SECONDS = 15
+
+def load_user(view):
+    """
+    Loads the user of a request with the async ORM before calling the view, so
+    that nothing after it (like the templates) loads it synchronously.
+    """
+    @functools.wraps(view)
+    async def inner(request, *args, **kwargs):
+        request.user = await request.auser()
+        return await view(request, *args, **kwargs)
+
+    return inner
+
+# Unchanged pages are answered with a 304 (see conditional.py).
+@load_user
+@async_condition(aget_home_metadata, home_etag)
+async def home(request):
+    id = request.user.id
+
+    # Getting a page of the ToDos that belong to this user or are shared with
+    # them, along with their owners and the users access level to each.
+    toDos, nextPageQuery, errorMessage = await aget_keyset_page(gen_home_todos(id), request)
+    set_shared_access(toDos)
+
+    async def gen_card_context(missedToDos):
+        # Who each todo is shared with, for all of the cards that need
+        # rendering at once.
+        await aprefetch_related_objects(missedToDos, gen_shares_prefetch())
+        ToDo.genShareDetails(missedToDos, id)
+
+        return lambda toDo: {"toDo": toDo, "user": request.user}
+
+    # Only rendering the cards of todos that aren't already cached.
+    cards = await aget_cached_fragments(toDos, id, "card", "todo_card.html", gen_card_context)
+    context = {
+        # The users totals come with the metadata of the page.
+        "stats": await aget_home_metadata(request),
+        "cards": cards,
+        "nextPageQuery": nextPageQuery,
+        "errorMessage": errorMessage,
+    }
+
+    return render(request, "home.html", context)
+
+@load_user
+@async_condition(aget_todo_metadata, todo_etag)
+async def view_todo(request, toDoId):
+    id = request.user.id
+
+    # Checking that the user has access to view this todo.
+    toDo, isOwner, accessLevel, errorMessage = await aresolve_todo_access(request, toDoId)
+    taskList = None
+    if errorMessage == None:
+        async def gen_task_list_context(missedToDos):
+            # Getting a page of the todos tasks.
+            tasks = Task.objects.filter(belongsTo=toDoId).select_related("createdBy")
+            tasks, nextPageQuery, pageErrorMessage = await aget_keyset_page(tasks, request)
+
+            return lambda toDo: {
+                "errorMessage": pageErrorMessage,
+                "toDo": toDo,
+                "tasks": tasks,
+                "nextPageQuery": nextPageQuery,
+                "after": request.GET.get("after"),
+            }
+
+        # Only rendering the page of tasks if it isn't already cached.
+        taskList, = await aget_cached_fragments([toDo], id, "tasks", "task_list.html",
+            gen_task_list_context, extra=request.GET.urlencode())
+
+    context = {
+        "errorMessage": errorMessage,
+        "toDo": toDo,
+        "taskList": taskList,
+        "liveEvents": settings.LIVE_EVENTS_ENABLED,
+    }
+
+    return render(request, "view_todo.html", context)
+
+@load_user
+async def add_task(request, toDoId):
+    form = None
+
+    # Checking that the user has access to add to this todo.
+    toDo, isOwner, accessLevel, errorMessage = await aresolve_todo_access(request, toDoId)
+    if errorMessage == None:
+        # If this is a POST request, process the form data
+        if request.method == "POST":
+            form = TaskForm(request.POST)
+
+            if form.is_valid():
+                title = form.cleaned_data["title"]
+
+                # Add the task to the database, the database makes sure
+                # there isn't an identical task in this todo already.
+                position = await anext_position(Task.objects.filter(belongsTo=toDoId))
+                task = Task(title=title, position=position,
+                    lastModified=datetime.datetime.now(), belongsTo=toDo,
+                    createdBy=request.user)
+                try:
+                    await arun_write(task.save)
+
+                    # Redirect back to view todo page.
+                    return redirect(f"/view_todo/{toDoId}")
+
+                # Otherwise let the user know what the problem is.
+                except IntegrityError:
+                    errorMessage = DUPLICATE_TASK_MESSAGE
+
+        # If a GET (or any other method) create a blank form.
+        else:
+            form = TaskForm()
+
+    context = {
+        "form": form,
+        "toDo": toDo,
+        "errorMessage": errorMessage,
+    }
+
+    return render(request, "add_task.html", context)
+
+@load_user
+async def complete_task(request, toDoId, taskId):
+    # Checking that the user has access to complete this task.
+    task, isOwner, accessLevel, errorMessage = await aresolve_task_access(request, taskId)
+    if errorMessage == None:
+        # Toggling the task as done/not done.
+        await arun_write(task.toggleDone)
+
+    return redirect(f"/view_todo/{toDoId}")
+
+@load_user
+async def todo_events(request, toDoId):
+    """
+    Streams changes to the tasks of a todo as Server-Sent Events (see 
+    events.py), until the user loses access to it. Only works through 
+    asgi.py, under wsgi.py the response would never finish, so it is a 404
+    unless LIVE_EVENTS_ENABLED is set.
+    """
+    if not settings.LIVE_EVENTS_ENABLED:
+        return HttpResponse("Live updates are turned off.", status=404, content_type="text/plain")
+
+    toDo, isOwner, accessLevel, errorMessage = await aresolve_todo_access(request, toDoId)
+    if errorMessage != None:
+        status = 404 if toDo == None else 403
+        return HttpResponse(errorMessage.strip(), status=status, content_type="text/plain")
+
+    userId = request.user.id
+
+    async def stream():
+        subscriber = hub.subscribe(toDoId, userId)
+        try:
+            # How long the browser waits before reconnecting.
+            yield "retry: 3000\n\n"
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+
+                # Only changes to how this user can access the todo matter
+                # to the page, and stop the stream if they lose access.
+                if event["type"] == "share":
+                    if event["userId"] != userId:
+                        continue
+                    if event["action"] == "deleted":
+                        event = {"type": "revoked"}
+                    else:
+                        event = {"type": "reload"}
+                elif event["type"] == "todo":
+                    event = {"type": "revoked"}
+
+                yield format_event(event)
+                if event["type"] == "revoked":
+                    return
+        finally:
+            hub.unsubscribe(subscriber)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Stopping proxies (like nginx) from buffering the events.
+    response["X-Accel-Buffering"] = "no"
+    return response
@@ -0,0 +1,239 @@
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .cache import invalidate_todo
+from .events import gen_task_event, publish
+from .forms import TaskForm
+from .metrics import count_writes
+from .models import Task, ToDo
+from .ordering import POSITION_GAP, next_position
+
+# The operations that can be applied to the tasks of a todo in a batch, and
+# whether they need write access to the todo (completing a task only needs
+# access to the todo, like the complete_task view).
+BATCH_OPERATIONS = {
+    "add": True,
+    "complete": False,
+    "remove": True,
+    "retitle": True,
+}
+
+MAX_BATCH_SIZE = 500
+
+def _validate_title(title):
+    """
+    Validates a task title the same way the add/edit task forms do.
+
+    returns: errorMessage, None if the title is valid.
+    """
+    form = TaskForm({"title": title})
+    if not form.is_valid():
+        return f"Invalid task title {title!r}."
+    return None
+
+def parse_task_batch(operations):
+    """
+    Used to validate a list of task operations before applying them with 
+    apply_task_batch.
+
+    Each operation is a dictionary with an "op" key, one of:
+        - {"op": "add", "title": str}
+        - {"op": "complete", "id": int, "done": bool (optional, toggles if
+        missing)}
+        - {"op": "remove", "id": int}
+        - {"op": "retitle", "id": int, "title": str}
+
+    Params:
+        - operations: list of dict
+
+    returns: (operations, errorMessage)
+        - operations
+            - The validated list of operations.
+        - errorMessage
+            - A string with the error message if the batch is invalid.
+            - None otherwise.
+    """
+    if not isinstance(operations, list) or len(operations) == 0:
+        return (None, "A batch must be a non-empty list of operations.")
+    if len(operations) > MAX_BATCH_SIZE:
+        return (None, f"A batch can have at most {MAX_BATCH_SIZE} operations.")
+
+    removedIds = set()
+    changedIds = set()
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get("op") not in BATCH_OPERATIONS:
+            return (None, f"Invalid operation {operation!r}.")
+
+        op = operation["op"]
+        if op in ("add", "retitle"):
+            errorMessage = _validate_title(operation.get("title"))
+            if errorMessage != None:
+                return (None, errorMessage)
+
+        if op != "add":
+            taskId = operation.get("id")
+            if not isinstance(taskId, int) or isinstance(taskId, bool):
+                return (None, f"Invalid task id in operation {operation!r}.")
+            if op == "complete" and not isinstance(operation.get("done", False), bool):
+                return (None, f"Invalid done value in operation {operation!r}.")
+
+            if op == "remove":
+                removedIds.add(taskId)
+            else:
+                changedIds.add(taskId)
+
+    if removedIds & changedIds:
+        return (None, "A task cannot be removed and changed in the same batch.")
+
+    return (operations, None)
+
+def batch_needs_write(operations):
+    """
+    Returns whether a list of validated task operations needs write access to
+    the todo to be applied.
+    """
+    return any(BATCH_OPERATIONS[operation["op"]] for operation in operations)
+
+def apply_task_batch(toDo, user, operations):
+    """
+    Used to apply a list of validated task operations (see parse_task_batch)
+    to a todo in a single transaction. New tasks are inserted with one 
+    bulk_create, changed tasks are saved with one bulk_update and removed
+    tasks are deleted with filtered deletes, and the numOfTasks, numDone and
+    lastModified of the todo are updated once for the whole batch rather than
+    once per task (like Task.save/Task.delete do).
+
+    Params:
+        - toDo: models.ToDo
+        - user: User making the changes
+        - operations: list of dict
+
+    returns: (result, errorMessage)
+        - result
+            - A dictionary with the ids of the added tasks, the number of
+            tasks completed/uncompleted, removed and retitled, and the new 
+            number of tasks (and done tasks) in the todo.
+            - None if the batch could not be applied.
+        - errorMessage
+            - A string with the error message if the batch could not be 
+            applied.
+            - None otherwise.
+    """
+    now = timezone.now()
+    newTitles = [operation["title"] for operation in operations if operation["op"] == "add"]
+    taskIds = {operation["id"] for operation in operations if operation["op"] != "add"}
+
+    # Check that no two added tasks share a title.
+    if len(newTitles) != len(set(newTitles)):
+        return (None, "You cannot add two Tasks with the same title.")
+
+    try:
+        result, errorMessage = _write_task_batch(toDo, user, operations, taskIds, now)
+    # The database makes sure no two tasks in a todo share a title, if one 
+    # does then none of the batch is applied.
+    except IntegrityError:
+        return (None, "You already have a Task with one of these titles.")
+    if errorMessage != None:
+        return (None, errorMessage)
+
+    # The bulk queries don't send the signals that keep the cache up to date.
+    invalidate_todo(toDo.id)
+    count_writes("task", "added", len(result["added"]))
+    count_writes("task", "changed", result["completed"] + result["retitled"])
+    count_writes("task", "deleted", result["removed"])
+
+    return (result, None)
+
+def _write_task_batch(toDo, user, operations, taskIds, now):
+    """
+    Makes the writes for apply_task_batch in a single transaction, which is 
+    rolled back if any of them fail.
+
+    returns: (result, errorMessage), as for apply_task_batch.
+    """
+    with transaction.atomic():
+        # Fetching every task the batch refers to at once, in the transaction
+        # so the batch works from their current done and title.
+        tasks = Task.objects.filter(belongsTo=toDo, id__in=taskIds).in_bulk()
+        missingIds = taskIds - tasks.keys()
+        if missingIds:
+            return (None, f"There is no Task with id {min(missingIds)} in this ToDo.")
+
+        position = next_position(Task.objects.filter(belongsTo=toDo))
+        newTasks = []
+        changedTasks = {}
+        retitledIds = set()
+        removedIds = []
+        numCompleted = 0
+        numRetitled = 0
+
+        for operation in operations:
+            op = operation["op"]
+
+            if op == "add":
+                newTasks.append(Task(title=operation["title"], position=position,
+                    lastModified=now, belongsTo=toDo, createdBy=user))
+                position += POSITION_GAP
+            elif op == "remove":
+                removedIds.append(operation["id"])
+            else:
+                task = tasks[operation["id"]]
+                if op == "complete":
+                    task.done = operation.get("done", not task.done)
+                    numCompleted += 1
+                else:
+                    task.title = operation["title"]
+                    retitledIds.add(task.id)
+                    numRetitled += 1
+                task.lastModified = now
+                changedTasks[task.id] = task
+
+        # Removing tasks first, so their titles can be reused by the batch
+        # (the done ones separately, to know how many there were).
+        removedTasks = Task.objects.filter(belongsTo=toDo, id__in=removedIds)
+        numRemovedDone, _ = removedTasks.filter(done=True).delete()
+        numRemovedNotDone, _ = removedTasks.delete()
+        numRemoved = numRemovedDone + numRemovedNotDone
+
+        # Marking tasks (un)done with a compare-and-set like Task.save, so
+        # only the tasks this batch changes are counted.
+        numDone = -numRemovedDone
+        for done in (True, False):
+            changedIds = [task.id for task in changedTasks.values() if task.done == done]
+            numChanged = (Task.objects
+                .filter(id__in=changedIds, done=not done)
+                .update(done=done, lastModified=now))
+            numDone += numChanged if done else -numChanged
+
+        # Only writing the titles of retitled tasks, so completing a task
+        # doesn't undo someone else retitling it.
+        Task.objects.bulk_update([changedTasks[taskId] for taskId in retitledIds],
+            ["title", "lastModified"])
+        Task.objects.filter(id__in=changedTasks.keys() - retitledIds).update(lastModified=now)
+        Task.objects.bulk_create(newTasks)
+
+        # Updating the todo once for the whole batch.
+        ToDo.updateCounts(toDo.id, numOfTasks=len(newTasks) - numRemoved, numDone=numDone,
+            lastModified=now)
+        numOfTasks, numDone = (ToDo.objects
+            .values_list("numOfTasks", "numDone")
+            .get(id=toDo.id))
+
+        # Letting anyone viewing the todo know once the batch is committed.
+        for taskId in removedIds:
+            publish(toDo.id, {"type": "task", "action": "deleted", "id": taskId})
+        removedIdSet = set(removedIds)
+        for task in changedTasks.values():
+            if task.id not in removedIdSet:
+                publish(toDo.id, gen_task_event(task, "changed"))
+        for task in newTasks:
+            publish(toDo.id, gen_task_event(task, "added"))
+
+    return ({
+        "added": [task.id for task in newTasks],
+        "completed": numCompleted,
+        "removed": numRemoved,
+        "retitled": numRetitled,
+        "numOfTasks": numOfTasks,
+        "numDone": numDone,
+    }, None)
@@ -0,0 +1,155 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+import uuid
+
+from . import metrics
+
+# Rendered fragments of todos (their cards on the home page and their task
+# lists on the view_todo page) are kept in the configured cache (see CACHES
+# in settings.py, which bounds its size and how long fragments are kept).
+#
+# Fragment keys include the todo id, its lastModified and position, how the
+# viewer can access it, a digest of who it is shared with (for todos fetched
+# with a shareDigest, see views.gen_home_todos) and a "generation" token for
+# the todo. Anything that changes a todo without changing those calls
+# invalidate_todo (see signals.py), which throws away the generation so every
+# fragment of that todo is missed from then on. Generations are kept in the
+# default cache, which is per process, so the rest of the key is what other
+# processes see changes by (a share changing in one process changes the
+# digest fetched by every process).
+
+CACHE_STATS = ["hits", "misses", "invalidations"]
+
+def _count(stat, amount=1):
+    # Counted with the other metrics (see metrics.py), without a lock.
+    if amount:
+        metrics.inc(f"todo_fragment_cache_{stat}_total", (), amount)
+
+def get_cache_stats():
+    """
+    Returns the number of fragment cache hits, misses and invalidations in
+    this process.
+    """
+    return {stat: metrics.get_value(f"todo_fragment_cache_{stat}_total") for stat in CACHE_STATS}
+
+def _generation_key(toDoId):
+    return f"todo:{toDoId}:generation"
+
+def invalidate_todo(toDoId):
+    """
+    Call whenever a todo, its tasks or who it is shared with change, to stop
+    any cached fragments of it from being used.
+    """
+    cache.delete(_generation_key(toDoId))
+    _count("invalidations")
+
+def _gen_new_generations(keys, generations):
+    """
+    Starts a new generation for any todos that don't have one.
+    """
+    return {key: uuid.uuid4().hex for key in keys.values() if key not in generations}
+
+def _get_generations(toDoIds):
+    """
+    Gets the current generation of each todo, starting a new one for any
+    todos that don't have one.
+    """
+    keys = {toDoId: _generation_key(toDoId) for toDoId in toDoIds}
+    generations = cache.get_many(keys.values())
+
+    newGenerations = _gen_new_generations(keys, generations)
+    cache.set_many(newGenerations)
+    generations.update(newGenerations)
+
+    return {toDoId: generations[key] for toDoId, key in keys.items()}
+
+async def _aget_generations(toDoIds):
+    """
+    Async version of _get_generations.
+    """
+    keys = {toDoId: _generation_key(toDoId) for toDoId in toDoIds}
+    generations = await cache.aget_many(keys.values())
+
+    newGenerations = _gen_new_generations(keys, generations)
+    await cache.aset_many(newGenerations)
+    generations.update(newGenerations)
+
+    return {toDoId: generations[key] for toDoId, key in keys.items()}
+
+def _fragment_key(toDo, generation, fragment, viewerId, extra):
+    isOwner = toDo.user_id == viewerId
+    shareDigest = getattr(toDo, "shareDigest", "")
+    return (f"todo:{toDo.id}:{fragment}:{generation}:{toDo.lastModified.timestamp()}"
+        f":{toDo.position}:{int(isOwner)}:{toDo.accessLevel}:{shareDigest}:{extra}")
+
+def get_cached_fragments(toDos, viewerId, fragment, template, gen_context, extra=""):
+    """
+    Used to get the rendered fragments for a list of todos, only rendering
+    those that aren't already cached. Fragments are shared between viewers
+    with the same access to a todo (whether they own it, and their
+    accessLevel, which must already be set on each todo).
+
+    Params:
+        - toDos: list of models.ToDo
+        - viewerId: int, the id of the user viewing the todos
+        - fragment: str, the name of the fragment (e.g. "card")
+        - template: str, the template the fragment is rendered from
+        - gen_context: function called with the list of todos that missed the
+        cache (to load anything else they need in bulk), returning a function
+        that makes the template context for one of them
+        - extra: str, anything else the fragment depends on (e.g. the page)
+
+    returns: list of str, the rendered fragment for each todo.
+    """
+    generations = _get_generations([toDo.id for toDo in toDos])
+    keys = [_fragment_key(toDo, generations[toDo.id], fragment, viewerId, extra)
+        for toDo in toDos]
+    fragments = cache.get_many(keys)
+
+    missedToDos = _get_missed_todos(toDos, keys, fragments)
+    if missedToDos:
+        newFragments = _render_fragments(toDos, keys, fragments, template, 
+            gen_context(missedToDos))
+        cache.set_many(newFragments)
+        fragments.update(newFragments)
+
+    return [mark_safe(fragments[key]) for key in keys]
+
+async def aget_cached_fragments(toDos, viewerId, fragment, template, agen_context, extra=""):
+    """
+    Async version of get_cached_fragments, where agen_context is an async 
+    function (so it can load what the missed todos need with the async ORM).
+    """
+    generations = await _aget_generations([toDo.id for toDo in toDos])
+    keys = [_fragment_key(toDo, generations[toDo.id], fragment, viewerId, extra)
+        for toDo in toDos]
+    fragments = await cache.aget_many(keys)
+
+    missedToDos = _get_missed_todos(toDos, keys, fragments)
+    if missedToDos:
+        newFragments = _render_fragments(toDos, keys, fragments, template, 
+            await agen_context(missedToDos))
+        await cache.aset_many(newFragments)
+        fragments.update(newFragments)
+
+    return [mark_safe(fragments[key]) for key in keys]
+
+def _get_missed_todos(toDos, keys, fragments):
+    missedToDos = [toDo for toDo, key in zip(toDos, keys) if key not in fragments]
+    _count("hits", len(toDos) - len(missedToDos))
+    _count("misses", len(missedToDos))
+    return missedToDos
+
+def _render_fragments(toDos, keys, fragments, template, gen_todo_context):
+    """
+    Renders the fragments of the todos that missed the cache.
+
+    returns: dict, the new fragments by their key.
+    """
+    newFragments = {}
+    for toDo, key in zip(toDos, keys):
+        if key not in fragments:
+            newFragments[key] = render_to_string(template, gen_todo_context(toDo))
+    return newFragments
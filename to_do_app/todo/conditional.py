@@ -0,0 +1,228 @@
+from django.conf import settings
+from django.views.decorators.http import condition
+from django.db.models import CharField, F, Func, IntegerField, OuterRef, Q, Subquery, Value, Case, When
+from django.db.models.functions import Cast, Coalesce, Concat
+
+import functools
+import hashlib
+
+from .models import ToDo, SharedWith, AccessLevel, User
+from .utils import shared_access_subquery
+
+# Conditional GET support for home and view_todo (used with Django's
+# condition decorator). The ETag of a page is built from a small amount of
+# metadata fetched in one query (the lastModified of the todos, which is
+# bumped whenever a task changes, the share set and the users access level),
+# so an unchanged page can be answered with a 304 without loading any tasks
+# or rendering the template.
+#
+# The pages have no Last-Modified, only the ETag. Last-Modified only goes
+# down to the second, and not everything on a page bumps a lastModified
+# (like the users access level changing, or the newest todo on the home page
+# being moved or deleted), so a client only sending If-Modified-Since would
+# be told a changed page hadn't changed.
+
+def _aggregate(function, expression):
+    """
+    An aggregate over a whole queryset. Unlike Django's aggregates this 
+    doesn't make the queryset GROUP BY anything, so it can be wrapped in a 
+    subquery returning a single value (see _scalar_subquery).
+    """
+    return Func(expression, function=function)
+
+def _share_aggregates():
+    """
+    Aggregates over shares that change whenever a share is added, removed or
+    has its access level changed (share ids only ever increase, so removing
+    one share and adding another always changes the sum).
+    """
+    writeId = Case(When(access=AccessLevel.WRITE, then=F("id")), default=0, 
+        output_field=IntegerField())
+    return [
+        _aggregate("COUNT", F("id")),
+        Coalesce(_aggregate("SUM", F("id")), 0),
+        Coalesce(_aggregate("SUM", writeId), 0),
+    ]
+
+def _scalar_subquery(queryset, expression):
+    """
+    Wraps an aggregate (from _aggregate) over a whole queryset in a subquery
+    returning one value, so aggregates over different tables can be fetched
+    in one query.
+    """
+    return Subquery(queryset.order_by().annotate(value=expression).values("value"))
+
+def _digest_subquery(queryset, aggregates):
+    """
+    Like _scalar_subquery, but for several aggregates over the same queryset,
+    which are joined into one string so the rows are only read once.
+    """
+    parts = []
+    for aggregate in aggregates:
+        if parts:
+            parts.append(Value(":"))
+        parts.append(Cast(aggregate, CharField()))
+    return _scalar_subquery(queryset, Concat(*parts, output_field=CharField()))
+
+def share_digest_subquery(toDoRef):
+    """
+    Builds a subquery of a digest of who a todo is shared with (see 
+    _share_aggregates), so it can be fetched in the same query as the todo.
+    """
+    return _digest_subquery(SharedWith.objects.filter(todo=toDoRef), _share_aggregates())
+
+def _get_memo_dict(request):
+    """
+    The metadata of a page is memoized on the request, as the ETag function
+    and the view both use it.
+    """
+    memo = getattr(request, "_conditionalCache", None)
+    if memo == None:
+        memo = {}
+        request._conditionalCache = memo
+    return memo
+
+def _get_memo(request, key, queryset):
+    memo = _get_memo_dict(request)
+    if key not in memo:
+        memo[key] = queryset.first()
+    return memo[key]
+
+async def _aget_memo(request, key, queryset):
+    memo = _get_memo_dict(request)
+    if key not in memo:
+        memo[key] = await queryset.afirst()
+    return memo[key]
+
+def _gen_etag(request, parts):
+    """
+    Hashes the parts of a page's metadata, along with who is viewing it and
+    which page of it they asked for, into an ETag.
+    """
+    parts = list(parts) + [
+        request.user.id,
+        request.user.username,
+        request.GET.urlencode(),
+        # Pages with forms include a CSRF token tied to this cookie.
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+    ]
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+def get_todo_metadata(request, toDoId):
+    """
+    Fetches the metadata that the view_todo page of a todo depends on in one
+    query.
+
+    returns: dict, or None if the user isn't logged in or the todo doesn't
+    exist.
+    """
+    userId = request.user.id
+    if userId == None:
+        return None
+    return _get_memo(request, ("todo", toDoId), _todo_metadata_queryset(userId, toDoId))
+
+async def aget_todo_metadata(request, toDoId):
+    """
+    Async version of get_todo_metadata.
+    """
+    userId = (await request.auser()).id
+    if userId == None:
+        return None
+    return await _aget_memo(request, ("todo", toDoId), _todo_metadata_queryset(userId, toDoId))
+
+def _todo_metadata_queryset(userId, toDoId):
+    return (ToDo.objects
+        .filter(id=toDoId)
+        .annotate(
+            sharedAccess=shared_access_subquery(userId, OuterRef("pk")),
+            shareDigest=share_digest_subquery(OuterRef("pk")))
+        .values("lastModified", "numOfTasks", "numDone", "title", "user_id", "sharedAccess",
+            "shareDigest"))
+
+def todo_etag(request, toDoId):
+    """
+    ETag function for view_todo.
+    """
+    metadata = get_todo_metadata(request, toDoId)
+    # Users with no access get the error page, which isn't cached.
+    if metadata == None or (metadata["user_id"] != request.user.id and metadata["sharedAccess"] == None):
+        return None
+    return _gen_etag(request, sorted(metadata.items()))
+
+def get_home_metadata(request):
+    """
+    Fetches the metadata that the home page depends on in one query:
+    aggregates over every todo the user can see, over the shares of those
+    todos that show on the page (who the users own todos are shared with, 
+    and what the user's own access levels are), and the users UserStats
+    (which the page shows).
+
+    returns: dict, or None if the user isn't logged in.
+    """
+    userId = request.user.id
+    if userId == None:
+        return None
+    return _get_memo(request, ("home",), _home_metadata_queryset(userId))
+
+async def aget_home_metadata(request):
+    """
+    Async version of get_home_metadata.
+    """
+    userId = (await request.auser()).id
+    if userId == None:
+        return None
+    return await _aget_memo(request, ("home",), _home_metadata_queryset(userId))
+
+def _home_metadata_queryset(userId):
+    sharedToDoIds = SharedWith.objects.filter(user=userId).values("todo")
+    toDos = ToDo.objects.filter(Q(user=userId) | Q(id__in=sharedToDoIds))
+    shares = (SharedWith.objects
+        .filter(Q(todo__user=userId) | Q(user=userId), todo__deletedAt__isnull=True))
+    # Todos being added, removed or moved changes the count, id sum or
+    # position sum, and anything else changes the lastModified.
+    toDoAggregates = [
+        _aggregate("COUNT", F("id")),
+        Coalesce(_aggregate("SUM", F("id")), 0),
+        Coalesce(_aggregate("SUM", F("position")), 0),
+    ]
+
+    return (User.objects
+        .filter(id=userId)
+        .annotate(
+            lastModified=_scalar_subquery(toDos, _aggregate("MAX", F("lastModified"))),
+            toDoDigest=_digest_subquery(toDos, toDoAggregates),
+            shareDigest=_digest_subquery(shares, _share_aggregates()))
+        .values("lastModified", "toDoDigest", "shareDigest", numOfToDos=F("stats__numOfToDos"),
+            numOfTasks=F("stats__numOfTasks"), numDone=F("stats__numDone")))
+
+def home_etag(request):
+    """
+    ETag function for home.
+    """
+    metadata = get_home_metadata(request)
+    if metadata == None:
+        return None
+    return _gen_etag(request, sorted(metadata.items()))
+
+def async_condition(aget_metadata, etag_func):
+    """
+    Django's condition decorator for async views. The ETag functions above
+    can't query the database from an async view, so the metadata they
+    memoize is fetched with the async ORM first.
+
+    Params:
+        - aget_metadata: async function fetching the metadata of the page
+        (e.g. aget_todo_metadata), called with the same arguments as the view
+        - etag_func: as for condition
+    """
+    def decorator(view):
+        conditionalView = condition(etag_func=etag_func)(view)
+
+        @functools.wraps(view)
+        async def inner(request, *args, **kwargs):
+            await aget_metadata(request, *args, **kwargs)
+            return await conditionalView(request, *args, **kwargs)
+
+        return inner
+
+    return decorator
@@ -0,0 +1,118 @@
+from django.db import transaction
+
+import asyncio
+import json
+import threading
+
+# Live updates for the view_todo page (see async_views.todo_events and
+# static/todo_events.js). Changes to tasks and shares publish small events
+# to an in-process hub once they are committed, which fans them out to the
+# pages subscribed to that todo. Each subscriber is just an asyncio queue
+# waited on by its streaming response, so idle pages don't hold a thread.
+#
+# NOTE: the hub only reaches subscribers in the same process, so with
+# several server processes a page only sees the changes made through the
+# process it is connected to.
+
+# How many events a subscriber can fall behind by before it is told to
+# reload instead.
+MAX_QUEUED_EVENTS = 100
+
+class Subscriber:
+    """
+    A page subscribed to the events of a todo, from inside an event loop.
+    """
+
+    def __init__(self, toDoId, userId):
+        self.toDoId = toDoId
+        self.userId = userId
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(MAX_QUEUED_EVENTS)
+
+    def put(self, event):
+        # Called on the subscribers event loop.
+        if self.queue.full():
+            # Dropping what the page missed, it just needs to reload.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {"type": "reload"}
+        self.queue.put_nowait(event)
+
+class EventHub:
+    """
+    Fans out the events of each todo to its subscribers.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def subscribe(self, toDoId, userId):
+        """
+        Must be called from the event loop the subscriber will wait in.
+
+        returns: Subscriber
+        """
+        subscriber = Subscriber(toDoId, userId)
+        with self.lock:
+            self.subscribers.setdefault(toDoId, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            toDoSubscribers = self.subscribers.get(subscriber.toDoId, set())
+            toDoSubscribers.discard(subscriber)
+            if not toDoSubscribers:
+                self.subscribers.pop(subscriber.toDoId, None)
+
+    def count(self):
+        """
+        returns: int, the number of subscribers.
+        """
+        with self.lock:
+            return sum(len(toDoSubscribers) for toDoSubscribers in self.subscribers.values())
+
+    def publish(self, toDoId, event):
+        """
+        Sends an event to every subscriber of a todo. Can be called from any
+        thread.
+        """
+        with self.lock:
+            toDoSubscribers = list(self.subscribers.get(toDoId, ()))
+        for subscriber in toDoSubscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.put, event)
+            except RuntimeError:
+                # The subscribers event loop has closed.
+                self.unsubscribe(subscriber)
+
+hub = EventHub()
+
+def publish(toDoId, event):
+    """
+    Publishes an event to the subscribers of a todo once the current
+    transaction (if there is one) is committed.
+    """
+    transaction.on_commit(lambda: hub.publish(toDoId, event))
+
+def gen_task_event(task, action):
+    """
+    Makes the event for a task being "added", "changed" or "deleted".
+    """
+    return {
+        "type": "task",
+        "action": action,
+        "id": task.id,
+        "title": task.title,
+        "done": task.done,
+        "position": task.position,
+    }
+
+def publish_task_event(task, action):
+    publish(task.belongsTo_id, gen_task_event(task, action))
+
+def format_event(event):
+    """
+    Formats an event as a Server-Sent Event.
+    """
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
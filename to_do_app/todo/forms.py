@@ -11,4 +11,8 @@ class TaskForm(forms.Form):
 
 class ShareForm(forms.Form):
     username = forms.CharField(label="username", max_length=255)
-    access = forms.ChoiceField(choices=AccessLevel.choices)
\ No newline at end of file
+    access = forms.ChoiceField(choices=AccessLevel.choices)
+
+class ImportForm(forms.Form):
+    file = forms.FileField(label="File")
+    format = forms.ChoiceField(choices=[("ndjson", "NDJSON"), ("csv", "CSV")])
@@ -0,0 +1,277 @@
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+import datetime
+import logging
+import threading
+import time
+import traceback
+import uuid
+
+from . import metrics
+from .models import Job, JobStatus
+
+# A queue of background jobs kept in the database (the Job model), so views
+# can hand off slow work (like purging a deleted todo, see purge.py) and
+# respond straight away, without a broker. Jobs are run by the workers of
+# "python manage.py run_jobs".
+#
+# A job is a call to a module level function, with arguments that can be
+# stored as JSON. It is queued in the transaction of the request that
+# queued it, so it is only run if that commits.
+#
+# Workers claim a batch of jobs at a time with one UPDATE (SQLite runs it
+# with the write lock held, so two workers can never claim the same job),
+# which also pushes back their runAt by the visibility timeout. The jobs of
+# a batch that succeed are deleted together once it is finished. One that
+# raises is retried after JOB_RETRY_DELAY seconds (doubling after each
+# attempt) until it has been tried maxAttempts times, when it is marked as
+# failed with the traceback kept in lastError.
+# If a worker dies running a job, the job is run again by another worker
+# once its visibility timeout is up, so jobs should be safe to run twice.
+
+logger = logging.getLogger(__name__)
+
+# How many times the workers own queries are tried when the database is
+# locked (beyond its busy timeout).
+LOCKED_ATTEMPTS = 5
+
+def _retry_locked(function, *args, **kwargs):
+    """
+    Runs one of the workers own queries, trying it again after a short wait
+    if the database is locked.
+    """
+    for attempt in range(LOCKED_ATTEMPTS):
+        try:
+            return function(*args, **kwargs)
+        except OperationalError:
+            if attempt == LOCKED_ATTEMPTS - 1:
+                raise
+            time.sleep(0.01 * 2 ** attempt)
+
+def enqueue(function, *args, delay=0, maxAttempts=None, **kwargs):
+    """
+    Used to run a function in the background.
+
+    Params:
+        - function: a module level function (or its dotted path)
+        - args, kwargs: what to call it with, which must be JSON
+        - delay: float, how long to wait before running it (in seconds)
+        - maxAttempts: int, how many times to try it, defaults to the
+        JOB_MAX_ATTEMPTS setting
+
+    returns: models.Job
+    """
+    return Job.objects.create(**_gen_job(function, args, kwargs, delay, maxAttempts))
+
+def enqueue_many(function, argsList, delay=0, maxAttempts=None):
+    """
+    Bulk version of enqueue, queueing a call to the function for each tuple
+    of arguments in argsList with one INSERT.
+
+    returns: list of models.Job
+    """
+    return Job.objects.bulk_create([Job(**_gen_job(function, args, {}, delay, maxAttempts))
+        for args in argsList])
+
+def _gen_job(function, args, kwargs, delay, maxAttempts):
+    if not isinstance(function, str):
+        function = f"{function.__module__}.{function.__qualname__}"
+    if maxAttempts == None:
+        maxAttempts = settings.JOB_MAX_ATTEMPTS
+    return {
+        "name": function,
+        "args": list(args),
+        "kwargs": kwargs,
+        "runAt": timezone.now() + datetime.timedelta(seconds=delay),
+        "maxAttempts": maxAttempts,
+    }
+
+def claim_jobs(limit, visibilityTimeout=None):
+    """
+    Used by workers to take up to limit of the jobs that are ready to run,
+    oldest first.
+
+    Params:
+        - limit: int
+        - visibilityTimeout: float, how long the worker has to run them (in
+        seconds) before they are given to another worker, defaults to the
+        JOB_VISIBILITY_TIMEOUT setting
+
+    returns: list of models.Job
+    """
+    if visibilityTimeout == None:
+        visibilityTimeout = settings.JOB_VISIBILITY_TIMEOUT
+    claimId = uuid.uuid4().hex
+    now = timezone.now()
+
+    readyJobs = (Job.objects
+        .filter(status=JobStatus.QUEUED, runAt__lte=now)
+        .order_by("runAt", "id")
+        .values("id")[:limit])
+    # Each query is retried on its own, so jobs claimed by the UPDATE aren't
+    # left behind when reading them back fails.
+    numClaimed = _retry_locked(Job.objects.filter(id__in=readyJobs).update, claimId=claimId,
+        runAt=now + datetime.timedelta(seconds=visibilityTimeout), attempts=F("attempts") + 1)
+    if not numClaimed:
+        return []
+    return _retry_locked(list, Job.objects.filter(claimId=claimId).order_by("id"))
+
+def run_job(job):
+    """
+    Used to run a job claimed with claim_jobs, then delete it (or schedule
+    its retry).
+
+    returns: bool, whether the job succeeded.
+    """
+    succeeded = _call_job(job)
+    if succeeded:
+        _retry_locked(_finish_jobs, [job])
+    return succeeded
+
+def _call_job(job):
+    """
+    Runs a job, scheduling its retry (or failing it) if it raises.
+
+    returns: bool, whether the job succeeded.
+    """
+    # The claim of a job that has timed out more times than it can be tried
+    # (e.g. as it keeps killing its workers) is only used to fail it.
+    if job.attempts > job.maxAttempts:
+        _retry_locked(_fail_job, job, "Gave up after the job timed out.")
+        return False
+
+    try:
+        function = import_string(job.name)
+        function(*job.args, **job.kwargs)
+    except Exception:
+        logger.exception("Job %s (%s) failed", job.id, job.name)
+        _retry_locked(_fail_job, job, traceback.format_exc())
+        return False
+    return True
+
+def _finish_jobs(jobs):
+    """
+    Deletes jobs that succeeded (claimed together) with one DELETE.
+    """
+    # Only deleting the jobs that are still ours (they weren't given to
+    # another worker after their visibility timeout).
+    Job.objects.filter(claimId=jobs[0].claimId, id__in=[job.id for job in jobs]).delete()
+    for job in jobs:
+        metrics.inc("todo_jobs_total", (("name", job.name), ("result", "succeeded")))
+
+def _fail_job(job, error):
+    jobs = Job.objects.filter(id=job.id, claimId=job.claimId)
+    if job.attempts >= job.maxAttempts:
+        jobs.update(status=JobStatus.FAILED, claimId=None, lastError=error)
+        metrics.inc("todo_jobs_total", (("name", job.name), ("result", "failed")))
+        return
+
+    delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+    jobs.update(claimId=None, lastError=error,
+        runAt=timezone.now() + datetime.timedelta(seconds=delay))
+    metrics.inc("todo_jobs_total", (("name", job.name), ("result", "retried")))
+
+def retry_failed_jobs(name=None):
+    """
+    Used to queue the failed jobs (with a name, or all of them) again, with
+    their attempts reset.
+
+    returns: int, the number of jobs queued again.
+    """
+    jobs = Job.objects.filter(status=JobStatus.FAILED)
+    if name != None:
+        jobs = jobs.filter(name=name)
+    return jobs.update(status=JobStatus.QUEUED, attempts=0, runAt=timezone.now())
+
+class Worker:
+    """
+    Runs jobs in a number of threads, each claiming batchSize jobs at a time
+    and waiting pollInterval seconds whenever there are none ready.
+    """
+
+    def __init__(self, threads=1, batchSize=10, pollInterval=1.0, visibilityTimeout=None,
+            burst=False):
+        self.numOfThreads = threads
+        self.batchSize = batchSize
+        self.pollInterval = pollInterval
+        self.visibilityTimeout = visibilityTimeout
+        # Whether to stop once there are no jobs ready, rather than waiting
+        # for more.
+        self.burst = burst
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {"succeeded": 0, "failed": 0}
+
+    def stop(self):
+        """
+        Stops the threads once they finish the jobs they have claimed.
+        """
+        self.stopping.set()
+
+    def run(self):
+        """
+        Runs jobs until stop is called (or, in burst mode, until there are
+        none ready).
+
+        returns: dict, the number of jobs that succeeded and failed.
+        """
+        threads = [threading.Thread(target=self._run_thread, name=f"todo-jobs-{index}", daemon=True)
+            for index in range(self.numOfThreads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.stats
+
+    def _run_batch(self, jobs):
+        """
+        Runs a batch of claimed jobs, deleting the ones that succeed together
+        at the end.
+        """
+        succeededJobs = []
+        numFailed = 0
+        try:
+            for job in jobs:
+                if _call_job(job):
+                    succeededJobs.append(job)
+                else:
+                    numFailed += 1
+            if succeededJobs:
+                _retry_locked(_finish_jobs, succeededJobs)
+        except OperationalError:
+            # How the jobs went couldn't be saved, so they are run again once
+            # their visibility timeout is up.
+            logger.warning("Couldn't finish jobs", exc_info=True)
+            numFailed = len(jobs)
+            succeededJobs = []
+
+        with self.lock:
+            self.stats["succeeded"] += len(succeededJobs)
+            self.stats["failed"] += numFailed
+
+    def _run_thread(self):
+        try:
+            while not self.stopping.is_set():
+                # Replacing the connection if it has gone away (like Django
+                # does between requests).
+                close_old_connections()
+                try:
+                    jobs = claim_jobs(self.batchSize, self.visibilityTimeout)
+                except OperationalError:
+                    # The database stayed locked, trying again after a wait.
+                    logger.warning("Couldn't claim jobs", exc_info=True)
+                    jobs = None
+
+                if not jobs:
+                    if jobs != None and self.burst:
+                        return
+                    self.stopping.wait(self.pollInterval)
+                    continue
+
+                self._run_batch(jobs)
+        finally:
+            connection.close()
@@ -0,0 +1,172 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test import Client
+
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+from wsgiref.util import setup_testing_defaults
+
+from todo.models import ToDo, Task
+from todo.ordering import POSITION_GAP
+
+
+class Command(BaseCommand):
+    help = """
+    Measures the requests per second and latency of the home and view_todo
+    pages served in-process through asgi.py (many concurrent requests on one
+    event loop, like uvicorn) or wsgi.py (a pool of threads, like a threaded
+    WSGI server). With --compare, runs WSGI, ASGI with the sync views and
+    ASGI with the async views (ASYNC_VIEWS) one after another. Creates a
+    scratch user with todos and tasks in the configured database and removes
+    them again afterwards.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--server", choices=["asgi", "wsgi"], default="asgi")
+        parser.add_argument("--compare", action="store_true",
+            help="Run every server/view combination in its own process.")
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--todos", type=int, default=20)
+        parser.add_argument("--tasks", type=int, default=50,
+            help="The number of tasks in each todo.")
+
+    def handle(self, *args, **options):
+        if options["compare"]:
+            return self.compare(options)
+
+        user = User.objects.create_user(f"bench-asgi-{time.time_ns()}")
+        try:
+            paths = self.seed(user, options)
+            client = Client()
+            client.force_login(user)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.session.session_key}"
+
+            if options["server"] == "asgi":
+                latencies, seconds = asyncio.run(self.run_asgi(paths, cookie, options))
+            else:
+                latencies, seconds = self.run_wsgi(paths, cookie, options)
+            client.logout()
+        finally:
+            user.delete()
+
+        name = f"{options['server']}/{'async' if settings.ASYNC_VIEWS else 'sync'}"
+        self.report(name, latencies, seconds)
+
+    def compare(self, options):
+        for server, asyncViews in (("wsgi", "0"), ("asgi", "0"), ("asgi", "1")):
+            command = [sys.executable, sys.argv[0], "bench_asgi", "--server", server]
+            for option in ("concurrency", "requests", "todos", "tasks"):
+                command += [f"--{option}", str(options[option])]
+            environment = dict(os.environ, TODO_ASYNC_VIEWS=asyncViews)
+            subprocess.run(command, env=environment, check=True)
+
+    def seed(self, user, options):
+        toDos = [ToDo(title=f"Bench {index}", desc="Bench", position=(index + 1) * POSITION_GAP,
+            user=user) for index in range(options["todos"])]
+        for toDo in toDos:
+            toDo.save()
+        Task.objects.bulk_create([
+            Task(title=f"Task {index}", position=(index + 1) * POSITION_GAP, belongsTo=toDo,
+                createdBy=user)
+            for toDo in toDos for index in range(options["tasks"])])
+
+        return ["/"] + [f"/view_todo/{toDo.id}" for toDo in toDos]
+
+    async def run_asgi(self, paths, cookie, options):
+        application = get_asgi_application()
+        latencies = []
+
+        async def request(path):
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "query_string": b"",
+                "headers": [(b"host", b"localhost"), (b"cookie", cookie.encode())],
+                "server": ("localhost", 80),
+                "client": ("127.0.0.1", 0),
+            }
+            bodySent = False
+            finished = asyncio.Event()
+
+            async def receive():
+                nonlocal bodySent
+                if not bodySent:
+                    bodySent = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                await finished.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                if message["type"] == "http.response.start" and message["status"] != 200:
+                    raise RuntimeError(f"{path} returned {message['status']}")
+                if message["type"] == "http.response.body" and not message.get("more_body"):
+                    finished.set()
+
+            start = time.perf_counter()
+            await application(scope, receive, send)
+            latencies.append(time.perf_counter() - start)
+
+        async def client(clientIndex):
+            for index in range(clientIndex, options["requests"], options["concurrency"]):
+                await request(paths[index % len(paths)])
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client(index) for index in range(options["concurrency"])])
+        return (latencies, time.perf_counter() - start)
+
+    def run_wsgi(self, paths, cookie, options):
+        application = get_wsgi_application()
+        lock = threading.Lock()
+        latencies = []
+
+        def request(path):
+            environ = {"PATH_INFO": path, "HTTP_COOKIE": cookie, "HTTP_HOST": "localhost"}
+            setup_testing_defaults(environ)
+
+            def start_response(status, headers):
+                if not status.startswith("200"):
+                    raise RuntimeError(f"{path} returned {status}")
+
+            start = time.perf_counter()
+            response = application(environ, start_response)
+            b"".join(response)
+            response.close()
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+
+        def client(clientIndex):
+            for index in range(clientIndex, options["requests"], options["concurrency"]):
+                request(paths[index % len(paths)])
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(index,))
+            for index in range(options["concurrency"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return (latencies, time.perf_counter() - start)
+
+    def report(self, name, latencies, seconds):
+        latencies = sorted(latencies)
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+        self.stdout.write(
+            f"{name:<11} requests/s: {len(latencies) / seconds:>7.0f}  "
+            f"p50: {percentile(0.5):>7.1f}ms  p95: {percentile(0.95):>7.1f}ms  "
+            f"p99: {percentile(0.99):>7.1f}ms")
@@ -0,0 +1,361 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+import json
+import statistics
+import time
+
+from todo import api_urls, urls
+from todo.models import ToDo, Task, SharedWith, AccessLevel
+from todo.ordering import next_position
+from todo.seeding import clear_seed_data, seed_data
+
+# URLs that can't be measured like the rest, and why.
+SKIPPED_URLS = {
+    "todo_events": "streams events until the page is closed",
+}
+
+
+class Command(BaseCommand):
+    help = """
+    Measures the latency (p50/p95/p99), queries per request and response
+    size of every URL in todo/urls.py (and the API) through the Django test
+    client, as the seeded user with the most todos. Seeds users, todos,
+    tasks and shares at the given scale (see todo/seeding.py) in the
+    configured database and removes them again afterwards.
+
+    Save the results with --output and compare them to an earlier run with
+    --baseline, or compare two saved runs with --compare.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--todos", type=float, default=10,
+            help="The mean number of todos each user has.")
+        parser.add_argument("--tasks", type=float, default=20,
+            help="The mean number of tasks in each todo.")
+        parser.add_argument("--share", type=float, default=0.2,
+            help="The fraction of todos shared with other users.")
+        parser.add_argument("--repeat", type=int, default=30,
+            help="How many times to request each URL.")
+        parser.add_argument("--only", nargs="+", default=[],
+            help="Only measure the URLs with these names.")
+        parser.add_argument("--cold", action="store_true",
+            help="Clear the cache before every request.")
+        parser.add_argument("--output", help="Save the results to this JSON file.")
+        parser.add_argument("--baseline", help="Compare the results to this JSON file.")
+        parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+            help="Only compare two JSON files of results.")
+
+    def handle(self, *args, **options):
+        if options["compare"]:
+            old, new = [self.load(path) for path in options["compare"]]
+            self.compare(old, new)
+            return
+
+        baseline = self.load(options["baseline"]) if options["baseline"] else None
+        self.cold = options["cold"]
+        prefix = f"bench-endpoints-{time.time_ns()}"
+        seeded = seed_data(options["users"], toDosPerUser=options["todos"],
+            tasksPerToDo=options["tasks"], shareFraction=options["share"], prefix=prefix)
+        try:
+            self.prepare(seeded["users"])
+            endpoints = self.run(options)
+            self.client.logout()
+        finally:
+            clear_seed_data(prefix)
+
+        results = {
+            "date": timezone.now().isoformat(),
+            "options": {option: options[option]
+                for option in ("users", "todos", "tasks", "share", "repeat", "cold")},
+            "database": {"vendor": connection.vendor, "profile": settings.DATABASE_PROFILE},
+            "asyncViews": settings.ASYNC_VIEWS,
+            "seeded": {key: seeded[key] for key in ("toDos", "tasks", "shares")},
+            "user": self.userStats,
+            "endpoints": endpoints,
+        }
+        self.report(endpoints)
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Saved the results to {options['output']}")
+        if baseline != None:
+            self.compare(baseline, results)
+
+    def load(self, path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(f"Could not read {path}: {error}")
+
+    def prepare(self, users):
+        # Benchmarking as the user with the most todos, who can see the
+        # cache stats.
+        self.user = max(users, key=lambda user: ToDo.objects.filter(user=user).count())
+        # Saved (rather than updated) so the cached user is thrown away.
+        self.user.is_staff = True
+        self.user.save(update_fields=["is_staff"])
+        self.other = next(user for user in users if user.id != self.user.id)
+        self.client = Client(HTTP_HOST="localhost")
+        self.client.force_login(self.user)
+
+        # The todo with the most tasks, which the requests about one todo use.
+        self.toDo = ToDo.objects.filter(user=self.user).order_by("-numOfTasks").first()
+        if self.toDo == None:
+            raise CommandError("The benchmark user has no todos, seed more with --todos.")
+        if not Task.objects.filter(belongsTo=self.toDo).exists():
+            Task(title="Bench task", position=next_position(Task.objects.filter(belongsTo=self.toDo)),
+                belongsTo=self.toDo, createdBy=self.user, lastModified=timezone.now()).save()
+        self.task = Task.objects.filter(belongsTo=self.toDo).order_by("position").first()
+
+        self.userStats = {
+            "toDos": ToDo.objects.filter(user=self.user).count(),
+            "sharedWithThem": SharedWith.objects.filter(user=self.user).count(),
+            "tasksInToDo": Task.objects.filter(belongsTo=self.toDo).count(),
+        }
+
+    def gen_url_names(self):
+        for pattern in urls.urlpatterns + api_urls.urlpatterns:
+            if isinstance(pattern, URLPattern):
+                yield pattern.name
+
+    def run(self, options):
+        endpoints = {}
+        for name in self.gen_url_names():
+            if options["only"] and name not in options["only"]:
+                continue
+            if name in SKIPPED_URLS:
+                self.stdout.write(f"Skipping {name}, it {SKIPPED_URLS[name]}.")
+                continue
+            gen_request = getattr(self, f"request_{name}", None)
+            if gen_request == None:
+                self.stdout.write(self.style.WARNING(f"Skipping {name}, there is no request for it."))
+                continue
+
+            samples = [self.request(*gen_request(index)) for index in range(options["repeat"])]
+            endpoints[name] = self.summarise(samples)
+        return endpoints
+
+    def request(self, method, path, data=None, contentType=None):
+        """
+        Makes a request, returning its latency, number of queries, response
+        size and status code.
+        """
+        kwargs = {}
+        if data != None:
+            kwargs["data"] = data
+        if contentType != None:
+            kwargs["content_type"] = contentType
+        if self.cold:
+            cache.clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(self.client, method)(path, **kwargs)
+            # Streamed responses are only made while they are read.
+            if response.streaming:
+                body = b"".join(response.streaming_content)
+            else:
+                body = response.content
+            latency = time.perf_counter() - start
+
+        return {
+            "method": method.upper(),
+            "path": path,
+            "latency": latency,
+            "queries": len(queries),
+            "bytes": len(body),
+            "status": response.status_code,
+        }
+
+    def summarise(self, samples):
+        latencies = sorted(sample["latency"] for sample in samples)
+
+        def percentile(fraction):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 3)
+
+        return {
+            "method": samples[0]["method"],
+            "path": samples[0]["path"],
+            "requests": len(samples),
+            "status": sorted({sample["status"] for sample in samples}),
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "queries": round(statistics.mean(sample["queries"] for sample in samples), 1),
+            "maxQueries": max(sample["queries"] for sample in samples),
+            "bytes": round(statistics.mean(sample["bytes"] for sample in samples)),
+        }
+
+    def report(self, endpoints):
+        self.stdout.write(f"{'url':<22} {'method':<6} {'status':<9} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'p99 ms':>8} {'queries':>8} {'bytes':>9}")
+        for name, result in endpoints.items():
+            status = ",".join(str(code) for code in result["status"])
+            self.stdout.write(f"{name:<22} {result['method']:<6} {status:<9} {result['p50']:>8.2f} "
+                f"{result['p95']:>8.2f} {result['p99']:>8.2f} {result['queries']:>8} "
+                f"{result['bytes']:>9}")
+
+    def compare(self, old, new):
+        self.stdout.write(f"Comparing {old['date']} (old) to {new['date']} (new)")
+        if old["options"] != new["options"]:
+            self.stdout.write(self.style.WARNING("The runs were made with different options."))
+        self.stdout.write(f"{'url':<22} {'p50 ms':>17} {'change':>8} {'p95 ms':>17} "
+            f"{'queries':>13} {'bytes':>19}")
+
+        def change(oldValue, newValue):
+            if oldValue == 0:
+                return "n/a"
+            return f"{(newValue - oldValue) / oldValue * 100:+.0f}%"
+
+        for name, result in new["endpoints"].items():
+            if name not in old["endpoints"]:
+                continue
+            before = old["endpoints"][name]
+            line = (f"{name:<22} {before['p50']:>7.2f} -> {result['p50']:>6.2f} "
+                f"{change(before['p50'], result['p50']):>8} {before['p95']:>7.2f} -> "
+                f"{result['p95']:>6.2f} {before['queries']:>5} -> {result['queries']:>5} "
+                f"{before['bytes']:>8} -> {result['bytes']:>7}")
+            # More queries per request is almost always a regression.
+            if result["queries"] > before["queries"]:
+                line = self.style.WARNING(line)
+            self.stdout.write(line)
+
+    # The requests made for each URL, by its name. Requests that change or
+    # remove something set up what they need first, outside of the timing.
+    # returns: (method, path, data, contentType)
+
+    def request_home(self, index):
+        return ("get", reverse("home"))
+
+    def request_view_todo(self, index):
+        return ("get", reverse("view_todo", args=[self.toDo.id]))
+
+    def request_add_todo(self, index):
+        return ("post", reverse("add_todo"), {"title": f"Bench todo {index}", "desc": "Bench"})
+
+    def request_edit_todo(self, index):
+        return ("post", reverse("edit_todo", args=[self.toDo.id]),
+            {"title": f"Bench edited {index}", "desc": self.toDo.desc})
+
+    def request_remove_todo(self, index):
+        toDo = ToDo(title=f"Bench removed {index}", desc="Bench",
+            position=next_position(ToDo.objects.filter(user=self.user)), user=self.user)
+        toDo.save()
+        return ("get", reverse("remove_todo", args=[toDo.id]))
+
+    def request_share_todo(self, index):
+        SharedWith.objects.filter(todo=self.toDo, user=self.other).delete()
+        return ("post", reverse("share_todo", args=[self.toDo.id]),
+            {"username": self.other.username, "access": AccessLevel.READ})
+
+    def request_unshare_todo(self, index):
+        SharedWith.objects.get_or_create(todo=self.toDo, user=self.other)
+        return ("get", reverse("unshare_todo", args=[self.toDo.id, self.other.id]))
+
+    def request_add_task(self, index):
+        return ("post", reverse("add_task", args=[self.toDo.id]), {"title": f"Bench added {index}"})
+
+    def request_edit_task(self, index):
+        return ("post", reverse("edit_task", args=[self.task.id]), {"title": f"Bench edited {index}"})
+
+    def request_complete_task(self, index):
+        return ("get", reverse("complete_task", args=[self.toDo.id, self.task.id]))
+
+    def request_remove_task(self, index):
+        task = Task(title=f"Bench removed {index}", belongsTo=self.toDo, createdBy=self.user,
+            position=next_position(Task.objects.filter(belongsTo=self.toDo)),
+            lastModified=timezone.now())
+        task.save()
+        return ("get", reverse("remove_task", args=[self.toDo.id, task.id]))
+
+    def gen_batch(self, index):
+        return json.dumps({"operations": [
+            {"op": "complete", "id": self.task.id},
+            {"op": "add", "title": f"Bench batch {index}"},
+        ]})
+
+    def request_batch_tasks(self, index):
+        return ("post", reverse("batch_tasks", args=[self.toDo.id]), self.gen_batch(index),
+            "application/json")
+
+    def request_reorder_todo(self, index):
+        # Moving the todo to the start and back again.
+        last = ToDo.objects.filter(user=self.user).exclude(id=self.toDo.id).order_by("position").last()
+        after = last.id if index % 2 and last != None else ""
+        return ("post", reverse("reorder_todo", args=[self.toDo.id]), {"after": after})
+
+    def request_reorder_task(self, index):
+        last = Task.objects.filter(belongsTo=self.toDo).exclude(id=self.task.id).order_by("position").last()
+        after = last.id if index % 2 and last != None else ""
+        return ("post", reverse("reorder_task", args=[self.task.id]), {"after": after})
+
+    def request_search(self, index):
+        return ("get", reverse("search"), {"q": "buy milk"})
+
+    def request_export_todos(self, index):
+        return ("get", reverse("export_todos"), {"format": "ndjson"})
+
+    def gen_import(self, index):
+        lines = [{"type": "todo", "toDo": 1, "title": f"Bench imported {index}", "desc": "Bench"}]
+        lines += [{"type": "task", "toDo": 1, "title": f"Task {taskIndex}"} for taskIndex in range(20)]
+        return "".join(json.dumps(line) + "\n" for line in lines).encode()
+
+    def request_import_todos(self, index):
+        upload = SimpleUploadedFile("todos.ndjson", self.gen_import(index))
+        return ("post", reverse("import_todos"), {"file": upload, "format": "ndjson"})
+
+    def request_metrics(self, index):
+        return ("get", reverse("metrics"))
+
+    def request_api_todos(self, index):
+        return ("get", reverse("api_todos"))
+
+    def request_api_todo(self, index):
+        return ("get", reverse("api_todo", args=[self.toDo.id]))
+
+    def request_api_todo_tasks(self, index):
+        return ("get", reverse("api_todo_tasks", args=[self.toDo.id]))
+
+    def request_api_todo_tasks_batch(self, index):
+        return ("post", reverse("api_todo_tasks_batch", args=[self.toDo.id]),
+            self.gen_batch(f"api {index}"), "application/json")
+
+    def request_api_todo_shares(self, index):
+        return ("get", reverse("api_todo_shares", args=[self.toDo.id]))
+
+    def request_api_todo_share(self, index):
+        SharedWith.objects.get_or_create(todo=self.toDo, user=self.other)
+        return ("delete", reverse("api_todo_share", args=[self.toDo.id, self.other.id]))
+
+    def request_api_task(self, index):
+        return ("get", reverse("api_task", args=[self.task.id]))
+
+    def request_api_search(self, index):
+        return ("get", reverse("api_search"), {"q": "buy milk"})
+
+    def request_api_export(self, index):
+        return ("get", reverse("api_export"), {"format": "csv"})
+
+    def request_api_import(self, index):
+        return ("post", f"{reverse('api_import')}?format=ndjson", self.gen_import(f"api {index}"),
+            "application/x-ndjson")
+
+    def request_api_stats(self, index):
+        return ("get", reverse("api_stats"))
+
+    def request_api_cache_stats(self, index):
+        return ("get", reverse("api_cache_stats"))
+
+    def request_api_profile_stats(self, index):
+        return ("get", reverse("api_profile_stats"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+import time
+
+from todo.jobs import Worker, enqueue, enqueue_many
+from todo.models import Job
+
+
+def noop_job(*args):
+    pass
+
+class Command(BaseCommand):
+    help = """
+    Measures the throughput of the background job queue in todo/jobs.py:
+    queueing jobs one at a time and in bulk, then running them (jobs that do
+    nothing, so this is the overhead of the queue itself) with different
+    numbers of worker threads. Uses the configured database, removing the
+    jobs it queued afterwards.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--jobs", type=int, default=5000)
+        parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+        parser.add_argument("--batch-size", type=int, default=10,
+            help="How many jobs a worker thread claims at a time.")
+
+    def handle(self, *args, **options):
+        numOfJobs = options["jobs"]
+        name = f"{__name__}.noop_job"
+        try:
+            start = time.perf_counter()
+            for index in range(numOfJobs):
+                enqueue(name, index)
+            self.report("enqueue", numOfJobs, time.perf_counter() - start)
+            Job.objects.filter(name=name).delete()
+
+            for threads in options["threads"]:
+                start = time.perf_counter()
+                enqueue_many(name, [(index,) for index in range(numOfJobs)])
+                self.report("enqueue_many", numOfJobs, time.perf_counter() - start)
+
+                worker = Worker(threads=threads, batchSize=options["batch_size"], pollInterval=0.01,
+                    burst=True)
+                start = time.perf_counter()
+                stats = worker.run()
+                self.report(f"run ({threads} threads)", stats["succeeded"], time.perf_counter() - start)
+        finally:
+            Job.objects.filter(name=name).delete()
+
+    def report(self, name, numOfJobs, seconds):
+        self.stdout.write(f"{name:<18} jobs/s: {numOfJobs / seconds:>8.0f}")
@@ -0,0 +1,134 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import RequestFactory
+from django.utils import timezone
+
+import random
+import statistics
+import string
+import time
+
+from todo.models import ToDo, Task, SharedWith, AccessLevel
+from todo.ordering import POSITION_GAP
+from todo.search import search_todos
+
+
+class Command(BaseCommand):
+    help = """
+    Measures the latency of searching todos and tasks with the FTS5 index in
+    search.py against a naive icontains scan of the rows the user can see.
+    Creates scratch users, todos and (by default 1M) tasks in the configured
+    database and removes them again afterwards.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tasks", type=int, default=1000000)
+        parser.add_argument("--todos", type=int, default=5000)
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=20,
+            help="How many times to run each search.")
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        self.vocabulary = ["".join(random.choices(string.ascii_lowercase, k=random.randint(4, 9)))
+            for _ in range(5000)]
+        prefix = f"bench-search-{time.time_ns()}"
+        users = User.objects.bulk_create([User(username=f"{prefix}-{index}")
+            for index in range(options["users"])])
+
+        try:
+            start = time.perf_counter()
+            self.seed(users, options)
+            self.stdout.write(f"Seeded {options['tasks']} tasks in "
+                f"{time.perf_counter() - start:.1f}s")
+
+            # Common and rare words (by their rank in the Zipf-like
+            # distribution the titles were made with), several words and a
+            # prefix.
+            searches = {
+                "common word": self.vocabulary[0],
+                "rare word": self.vocabulary[2000],
+                "two words": f"{self.vocabulary[5]} {self.vocabulary[50]}",
+                "prefix": self.vocabulary[10][:3],
+            }
+            user = users[0]
+            for name, query in searches.items():
+                ftsTimes = self.time(lambda: self.search_fts(user, query), options["repeat"])
+                naiveTimes = self.time(lambda: self.search_naive(user, query), options["repeat"])
+                self.stdout.write(f"{name:<12} fts p50: {self.ms(ftsTimes, 0.5):>7.1f}ms "
+                    f"p95: {self.ms(ftsTimes, 0.95):>7.1f}ms   icontains p50: "
+                    f"{self.ms(naiveTimes, 0.5):>8.1f}ms p95: {self.ms(naiveTimes, 0.95):>8.1f}ms")
+        finally:
+            self.clean_up(users)
+
+    def gen_title(self):
+        # Earlier words in the vocabulary are much more common.
+        words = [self.vocabulary[min(int(random.paretovariate(1.0)) - 1, len(self.vocabulary) - 1)]
+            if random.random() < 0.5 else random.choice(self.vocabulary)
+            for _ in range(random.randint(2, 6))]
+        return " ".join(words)
+
+    def seed(self, users, options):
+        now = timezone.now()
+        toDos = []
+        for index in range(options["todos"]):
+            desc = self.gen_title()
+            toDos.append(ToDo(title=f"{self.gen_title()} {index}", desc=desc,
+                descHash=ToDo.hashDesc(desc), lastModified=now, user=random.choice(users),
+                position=(index + 1) * POSITION_GAP))
+        toDos = ToDo.objects.bulk_create(toDos, batch_size=500)
+
+        # Sharing some of the other users todos with the first user.
+        SharedWith.objects.bulk_create([SharedWith(user=users[0], todo=toDo, access=AccessLevel.READ)
+            for toDo in random.sample(toDos, len(toDos) // 50) if toDo.user_id != users[0].id])
+
+        tasksPerToDo = max(1, options["tasks"] // len(toDos))
+        sql = """INSERT INTO todo_task (title, belongsTo_id, createdBy_id, done, dateCreated,
+            lastModified, position) VALUES (%s, %s, %s, %s, %s, %s, %s)"""
+        with connection.cursor() as cursor:
+            for toDo in toDos:
+                with transaction.atomic():
+                    cursor.executemany(sql, [(f"{self.gen_title()} {index}", toDo.id, toDo.user_id,
+                        False, now, now, (index + 1) * POSITION_GAP) for index in range(tasksPerToDo)])
+
+    def search_fts(self, user, query):
+        request = RequestFactory().get("/search", {"q": query})
+        results, nextPageQuery, errorMessage = search_todos(user.id, query, request)
+        return results
+
+    def search_naive(self, user, query):
+        # What searching without the index would look like: scanning every
+        # todo and task the user can see.
+        visible = Q(user=user) | Q(sharedwith__user=user)
+        words = query.split()
+        toDos = ToDo.objects.filter(visible)
+        tasks = Task.objects.filter(Q(belongsTo__user=user) | Q(belongsTo__sharedwith__user=user))
+        for word in words:
+            toDos = toDos.filter(Q(title__icontains=word) | Q(desc__icontains=word))
+            tasks = tasks.filter(title__icontains=word)
+        return list(toDos.values("id", "title")[:50]) + list(tasks.values("id", "title")[:50])
+
+    def time(self, search, repeat):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            search()
+            times.append(time.perf_counter() - start)
+        return sorted(times)
+
+    def ms(self, times, fraction):
+        if fraction == 0.5:
+            return statistics.median(times) * 1000
+        return times[min(len(times) - 1, int(len(times) * fraction))] * 1000
+
+    def clean_up(self, users):
+        # Deleting the tasks in one query, rather than having the ORM load
+        # every one of them to cascade the user deletes.
+        userIds = [user.id for user in users]
+        with connection.cursor() as cursor:
+            placeholders = ", ".join(["%s"] * len(userIds))
+            cursor.execute(f"""DELETE FROM todo_task WHERE belongsTo_id IN
+                (SELECT id FROM todo_todo WHERE user_id IN ({placeholders}))""", userIds)
+        User.objects.filter(id__in=userIds).delete()
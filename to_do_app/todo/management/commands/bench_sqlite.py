@@ -0,0 +1,125 @@
+from django.core.management.base import BaseCommand
+
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from todo.sqlite import PROFILE_PRAGMAS, apply_pragmas
+
+
+class Command(BaseCommand):
+    help = """
+    Measures the read/write throughput of each database profile (see
+    DATABASE_PROFILE in settings.py) with several threads reading and
+    writing a scratch copy of the todo/task tables at once. The development
+    profile opens a new connection for every operation (like CONN_MAX_AGE=0
+    does for every request) with SQLite's default journal, the production
+    profile keeps a connection per thread with the pragmas in todo/sqlite.py.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--seconds", type=float, default=3.0,
+            help="How long to run each profile for.")
+        parser.add_argument("--write-ratio", type=float, default=0.2,
+            help="The fraction of operations that are writes.")
+        parser.add_argument("--todos", type=int, default=200,
+            help="The number of todos to seed, each with 20 tasks.")
+
+    def handle(self, *args, **options):
+        for profile in PROFILE_PRAGMAS:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "bench.sqlite3")
+                self.seed(path, options["todos"])
+                results = self.run_profile(path, profile, options)
+
+            seconds = options["seconds"]
+            self.stdout.write(
+                f"{profile:<12} reads/s: {results['reads'] / seconds:>9.0f}  "
+                f"writes/s: {results['writes'] / seconds:>8.0f}  "
+                f"errors: {results['errors']}")
+
+    def seed(self, path, numToDos):
+        connection = sqlite3.connect(path)
+        with connection:
+            connection.executescript("""
+                CREATE TABLE todo (id INTEGER PRIMARY KEY, numOfTasks INTEGER NOT NULL,
+                    lastModified REAL NOT NULL);
+                CREATE TABLE task (id INTEGER PRIMARY KEY, belongsTo INTEGER NOT NULL,
+                    title TEXT NOT NULL, position INTEGER NOT NULL);
+                CREATE INDEX task_todo_position_idx ON task (belongsTo, position, id);
+            """)
+            connection.executemany("INSERT INTO todo VALUES (?, 20, 0)",
+                [(toDoId,) for toDoId in range(1, numToDos + 1)])
+            connection.executemany("INSERT INTO task (belongsTo, title, position) VALUES (?, ?, ?)",
+                [(toDoId, f"Task {index}", (index + 1) * 1024)
+                    for toDoId in range(1, numToDos + 1) for index in range(20)])
+        connection.close()
+
+    def connect(self, path, profile):
+        # Django's default timeout is 5 seconds, the production profile's is 20.
+        pragmas = PROFILE_PRAGMAS[profile]
+        connection = sqlite3.connect(path, timeout=pragmas.get("busy_timeout", 5000) / 1000,
+            isolation_level=None, check_same_thread=False)
+        apply_pragmas(connection.cursor(), pragmas)
+        return connection
+
+    def run_profile(self, path, profile, options):
+        numToDos = options["todos"]
+        persistent = profile == "production"
+        # Like transaction_mode in the production profile.
+        begin = "BEGIN IMMEDIATE" if persistent else "BEGIN"
+        deadline = time.perf_counter() + options["seconds"]
+        lock = threading.Lock()
+        results = {"reads": 0, "writes": 0, "errors": 0}
+
+        def work():
+            counts = {"reads": 0, "writes": 0, "errors": 0}
+            connection = self.connect(path, profile) if persistent else None
+
+            while time.perf_counter() < deadline:
+                if not persistent:
+                    connection = self.connect(path, profile)
+                toDoId = random.randint(1, numToDos)
+                isWrite = random.random() < options["write_ratio"]
+
+                try:
+                    if isWrite:
+                        connection.execute(begin)
+                        connection.execute("""INSERT INTO task (belongsTo, title, position)
+                            VALUES (?, 'New', (SELECT MAX(position) + 1024 FROM task
+                            WHERE belongsTo = ?))""", (toDoId, toDoId))
+                        connection.execute("""UPDATE todo SET numOfTasks = numOfTasks + 1,
+                            lastModified = ? WHERE id = ?""", (time.time(), toDoId))
+                        connection.execute("COMMIT")
+                        counts["writes"] += 1
+                    else:
+                        connection.execute("""SELECT id, title, position FROM task
+                            WHERE belongsTo = ? ORDER BY position, id LIMIT 50""",
+                            (toDoId,)).fetchall()
+                        counts["reads"] += 1
+                except sqlite3.OperationalError:
+                    # "database is locked"
+                    counts["errors"] += 1
+                    if connection.in_transaction:
+                        connection.execute("ROLLBACK")
+
+                if not persistent:
+                    connection.close()
+
+            if persistent:
+                connection.close()
+            with lock:
+                for key, count in counts.items():
+                    results[key] += count
+
+        threads = [threading.Thread(target=work) for _ in range(options["threads"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return results
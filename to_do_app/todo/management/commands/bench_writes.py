@@ -0,0 +1,100 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+
+import random
+import statistics
+import threading
+import time
+
+from todo.models import ToDo, Task
+from todo.ordering import POSITION_GAP
+from todo.writer import WriteQueue
+
+
+class Command(BaseCommand):
+    help = """
+    Measures the throughput and latency of task writes from several threads
+    at once, each in its own transaction (the default) and through the write
+    queue in todo/writer.py (group commit). Creates a scratch user, todo and
+    tasks in the configured database and removes them again afterwards.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--writes", type=int, default=200,
+            help="The number of writes each thread makes.")
+        parser.add_argument("--tasks", type=int, default=100,
+            help="The number of tasks in the shared todo.")
+        parser.add_argument("--max-delay", type=float, default=0.005,
+            help="The latency budget of the write queue, in seconds.")
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(f"bench-writes-{time.time_ns()}")
+        try:
+            toDo = ToDo(title="Bench", desc="Bench", position=POSITION_GAP, user=user)
+            toDo.save()
+            Task.objects.bulk_create([
+                Task(title=f"Task {index}", position=(index + 1) * POSITION_GAP,
+                    belongsTo=toDo, createdBy=user)
+                for index in range(options["tasks"])])
+            taskIds = list(Task.objects.filter(belongsTo=toDo).values_list("id", flat=True))
+
+            def direct(task):
+                with transaction.atomic():
+                    task.save()
+
+            self.report("direct", self.run(direct, taskIds, options))
+
+            writeQueue = WriteQueue(maxDelay=options["max_delay"])
+            submit = lambda task: writeQueue.submit(task.save).result()
+            results = self.run(submit, taskIds, options)
+            writeQueue.stop()
+            self.report("queued", results, writeQueue.stats)
+        finally:
+            user.delete()
+
+    def run(self, write, taskIds, options):
+        lock = threading.Lock()
+        results = {"latencies": [], "errors": 0}
+
+        def work():
+            latencies = []
+            errors = 0
+            tasks = list(Task.objects.filter(id__in=taskIds))
+            for _ in range(options["writes"]):
+                task = random.choice(tasks)
+                task.done = not task.done
+                start = time.perf_counter()
+                try:
+                    write(task)
+                    latencies.append(time.perf_counter() - start)
+                except OperationalError:
+                    # "database is locked"
+                    errors += 1
+            connection.close()
+            with lock:
+                results["latencies"] += latencies
+                results["errors"] += errors
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=work) for _ in range(options["threads"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        results["seconds"] = time.perf_counter() - start
+
+        return results
+
+    def report(self, name, results, stats=None):
+        latencies = sorted(results["latencies"])
+        line = (f"{name:<7} writes/s: {len(latencies) / results['seconds']:>7.0f}  "
+            f"errors: {results['errors']:>4}")
+        if latencies:
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            line += (f"  p50: {statistics.median(latencies) * 1000:>6.1f}ms"
+                f"  p95: {p95 * 1000:>6.1f}ms")
+        if stats != None and stats["commits"]:
+            line += f"  writes/commit: {stats['writes'] / stats['commits']:.1f}"
+        self.stdout.write(line)
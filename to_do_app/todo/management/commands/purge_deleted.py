@@ -0,0 +1,52 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+import time
+
+from todo.jobs import enqueue
+from todo.purge import PURGE_CHUNK_SIZE, PURGE_PAUSE, purge_deleted, purge_user
+
+
+class Command(BaseCommand):
+    help = """
+    Removes the todos that have been deleted, with their tasks and shares, a
+    chunk at a time (see todo/purge.py). Safe to run while the site is up,
+    e.g. nightly (deleted todos are usually purged by background jobs
+    already). Use --user to delete a user and everything they own the same
+    way, and --queue to leave it to the run_jobs workers.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=PURGE_CHUNK_SIZE,
+            help="How many rows are deleted at a time.")
+        parser.add_argument("--pause", type=float, default=PURGE_PAUSE,
+            help="How long to wait between chunks (in seconds).")
+        parser.add_argument("--user", help="The username of a user to delete.")
+        parser.add_argument("--queue", action="store_true",
+            help="Queue a background job to do it rather than doing it now.")
+
+    def handle(self, *args, **options):
+        chunkSize = options["chunk_size"]
+        pause = options["pause"]
+
+        start = time.perf_counter()
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"There is no user {options['user']!r}.")
+            function, kwargs = purge_user, {"userId": user.id}
+        else:
+            function, kwargs = purge_deleted, {}
+
+        if options["queue"]:
+            job = enqueue(function, chunkSize=chunkSize, pause=pause, **kwargs)
+            self.stdout.write(f"Queued job {job.id}")
+            return
+
+        result = function(chunkSize=chunkSize, pause=pause, **kwargs)
+        if options["user"]:
+            self.stdout.write(f"Deleted user {user.username}")
+
+        self.stdout.write(f"Removed {result['toDos']} todos, {result['tasks']} tasks and "
+            f"{result['shares']} shares in {time.perf_counter() - start:.1f}s")
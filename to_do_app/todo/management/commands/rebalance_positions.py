@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from todo.models import ToDo, Task
+from todo.ordering import POSITION_GAP, rebalance_positions
+
+
+class Command(BaseCommand):
+    help = """
+    Spreads out the positions of any todo lists (per user) and task lists (per 
+    todo) whose gaps are running out, so that reordering them keeps only 
+    writing one row. Meant to be run in the background (e.g. nightly).
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-gap", type=int, default=POSITION_GAP // 64,
+            help="Rebalance any list with two neighbours closer than this.")
+
+    def handle(self, *args, **options):
+        minGap = options["min_gap"]
+
+        for model, parentField in ((ToDo, "user_id"), (Task, "belongsTo_id")):
+            numRebalanced = 0
+            for parentId in self.find_crowded_lists(model, parentField, minGap):
+                rebalance_positions(model.objects.filter(**{parentField: parentId}))
+                numRebalanced += 1
+
+                # Moving tasks around changes their todo.
+                if model == Task:
+                    ToDo.objects.filter(id=parentId).update(lastModified=timezone.now())
+
+            self.stdout.write(f"Rebalanced {numRebalanced} {model.__name__} lists.")
+
+    def find_crowded_lists(self, model, parentField, minGap):
+        """
+        Streams through every item in position order, returning the ids of 
+        the lists that have two neighbours less than minGap apart.
+        """
+        crowdedIds = []
+        parentId = None
+        lastPosition = None
+        items = (model.objects
+            .order_by(parentField, "position", "id")
+            .values_list(parentField, "position")
+            .iterator(chunk_size=2000))
+
+        for itemParentId, position in items:
+            if itemParentId != parentId:
+                parentId = itemParentId
+            elif position - lastPosition < minGap and crowdedIds[-1:] != [parentId]:
+                crowdedIds.append(parentId)
+            lastPosition = position
+
+        return crowdedIds
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+import time
+
+from todo.reconcile import RECONCILE_CHUNK_SIZE, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = """
+    Checks the numOfTasks, numDone and lastModified of every todo and the
+    UserStats of every user against their tasks, and fixes the ones that have
+    drifted (see todo/reconcile.py). Safe to run while the site is up, e.g.
+    nightly. Use --dry-run to only list the wrong counters.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true",
+            help="List the wrong counters (stored -> actual) without fixing them.")
+        parser.add_argument("--chunk-size", type=int, default=RECONCILE_CHUNK_SIZE,
+            help="How many users are checked at a time.")
+
+    def handle(self, *args, **options):
+        dryRun = options["dry_run"]
+        # The wrong counters are listed in dry runs, or with -v 2.
+        showDiffs = dryRun or options["verbosity"] >= 2
+
+        def report(model, id, diff):
+            if showDiffs:
+                changes = ", ".join(f"{field} {stored} -> {actual}"
+                    for field, (stored, actual) in diff.items())
+                self.stdout.write(f"{model} {id}: {changes}")
+
+        start = time.perf_counter()
+        result = reconcile_counters(dryRun=dryRun, chunkSize=options["chunk_size"], report=report)
+        self.stdout.write(f"{'Found' if dryRun else 'Fixed'} {result['wrongToDos']} of "
+            f"{result['toDos']} todos and {result['wrongUsers']} of {result['users']} users "
+            f"with wrong counters in {time.perf_counter() - start:.1f}s")
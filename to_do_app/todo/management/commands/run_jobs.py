@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+import multiprocessing
+import os
+import signal
+
+from todo import metrics
+from todo.jobs import Worker
+
+
+def _run_worker(workerOptions):
+    """
+    Runs a worker until it is sent SIGINT or SIGTERM (or, in burst mode,
+    until there are no jobs ready).
+
+    returns: dict, the number of jobs that succeeded and failed.
+    """
+    worker = Worker(**workerOptions)
+    stop = lambda signum, frame: worker.stop()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    if settings.METRICS_ENABLED:
+        metrics.ensure_flusher()
+    return worker.run()
+
+def _run_worker_process(workerOptions, stdout):
+    # Forked, so it writes to the stdout of the command (which multiprocessing
+    # flushes before the process exits).
+    stats = _run_worker(workerOptions)
+    stdout.write(f"Process {os.getpid()}: {stats['succeeded']} jobs succeeded, "
+        f"{stats['failed']} failed")
+
+class Command(BaseCommand):
+    help = """
+    Runs the background jobs queued in the database (see todo/jobs.py) with
+    a number of threads, in one or more processes, until stopped with
+    SIGINT or SIGTERM (jobs already claimed are finished first). Threads
+    help when the jobs wait on I/O, processes when they use the CPU.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=4,
+            help="How many jobs each process runs at once.")
+        parser.add_argument("--processes", type=int, default=1)
+        parser.add_argument("--batch-size", type=int, default=10,
+            help="How many jobs a thread claims at a time.")
+        parser.add_argument("--poll-interval", type=float, default=1.0,
+            help="How long to wait when there are no jobs ready (in seconds).")
+        parser.add_argument("--visibility-timeout", type=float, default=None,
+            help="How long a thread has to run the jobs it claims (in seconds), "
+                "defaults to the JOB_VISIBILITY_TIMEOUT setting.")
+        parser.add_argument("--burst", action="store_true",
+            help="Stop once there are no jobs ready, rather than waiting for more.")
+
+    def handle(self, *args, **options):
+        workerOptions = {
+            "threads": options["threads"],
+            "batchSize": options["batch_size"],
+            "pollInterval": options["poll_interval"],
+            "visibilityTimeout": options["visibility_timeout"],
+            "burst": options["burst"],
+        }
+
+        if options["processes"] <= 1:
+            stats = _run_worker(workerOptions)
+            self.stdout.write(f"{stats['succeeded']} jobs succeeded, {stats['failed']} failed")
+            return
+
+        # Forked processes can't share the connections of this one.
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        processes = [context.Process(target=_run_worker_process, args=(workerOptions, self.stdout))
+            for _ in range(options["processes"])]
+        for process in processes:
+            process.start()
+
+        # Passing SIGTERM on to the workers (they get SIGINT from the
+        # terminal themselves).
+        def stop(signum, frame):
+            for process in processes:
+                process.terminate()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, lambda signum, frame: None)
+
+        for process in processes:
+            process.join()
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+import time
+
+from todo.seeding import SEED_PASSWORD, clear_seed_data, seed_data
+
+
+class Command(BaseCommand):
+    help = """
+    Fills the configured database with synthetic users, todos, tasks and
+    shares (see todo/seeding.py), e.g. to try the app or run benchmarks at a
+    realistic scale. The users are named "<prefix>-<index>" and can log in
+    with the password "password". Use --clear to remove them again.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--todos", type=float, default=10,
+            help="The mean number of todos each user has.")
+        parser.add_argument("--tasks", type=float, default=20,
+            help="The mean number of tasks in each todo.")
+        parser.add_argument("--share", type=float, default=0.2,
+            help="The fraction of todos shared with other users.")
+        parser.add_argument("--done", type=float, default=0.4,
+            help="The fraction of tasks that are done.")
+        parser.add_argument("--prefix", default="seed")
+        parser.add_argument("--seed", type=int, default=0, help="The random seed.")
+        parser.add_argument("--clear", action="store_true",
+            help="Remove the users with this prefix (and their data) instead.")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options["clear"]:
+            numOfUsers = clear_seed_data(options["prefix"])
+            self.stdout.write(f"Removed {numOfUsers} users in {time.perf_counter() - start:.1f}s")
+            return
+
+        seeded = seed_data(options["users"], toDosPerUser=options["todos"],
+            tasksPerToDo=options["tasks"], shareFraction=options["share"],
+            doneFraction=options["done"], prefix=options["prefix"], randomSeed=options["seed"])
+        self.stdout.write(f"Seeded {len(seeded['users'])} users, {seeded['toDos']} todos, "
+            f"{seeded['tasks']} tasks and {seeded['shares']} shares in "
+            f"{time.perf_counter() - start:.1f}s (password: {SEED_PASSWORD!r})")
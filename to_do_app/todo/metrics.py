@@ -0,0 +1,361 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+import bisect
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+
+# Metrics for Prometheus (see the metrics view and METRICS_ENABLED in
+# settings.py): request latency histograms and request/query counters by
+# URL name, fragment cache hits and misses (see cache.py), the writes
+# made through the ToDo and Task save paths and the background jobs run
+# (see jobs.py).
+#
+# Each thread adds to its own shard of the metrics, so recording one only
+# touches dictionaries no other thread writes to, and never waits for a
+# lock. The shards are only added up when the metrics are scraped.
+#
+# Prefork servers (e.g. gunicorn with several workers) run a copy of the app
+# in each process. With METRICS_DIR set, every process writes its metrics to
+# a file in that directory every METRICS_FLUSH_INTERVAL seconds (from a
+# background thread), and scrapes add up the files of every process. The
+# directory should be emptied when the server starts, as files of old
+# processes are kept (so that counters never go down).
+
+COUNTERS = {
+    "todo_http_requests_total": "Requests handled, by URL name, method and status.",
+    "todo_db_queries_total": "Database queries made by requests, by URL name.",
+    "todo_db_query_seconds_total": "Time spent in database queries by requests, by URL name.",
+    "todo_fragment_cache_hits_total": "Rendered fragments found in the cache.",
+    "todo_fragment_cache_misses_total": "Rendered fragments not found in the cache.",
+    "todo_fragment_cache_invalidations_total": "Times the fragments of a todo were invalidated.",
+    "todo_model_writes_total": "ToDos and Tasks added, changed and deleted, by model and action.",
+    "todo_jobs_total": "Background jobs run, by name and result (succeeded, retried or failed).",
+}
+
+HISTOGRAMS = {
+    "todo_http_request_duration_seconds": "Time taken to respond to requests, by URL name.",
+}
+
+# The upper bounds of the latency histogram buckets, in seconds.
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+class _Shard:
+    """
+    The metrics recorded by one thread.
+    """
+
+    def __init__(self):
+        # (name, labels) -> value
+        self.counters = {}
+        # (name, labels) -> [count in each bucket (and +Inf)..., sum, count]
+        self.histograms = {}
+
+_local = threading.local()
+_shardsLock = threading.Lock()
+_shards = []
+
+_flusherLock = threading.Lock()
+_flusherPid = None
+
+def _get_shard():
+    shard = getattr(_local, "shard", None)
+    if shard == None:
+        # Only done once per thread.
+        shard = _Shard()
+        with _shardsLock:
+            _shards.append(shard)
+        _local.shard = shard
+    return shard
+
+def _reset_after_fork():
+    # A forked process starts counting from zero, rather than counting the
+    # metrics of its parent again.
+    global _local, _shardsLock, _shards, _flusherLock, _flusherPid
+    _local = threading.local()
+    # Another thread could have been holding the locks when the process
+    # was forked.
+    _shardsLock = threading.Lock()
+    _shards = []
+    _flusherLock = threading.Lock()
+    _flusherPid = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+def inc(name, labels=(), amount=1):
+    """
+    Adds to a counter.
+
+    Params:
+        - name: str, one of COUNTERS
+        - labels: tuple of (label, value) pairs
+        - amount: int or float
+    """
+    counters = _get_shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + amount
+
+def observe(name, labels, value):
+    """
+    Adds a value (e.g. a latency in seconds) to a histogram.
+    """
+    histograms = _get_shard().histograms
+    key = (name, labels)
+    histogram = histograms.get(key)
+    if histogram == None:
+        histogram = [0] * (len(BUCKETS) + 3)
+        histograms[key] = histogram
+    histogram[bisect.bisect_left(BUCKETS, value)] += 1
+    histogram[-2] += value
+    histogram[-1] += 1
+
+def count_writes(model, action, amount=1):
+    """
+    Counts ToDos or Tasks being "added", "changed" or "deleted".
+    """
+    if amount:
+        inc("todo_model_writes_total", (("model", model), ("action", action)), amount)
+
+def _collect_local():
+    """
+    Adds up the shards of this process.
+
+    returns: (counters, histograms)
+    """
+    with _shardsLock:
+        shards = list(_shards)
+
+    counters = {}
+    histograms = {}
+    for shard in shards:
+        # Copying a dictionary or list can't be interrupted by the thread
+        # writing to it.
+        for key, value in shard.counters.copy().items():
+            counters[key] = counters.get(key, 0) + value
+        for key, histogram in shard.histograms.copy().items():
+            histogram = list(histogram)
+            if key in histograms:
+                histogram = [total + value for total, value in zip(histograms[key], histogram)]
+            histograms[key] = histogram
+    return (counters, histograms)
+
+def get_value(name, labels=()):
+    """
+    Returns the value of a counter in this process.
+    """
+    counters, histograms = _collect_local()
+    return counters.get((name, labels), 0)
+
+# Multi-process mode.
+
+def _get_metrics_path(directory, pid):
+    return os.path.join(directory, f"metrics-{pid}.json")
+
+def flush(directory=None):
+    """
+    Writes the metrics of this process to its file in a directory
+    (METRICS_DIR by default).
+    """
+    counters, histograms = _collect_local()
+    data = {
+        "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+        "histograms": [[name, labels, values] for (name, labels), values in histograms.items()],
+    }
+    path = _get_metrics_path(directory or settings.METRICS_DIR, os.getpid())
+    # Replacing the file in one go, so a scrape never reads half of it.
+    temporaryPath = f"{path}.tmp"
+    with open(temporaryPath, "w") as file:
+        json.dump(data, file)
+    os.replace(temporaryPath, path)
+
+def _flush_forever(directory, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush(directory)
+        except OSError:
+            # Trying again next time.
+            pass
+
+def ensure_flusher():
+    """
+    Starts the thread writing the metrics of this process to METRICS_DIR
+    (once per process), if it is set.
+    """
+    global _flusherPid
+    if not settings.METRICS_DIR or _flusherPid == os.getpid():
+        return
+    with _flusherLock:
+        if _flusherPid == os.getpid():
+            return
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        # The directory is passed in, so the files always go to the one
+        # the thread was started for.
+        threading.Thread(target=_flush_forever,
+            args=(settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL), daemon=True).start()
+        _flusherPid = os.getpid()
+
+def collect():
+    """
+    Adds up the metrics of this process, and of every other process if
+    METRICS_DIR is set.
+
+    returns: (counters, histograms)
+    """
+    if not settings.METRICS_DIR:
+        return _collect_local()
+
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    flush()
+    counters = {}
+    histograms = {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, "metrics-*.json")):
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data["histograms"]:
+            key = (name, tuple(tuple(label) for label in labels))
+            if key in histograms:
+                values = [total + value for total, value in zip(histograms[key], values)]
+            histograms[key] = values
+    return (counters, histograms)
+
+# The Prometheus text format.
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for label, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{label}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _format_number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+def gen_metrics_text():
+    """
+    Returns the metrics in the Prometheus text format.
+    """
+    counters, histograms = collect()
+    lines = []
+
+    for name, help in COUNTERS.items():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} counter"]
+        values = sorted((labels, value) for (counterName, labels), value in counters.items()
+            if counterName == name)
+        for labels, value in values:
+            lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+
+    for name, help in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+        values = sorted((labels, histogram) for (histogramName, labels), histogram
+            in histograms.items() if histogramName == name)
+        for labels, histogram in values:
+            # The buckets are stored separately, but reported cumulatively.
+            total = 0
+            for bound, count in zip(BUCKETS + ["+Inf"], histogram):
+                total += count
+                bucketLabels = labels + (("le", bound if bound == "+Inf" else repr(bound)),)
+                lines.append(f"{name}_bucket{_format_labels(bucketLabels)} {total}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(histogram[-2])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+# Recording requests.
+
+_currentRequest = contextvars.ContextVar("todo_metrics_request", default=None)
+
+class _RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.dbTime = 0.0
+
+def _count_query(execute, sql, params, many, context):
+    # Installed on each connection once, only counting queries made while a
+    # request is being handled.
+    stats = _currentRequest.get()
+    if stats == None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.dbTime += time.perf_counter() - start
+        stats.queries += 1
+
+def install_query_counter(sender=None, connection=connection, **kwargs):
+    """
+    Adds the query counter to a connection (also a connection_created
+    receiver, see apps.py, which covers the threads the async ORM runs in).
+    """
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+class MetricsMiddleware:
+    """
+    Records the latency, status and queries of every request. Not used at
+    all unless METRICS_ENABLED is set.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        install_query_counter()
+        stats = _RequestStats()
+        token = _currentRequest.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _currentRequest.reset(token)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        stats = _RequestStats()
+        token = _currentRequest.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _currentRequest.reset(token)
+        self.record(request, response, stats, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, stats, duration):
+        ensure_flusher()
+        resolverMatch = request.resolver_match
+        view = (resolverMatch.url_name if resolverMatch != None else None) or "unmatched"
+
+        inc("todo_http_requests_total", (("view", view), ("method", request.method),
+            ("status", str(response.status_code))))
+        inc("todo_db_queries_total", (("view", view),), stats.queries)
+        inc("todo_db_query_seconds_total", (("view", view),), stats.dbTime)
+        observe("todo_http_request_duration_seconds", (("view", view),), duration)
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+# Kept in sync with todo.ordering.POSITION_GAP when this migration was made.
+POSITION_GAP = 1024
+
+
+def spread_positions(apps, schema_editor):
+    """
+    Spreads the dense positions of existing todos (per user) and tasks (per 
+    todo) out to the sparse positions used for reordering, keeping their 
+    order.
+    """
+    ToDo = apps.get_model("todo", "ToDo")
+    Task = apps.get_model("todo", "Task")
+
+    for model, parentField in ((ToDo, "user_id"), (Task, "belongsTo_id")):
+        changedItems = []
+        parentId = None
+        index = 0
+        for item in model.objects.order_by(parentField, "position", "id").only("id", parentField, "position").iterator():
+            if getattr(item, parentField) != parentId:
+                parentId = getattr(item, parentField)
+                index = 0
+            index += 1
+            item.position = index * POSITION_GAP
+            changedItems.append(item)
+
+            if len(changedItems) >= 500:
+                model.objects.bulk_update(changedItems, ["position"])
+                changedItems = []
+
+        model.objects.bulk_update(changedItems, ["position"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0014_task_createdby'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['belongsTo', 'position', 'id'], name='task_todo_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['user', 'position', 'id'], name='todo_user_position_idx'),
+        ),
+        migrations.RunPython(spread_positions, migrations.RunPython.noop),
+    ]
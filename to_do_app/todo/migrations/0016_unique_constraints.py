@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:10
+
+import hashlib
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_desc_hashes_and_dedupe(apps, schema_editor):
+    """
+    Fills in the descHash of existing todos, and makes sure no existing rows
+    break the new unique constraints (which could have happened if two 
+    requests raced past the old checks in the views):
+        - duplicate shares are removed, keeping the first.
+        - duplicate todos and tasks have their id added to their title.
+    """
+    ToDo = apps.get_model("todo", "ToDo")
+    Task = apps.get_model("todo", "Task")
+    SharedWith = apps.get_model("todo", "SharedWith")
+
+    changedToDos = []
+    for toDo in ToDo.objects.only("id", "desc").iterator():
+        toDo.descHash = hashlib.sha256(toDo.desc.encode()).hexdigest()
+        changedToDos.append(toDo)
+    ToDo.objects.bulk_update(changedToDos, ["descHash"], batch_size=500)
+
+    seen = set()
+    duplicateToDos = []
+    for toDo in ToDo.objects.order_by("id").only("id", "user_id", "title", "descHash").iterator():
+        key = (toDo.user_id, toDo.title, toDo.descHash)
+        if key in seen:
+            toDo.title = f"{toDo.title[:240]} ({toDo.id})"
+            duplicateToDos.append(toDo)
+        seen.add(key)
+    ToDo.objects.bulk_update(duplicateToDos, ["title"], batch_size=500)
+
+    seen = set()
+    duplicateTasks = []
+    for task in Task.objects.order_by("id").only("id", "belongsTo_id", "title").iterator():
+        key = (task.belongsTo_id, task.title)
+        if key in seen:
+            task.title = f"{task.title[:240]} ({task.id})"
+            duplicateTasks.append(task)
+        seen.add(key)
+    Task.objects.bulk_update(duplicateTasks, ["title"], batch_size=500)
+
+    seen = set()
+    duplicateShareIds = []
+    for shareId, userId, toDoId in SharedWith.objects.order_by("id").values_list("id", "user_id", "todo_id").iterator():
+        if (userId, toDoId) in seen:
+            duplicateShareIds.append(shareId)
+        seen.add((userId, toDoId))
+    SharedWith.objects.filter(id__in=duplicateShareIds).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0015_position_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='todo',
+            name='descHash',
+            field=models.CharField(default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_desc_hashes_and_dedupe, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='todo',
+            constraint=models.UniqueConstraint(fields=('user', 'title', 'descHash'), name='todo_unique_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(fields=('belongsTo', 'title'), name='task_unique_title_per_todo'),
+        ),
+        migrations.AddConstraint(
+            model_name='sharedwith',
+            constraint=models.UniqueConstraint(fields=('user', 'todo'), name='sharedwith_unique_user_todo'),
+        ),
+    ]
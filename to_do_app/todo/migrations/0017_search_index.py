@@ -0,0 +1,84 @@
+from django.db import migrations
+
+# Kept in sync with todo.search when this migration was made (todo.search
+# creates the triggers again after every migrate, see apps.py).
+SEARCH_TABLE = "todo_search"
+
+CREATE_SEARCH_TABLE = f"""
+    CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+        title, body, toDoKey, kind UNINDEXED, itemId UNINDEXED, toDoId UNINDEXED,
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')
+"""
+
+SEARCH_TRIGGERS = [
+    f"""CREATE TRIGGER todo_search_todo_insert AFTER INSERT ON todo_todo BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, title, body, toDoKey, kind, itemId, toDoId)
+        VALUES (new.id * 2, new.title, new."desc", 't' || new.id, 'todo', new.id, new.id);
+    END""",
+    f"""CREATE TRIGGER todo_search_todo_update AFTER UPDATE OF title, "desc" ON todo_todo BEGIN
+        UPDATE {SEARCH_TABLE} SET title = new.title, body = new."desc" WHERE rowid = new.id * 2;
+    END""",
+    f"""CREATE TRIGGER todo_search_todo_delete AFTER DELETE ON todo_todo BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2;
+    END""",
+    f"""CREATE TRIGGER todo_search_task_insert AFTER INSERT ON todo_task BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, title, body, toDoKey, kind, itemId, toDoId)
+        VALUES (new.id * 2 + 1, new.title, '', 't' || new.belongsTo_id, 'task', new.id,
+            new.belongsTo_id);
+    END""",
+    f"""CREATE TRIGGER todo_search_task_update AFTER UPDATE OF title, belongsTo_id ON todo_task BEGIN
+        UPDATE {SEARCH_TABLE} SET title = new.title, toDoKey = 't' || new.belongsTo_id,
+            toDoId = new.belongsTo_id WHERE rowid = new.id * 2 + 1;
+    END""",
+    f"""CREATE TRIGGER todo_search_task_delete AFTER DELETE ON todo_task BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+
+TRIGGER_NAMES = [
+    "todo_search_todo_insert", "todo_search_todo_update", "todo_search_todo_delete",
+    "todo_search_task_insert", "todo_search_task_update", "todo_search_task_delete",
+]
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Creates the search index (SQLite only), its triggers, and indexes the
+    existing todos and tasks.
+    """
+    if schema_editor.connection.vendor != "sqlite":
+        return
+
+    schema_editor.execute(CREATE_SEARCH_TABLE)
+    for trigger in SEARCH_TRIGGERS:
+        schema_editor.execute(trigger)
+
+    schema_editor.execute(f"""
+        INSERT INTO {SEARCH_TABLE} (rowid, title, body, toDoKey, kind, itemId, toDoId)
+        SELECT id * 2, title, "desc", 't' || id, 'todo', id, id FROM todo_todo
+    """)
+    schema_editor.execute(f"""
+        INSERT INTO {SEARCH_TABLE} (rowid, title, body, toDoKey, kind, itemId, toDoId)
+        SELECT id * 2 + 1, title, '', 't' || belongsTo_id, 'task', id, belongsTo_id
+        FROM todo_task
+    """)
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+
+    for name in TRIGGER_NAMES:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0016_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
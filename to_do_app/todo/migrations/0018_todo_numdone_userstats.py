@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_done_tasks(apps, schema_editor):
+    """
+    Fills in the numDone of existing todos, and makes the UserStats of 
+    existing users.
+    """
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    ToDo = apps.get_model("todo", "ToDo")
+    Task = apps.get_model("todo", "Task")
+    UserStats = apps.get_model("todo", "UserStats")
+
+    doneTasks = (Task.objects
+        .filter(belongsTo=OuterRef("pk"), done=True)
+        .order_by()
+        .values("belongsTo")
+        .annotate(count=Count("id"))
+        .values("count"))
+    ToDo.objects.update(numDone=Coalesce(Subquery(doneTasks), 0))
+
+    totals = {row["user"]: row for row in ToDo.objects
+        .order_by()
+        .values("user")
+        .annotate(numOfToDos=Count("id"), numOfTasks=Sum("numOfTasks"), numDone=Sum("numDone"))}
+    stats = []
+    for userId in User.objects.values_list("id", flat=True).iterator():
+        row = totals.get(userId, {})
+        stats.append(UserStats(user_id=userId, numOfToDos=row.get("numOfToDos", 0),
+            numOfTasks=row.get("numOfTasks", 0), numDone=row.get("numDone", 0)))
+    UserStats.objects.bulk_create(stats, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('todo', '0017_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('numOfToDos', models.IntegerField(default=0)),
+                ('numOfTasks', models.IntegerField(default=0)),
+                ('numDone', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='numDone',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_done_tasks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0018_todo_numdone_userstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='todo',
+            name='todo_unique_per_user',
+        ),
+        migrations.AddField(
+            model_name='todo',
+            name='deletedAt',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(condition=models.Q(('deletedAt__isnull', False)), fields=['deletedAt'], name='todo_deleted_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='todo',
+            constraint=models.UniqueConstraint(condition=models.Q(('deletedAt__isnull', True)), fields=('user', 'title', 'descHash'), name='todo_unique_per_user'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0019_todo_deletedat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('args', models.JSONField(default=list)),
+                ('kwargs', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('Q', 'Queued'), ('F', 'Failed')], default='Q', max_length=1)),
+                ('runAt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimId', models.CharField(blank=True, max_length=32, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('maxAttempts', models.IntegerField(default=3)),
+                ('lastError', models.TextField(blank=True, default='')),
+                ('dateCreated', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'Q')), fields=['runAt', 'id'], name='job_queued_idx'), models.Index(condition=models.Q(('claimId__isnull', False)), fields=['claimId'], name='job_claim_idx')],
+            },
+        ),
+    ]
@@ -1,38 +1,151 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, F, Q, Subquery
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 import datetime
+import hashlib
 from enum import Enum
 
+from .cache import invalidate_todo
+from .events import gen_task_event, publish, publish_task_event
+from .metrics import count_writes
+
 class AccessLevel(models.TextChoices):
     READ = "R", "Read"
     WRITE = "W", "Write"
 
+class ToDoManager(models.Manager):
+    """
+    Leaves out todos that have been deleted (see ToDo.softDelete), whose
+    rows are only there until purge.py removes them.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(deletedAt__isnull=True)
 
 # Create your models here.
 class ToDo(models.Model):
     title = models.CharField(max_length=255)
     desc = models.CharField(max_length=2550)
+    # A hash of the description, so that todos can be checked for uniqueness
+    # with a (small) index rather than by comparing whole descriptions.
+    descHash = models.CharField(max_length=64, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     # Each ToDo can be reordered either:
-    # ... manually
+    # ... manually (see ordering.py)
     position = models.IntegerField() 
     # ... or automatically
     dateCreated = models.DateTimeField(auto_now_add=True)
     # Should be the same as the task that was last modified.
     lastModified = models.DateTimeField()
     numOfTasks = models.IntegerField(default=0)
+    # How many of the tasks are done.
+    numDone = models.IntegerField(default=0)
+    # When the todo was deleted, if it was (see softDelete).
+    deletedAt = models.DateTimeField(null=True, blank=True, editable=False)
+
+    # Only todos that haven't been deleted, allObjects has them all.
+    objects = ToDoManager()
+    allObjects = models.Manager()
 
     sharedUsers = []
     sharedUserStr = ""
 
     accessLevel = AccessLevel.WRITE
 
-    # Modifying the save method to update the last modified when saving.
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "position", "id"], name="todo_user_position_idx"),
+            # Finding the deleted todos left to purge.
+            models.Index(fields=["deletedAt"], condition=Q(deletedAt__isnull=False),
+                name="todo_deleted_idx"),
+        ]
+        constraints = [
+            # Each user can't have two todos with the same title and description
+            # (deleted todos don't count, so they can be made again straight away).
+            models.UniqueConstraint(fields=["user", "title", "descHash"],
+                condition=Q(deletedAt__isnull=True), name="todo_unique_per_user"),
+        ]
+
+    @staticmethod
+    def hashDesc(desc):
+        """
+        Returns the hash stored in descHash for a description.
+        """
+        return hashlib.sha256(desc.encode()).hexdigest()
+
+    # Modifying the save method to update the last modified and description 
+    # hash when saving.
     def save(self, *args, **kwargs):
         self.lastModified = datetime.datetime.now()
+        self.descHash = ToDo.hashDesc(self.desc)
+        isNewToDo = self._state.adding
+
+        with transaction.atomic():
+            super(ToDo, self).save(*args, **kwargs)
+            if isNewToDo:
+                UserStats.objects.filter(user=self.user_id).update(numOfToDos=F("numOfToDos") + 1)
+        count_writes("todo", "added" if isNewToDo else "changed")
+
+    def softDelete(self):
+        """
+        Call to delete the todo. It is hidden from everyone straight away
+        with a single UPDATE, and taken off its owners UserStats, but its
+        tasks and shares are left for purge.py to remove a chunk at a time,
+        so deleting a todo takes the same time however many tasks it has.
 
-        super(ToDo, self).save(*args, **kwargs)
+        returns: bool, False if the todo had already been deleted.
+        """
+        deletedAt = timezone.now()
+        toDo = ToDo.objects.filter(id=self.id)
+
+        with transaction.atomic():
+            # Taking the todos counts off its owners totals while it can still
+            # be read, then only deleting it once (if two requests race).
+            UserStats.objects.filter(Exists(toDo), user=self.user_id).update(
+                numOfToDos=F("numOfToDos") - 1,
+                numOfTasks=F("numOfTasks") - Subquery(toDo.values("numOfTasks")),
+                numDone=F("numDone") - Subquery(toDo.values("numDone")))
+            if not toDo.update(deletedAt=deletedAt):
+                return False
+            publish(self.id, {"type": "todo", "action": "deleted"})
+
+        self.deletedAt = deletedAt
+        invalidate_todo(self.id)
+        count_writes("todo", "deleted")
+        return True
+
+    @staticmethod
+    def updateCounts(toDoId, numOfTasks=0, numDone=0, lastModified=None):
+        """
+        Call to add to the numOfTasks and numDone of a todo and of its owners
+        UserStats (and set the lastModified of the todo, if given). The 
+        counts are added to in the database, so concurrent changes can't 
+        overwrite each other.
+
+        Params:
+            - toDoId: int
+            - numOfTasks, numDone: int or expression, how much to add
+            - lastModified: datetime or None
+        """
+        toDoUpdates = {}
+        if lastModified != None:
+            toDoUpdates["lastModified"] = lastModified
+        if numOfTasks:
+            toDoUpdates["numOfTasks"] = F("numOfTasks") + numOfTasks
+        if numDone:
+            toDoUpdates["numDone"] = F("numDone") + numDone
+        if toDoUpdates:
+            ToDo.objects.filter(id=toDoId).update(**toDoUpdates)
+
+        statsUpdates = {}
+        if numOfTasks:
+            statsUpdates["numOfTasks"] = F("numOfTasks") + numOfTasks
+        if numDone:
+            statsUpdates["numDone"] = F("numDone") + numDone
+        if statsUpdates:
+            owner = ToDo.objects.filter(id=toDoId).values("user")
+            UserStats.objects.filter(user=Subquery(owner)).update(**statsUpdates)
 
     def genShareUserList(self):
         """
@@ -50,6 +163,24 @@ class ToDo(models.Model):
         if sharedWith.exists():
             self.accessLevel = sharedWith[0].access
 
+    @staticmethod
+    def genShareDetails(toDos, userId):
+        """
+        Bulk version of genShareUserList and updateSharedAccessLevel.
+        Call on todos fetched with a "sharedwith_set" prefetch (with the
+        shared users selected) to fill in the sharedUsers of the todos the
+        user owns and the accessLevel of the todos shared with them, without
+        doing any more queries.
+        """
+        for toDo in toDos:
+            sharedWithList = toDo.sharedwith_set.all()
+            if userId == toDo.user_id:
+                toDo.sharedUsers = [sharedWith.user for sharedWith in sharedWithList]
+            else:
+                for sharedWith in sharedWithList:
+                    if sharedWith.user_id == userId:
+                        toDo.accessLevel = sharedWith.access
+
 
 class Task(models.Model):
     title = models.CharField(max_length=255)
@@ -60,44 +191,88 @@ class Task(models.Model):
     lastModified = models.DateTimeField(auto_now=True)
     position = models.IntegerField() 
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["belongsTo", "position", "id"], name="task_todo_position_idx"),
+        ]
+        constraints = [
+            # Each todo can't have two tasks with the same title.
+            models.UniqueConstraint(fields=["belongsTo", "title"], name="task_unique_title_per_todo"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        task = super().from_db(db, field_names, values)
+        # Remembering if the task was done when it was loaded, so save can 
+        # tell if it changed.
+        task._savedDone = task.__dict__.get("done")
+        return task
+
     # Modifying the save method to update the last modified and number of tasks
-    # of the ToDo that the task belongs to.
+    # (and done tasks) of the ToDo that the task belongs to.
     def save(self, *args, **kwargs):
-        toDo = ToDo.objects.get(id=self.belongsTo.id)
-        toDo.lastModified = datetime.datetime.now()
-        
-        # Checking if the current task exists in the database
-        isNewTask = False
-        try:
-            task = Task.objects.get(id=self.id)
-
-            # If this isn't a new task, then change the last modified field.
-            self.lastModified = datetime.datetime.now()
-        except:
-            isNewTask = True
-        
-        # If this is a new task, then also increase the numOfTasks of the 
-        # todo.
-        if isNewTask:
-            numTasks = toDo.numOfTasks
-            toDo.numOfTasks = numTasks + 1
-
-        toDo.save()
-
-        super(Task, self).save(*args, **kwargs)
+        # Checking if the current task exists in the database (without a query).
+        isNewTask = self._state.adding
+        numDone = 0
+
+        with transaction.atomic():
+            # Changing done with a compare-and-set, so the task is only
+            # counted as (un)done if this save is what changed it. Two 
+            # concurrent toggles from the same state only change it once.
+            if isNewTask:
+                numDone = 1 if self.done else 0
+            elif self.done != getattr(self, "_savedDone", None):
+                if Task.objects.filter(id=self.id, done=not self.done).update(done=self.done):
+                    numDone = 1 if self.done else -1
+
+            super(Task, self).save(*args, **kwargs)
+
+            # Updating the todo with a single UPDATE, adding to numOfTasks
+            # and numDone in the database so that concurrent changes can't
+            # overwrite each other.
+            ToDo.updateCounts(self.belongsTo_id, numOfTasks=1 if isNewTask else 0,
+                numDone=numDone, lastModified=timezone.now())
+
+            # Letting anyone viewing the todo know once this is committed.
+            publish_task_event(self, "added" if isNewTask else "changed")
+
+        self._savedDone = self.done
+        count_writes("task", "added" if isNewTask else "changed")
+
+    def toggleDone(self):
+        """
+        Call to mark the task as done if it isn't, or as not done if it is.
+        """
+        self.done = not self.done
+        self.save()
 
     # Modifying the delete method to update the last modified and number of tasks
-    # of the ToDo that the task belongs to.
+    # (and done tasks) of the ToDo that the task belongs to.
     def delete(self, *args, **kwargs):
-        toDo = ToDo.objects.get(id=self.belongsTo.id)
-        toDo.lastModified = datetime.datetime.now()
+        # Deleting the task clears its id, so making the event first.
+        event = gen_task_event(self, "deleted")
 
-        numTasks = toDo.numOfTasks
-        toDo.numOfTasks = numTasks - 1
+        with transaction.atomic():
+            # Deleting the row first, and only taking the task off the counts
+            # if this delete is what removed it, so deleting the same task 
+            # twice (e.g. a double clicked remove) only counts it once. A done
+            # task is deleted separately from one that isn't, so whether it
+            # was done comes from the row rather than self.done, which may be
+            # out of date.
+            numDone, _ = Task.objects.filter(id=self.id, done=True).delete()
+            numDeleted = numDone or Task.objects.filter(id=self.id).delete()[0]
+            if numDeleted:
+                ToDo.updateCounts(self.belongsTo_id, numOfTasks=-1, numDone=-numDone,
+                    lastModified=timezone.now())
+                publish(self.belongsTo_id, event)
 
-        toDo.save()
+        self.id = None
+        if numDeleted:
+            # Not done with a post_delete signal, see signals.py.
+            invalidate_todo(self.belongsTo_id)
+            count_writes("task", "deleted")
 
-        super(Task, self).delete(*args, **kwargs)
+        return (numDeleted, {self._meta.label: numDeleted})
 
 class SharedWith(models.Model):
     """
@@ -109,4 +284,56 @@ class SharedWith(models.Model):
     access = models.CharField(
         max_length=1, 
         choices=AccessLevel.choices,
-        default=AccessLevel.READ)
\ No newline at end of file
+        default=AccessLevel.READ)
+
+    class Meta:
+        constraints = [
+            # Each todo can only be shared with a user once.
+            models.UniqueConstraint(fields=["user", "todo"], name="sharedwith_unique_user_todo"),
+        ]
+
+class UserStats(models.Model):
+    """
+    Totals over the todos a user owns, kept up to date as they change (see
+    ToDo.updateCounts), so they can be shown without counting anything.
+    Made for each user when they are created (see signals.py).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+        related_name="stats")
+    numOfToDos = models.IntegerField(default=0)
+    numOfTasks = models.IntegerField(default=0)
+    numDone = models.IntegerField(default=0)
+
+class JobStatus(models.TextChoices):
+    QUEUED = "Q", "Queued"
+    FAILED = "F", "Failed"
+
+class Job(models.Model):
+    """
+    Work handed off to the run_jobs workers (see jobs.py). Jobs are deleted
+    once they have run, so only the queued jobs (including the ones being
+    run) and the ones that failed every attempt are kept.
+    """
+    # The dotted path of the function to call, and what to call it with.
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=1, choices=JobStatus.choices, default=JobStatus.QUEUED)
+    # When a worker can next take the job: when it was queued, when it
+    # should be retried, or when a worker running it is given up on.
+    runAt = models.DateTimeField(default=timezone.now)
+    # Set by the worker running the job (see jobs.claim_jobs).
+    claimId = models.CharField(max_length=32, null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    maxAttempts = models.IntegerField(default=3)
+    lastError = models.TextField(blank=True, default="")
+    dateCreated = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Finding the next jobs to run, and the ones a worker claimed.
+            models.Index(fields=["runAt", "id"], condition=Q(status=JobStatus.QUEUED),
+                name="job_queued_idx"),
+            models.Index(fields=["claimId"], condition=Q(claimId__isnull=False),
+                name="job_claim_idx"),
+        ]
@@ -0,0 +1,119 @@
+from django.db import transaction
+from django.db.models import Max, Q
+
+# ToDos and Tasks are ordered by a sparse integer position, with a gap left 
+# between neighbours so that moving an item only has to write that item's 
+# position (half way between its new neighbours). When a gap runs out, the 
+# positions of that list are spread back out with rebalance_positions.
+POSITION_GAP = 1024
+
+def next_position(siblings):
+    """
+    Used to get the position of an item added to the end of a list.
+
+    Params:
+        - siblings: QuerySet of the items in the list (e.g. the tasks of a todo)
+
+    returns: int
+    """
+    lastPosition = siblings.aggregate(lastPosition=Max("position"))["lastPosition"]
+    return _gen_next_position(lastPosition)
+
+async def anext_position(siblings):
+    """
+    Async version of next_position.
+    """
+    lastPosition = (await siblings.aaggregate(lastPosition=Max("position")))["lastPosition"]
+    return _gen_next_position(lastPosition)
+
+def _gen_next_position(lastPosition):
+    if lastPosition == None:
+        return POSITION_GAP
+    return lastPosition + POSITION_GAP
+
+def rebalance_positions(siblings):
+    """
+    Used to spread the positions of a list back out to POSITION_GAP apart,
+    keeping their current order.
+
+    Params:
+        - siblings: QuerySet of the items in the list
+
+    returns: int, the number of items whose position changed.
+    """
+    items = list(siblings.order_by("position", "id").only("id", "position"))
+    changedItems = []
+    for index, item in enumerate(items):
+        position = (index + 1) * POSITION_GAP
+        if item.position != position:
+            item.position = position
+            changedItems.append(item)
+
+    siblings.model.objects.bulk_update(changedItems, ["position"], batch_size=500)
+    return len(changedItems)
+
+def _gen_position(item, siblings, afterId):
+    """
+    Works out the position to move an item to, so that it comes straight
+    after the item with id afterId (or first if afterId is None).
+
+    returns: (position, errorMessage)
+        - position
+            - int, or None if there is no gap left between the new neighbours.
+    """
+    others = siblings.exclude(id=item.id).order_by("position", "id")
+
+    # Moving to the start of the list.
+    if afterId == None:
+        firstPosition = others.values_list("position", flat=True).first()
+        if firstPosition == None:
+            return (POSITION_GAP, None)
+        return (firstPosition - POSITION_GAP, None)
+
+    afterPosition = others.filter(id=afterId).values_list("position", flat=True).first()
+    if afterPosition == None:
+        return (None, f"There is no item with id {afterId} in this list.")
+
+    # Finding the item currently straight after the one we're moving after.
+    nextPosition = (others
+        .filter(Q(position__gt=afterPosition) | Q(position=afterPosition, id__gt=afterId))
+        .values_list("position", flat=True)
+        .first())
+    if nextPosition == None:
+        return (afterPosition + POSITION_GAP, None)
+    if nextPosition - afterPosition < 2:
+        return (None, None)
+    return ((afterPosition + nextPosition) // 2, None)
+
+def move_item(item, siblings, afterId):
+    """
+    Used to move a ToDo or Task within its list, so that it comes straight 
+    after the item with id afterId (or first if afterId is None).
+    Usually only the moved item is written, the list is only rebalanced if 
+    there is no gap left between the new neighbours.
+
+    Params:
+        - item: models.ToDo or models.Task
+        - siblings: QuerySet of the items in the list, including item
+        - afterId: int or None
+
+    returns: errorMessage
+        - A string with the error message if the item cannot be moved there.
+        - None otherwise.
+    """
+    if afterId == item.id:
+        return "An item cannot be moved after itself."
+
+    with transaction.atomic():
+        position, errorMessage = _gen_position(item, siblings, afterId)
+
+        # If there is no gap left, spread the list back out and try again.
+        if errorMessage == None and position == None:
+            rebalance_positions(siblings)
+            position, errorMessage = _gen_position(item, siblings, afterId)
+
+        if errorMessage == None:
+            item.position = position
+            siblings.model.objects.filter(id=item.id).update(position=position)
+
+    return errorMessage
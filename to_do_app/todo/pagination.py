@@ -0,0 +1,105 @@
+from django.db.models import Q
+from django.utils.http import urlencode
+
+# Lists are paginated with a cursor (the sort key of the last item on the 
+# page) rather than an offset, so the database can seek straight to the 
+# start of any page using the (parent, position, id) indexes.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(item):
+    """
+    Encodes the sort key of an item (a model instance, or a dictionary from
+    QuerySet.values) into a cursor for the page after it.
+    """
+    if isinstance(item, dict):
+        return f"{item['position']}_{item['id']}"
+    return f"{item.position}_{item.id}"
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor made by encode_cursor.
+
+    returns: ((position, id), errorMessage)
+    """
+    try:
+        position, id = cursor.split("_")
+        return ((int(position), int(id)), None)
+    except ValueError:
+        return (None, f"Invalid page cursor {cursor}.")
+
+def get_page_size(request):
+    """
+    Gets the page size asked for in a request, limited to MAX_PAGE_SIZE.
+    """
+    try:
+        pageSize = int(request.GET.get("pageSize", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        pageSize = DEFAULT_PAGE_SIZE
+    return max(1, min(pageSize, MAX_PAGE_SIZE))
+
+def get_keyset_page(queryset, request):
+    """
+    Used to get one page of a queryset of todos or tasks, ordered by position
+    and then id. The page starts after the cursor in the "after" GET 
+    parameter (or at the start if there isn't one, or it is invalid).
+
+    Params:
+        - queryset: QuerySet of models.ToDo or models.Task (values querysets
+        must include the position and id)
+        - request: HttpRequest
+
+    returns: (items, nextPageQuery, errorMessage)
+        - items
+            - A list of the items on the page.
+        - nextPageQuery
+            - The query string for the next page, None if this is the last.
+        - errorMessage
+            - A string with the error message if the cursor is invalid (the
+            items are the first page then).
+            - None otherwise.
+    """
+    queryset, pageSize, errorMessage = _gen_page_queryset(queryset, request)
+    return _gen_page(list(queryset), pageSize, errorMessage)
+
+async def aget_keyset_page(queryset, request):
+    """
+    Async version of get_keyset_page.
+    """
+    queryset, pageSize, errorMessage = _gen_page_queryset(queryset, request)
+    return _gen_page([item async for item in queryset], pageSize, errorMessage)
+
+def _gen_page_queryset(queryset, request):
+    """
+    Limits a queryset to the page asked for in a request (see 
+    get_keyset_page).
+
+    returns: (queryset, pageSize, errorMessage)
+    """
+    pageSize = get_page_size(request)
+    queryset = queryset.order_by("position", "id")
+
+    errorMessage = None
+    cursor = request.GET.get("after")
+    if cursor:
+        afterKey, errorMessage = decode_cursor(cursor)
+        # Starting at the first page if the cursor is invalid (e.g. a link
+        # that has been edited).
+        if errorMessage == None:
+            position, id = afterKey
+            queryset = queryset.filter(Q(position__gt=position) | Q(position=position, id__gt=id))
+
+    # Fetching one extra item to find out if there is another page.
+    return (queryset[:pageSize + 1], pageSize, errorMessage)
+
+def _gen_page(items, pageSize, errorMessage):
+    """
+    Splits the items fetched by a page queryset into the page and the query
+    string for the next page.
+    """
+    nextPageQuery = None
+    if len(items) > pageSize:
+        items = items[:pageSize]
+        nextPageQuery = urlencode({"after": encode_cursor(items[-1]), "pageSize": pageSize})
+
+    return (items, nextPageQuery, errorMessage)
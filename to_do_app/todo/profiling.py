@@ -0,0 +1,231 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.exceptions import TemplateDoesNotExist
+
+import collections
+import contextvars
+import random
+import threading
+import time
+
+# Profiling of a sample of requests (see PROFILING_ENABLED and
+# PROFILING_SAMPLE_RATE in settings.py). For each sampled request the
+# middleware records the time spent in the database (and the number of
+# queries), rendering templates and in the whole view. They are sent back in
+# a Server-Timing header (shown by the network tab of browser dev tools) and
+# added to a report for the process, by URL name (see get_profile_stats and
+# the profile_stats API endpoint).
+#
+# The request being profiled is kept in a context variable, which is copied
+# into the threads sync_to_async runs the ORM in, so queries made by the
+# async views are counted too. Requests that aren't sampled only pay for a
+# random number and a context variable lookup.
+
+# How many of the latest request times are kept for each URL name, for the
+# percentiles in the report.
+MAX_SAMPLES = 1000
+
+_current = contextvars.ContextVar("todo_profile", default=None)
+
+class Profile:
+    """
+    The timings of one request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.dbTime = 0.0
+        self.templateTime = 0.0
+        self.templateDepth = 0
+
+    def time_query(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper timing each query.
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.dbTime += time.perf_counter() - start
+            self.queries += 1
+
+def _time_query(execute, sql, params, many, context):
+    # Installed on each connection once, only timing queries made while a
+    # request is being profiled.
+    profile = _current.get()
+    if profile == None:
+        return execute(sql, params, many, context)
+    return profile.time_query(execute, sql, params, many, context)
+
+def _install_query_timer():
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+class _TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        profile = _current.get()
+        # Templates rendered inside another template are part of its time.
+        if profile == None or profile.templateDepth:
+            return super().render(context, request)
+
+        profile.templateDepth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile.templateTime += time.perf_counter() - start
+            profile.templateDepth -= 1
+
+class ProfilingTemplates(DjangoTemplates):
+    """
+    The Django template backend, timing how long templates take to render in
+    profiled requests (see TEMPLATES in settings.py).
+    """
+
+    def from_string(self, template_code):
+        return _TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return _TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+class ProfileStats:
+    """
+    The timings of the profiled requests of this process, by URL name.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.urls = {}
+
+    def add(self, urlName, profile, totalTime):
+        with self.lock:
+            stats = self.urls.get(urlName)
+            if stats == None:
+                stats = {
+                    "requests": 0,
+                    "queries": 0,
+                    "dbTime": 0.0,
+                    "templateTime": 0.0,
+                    "totalTime": 0.0,
+                    "times": collections.deque(maxlen=MAX_SAMPLES),
+                }
+                self.urls[urlName] = stats
+            stats["requests"] += 1
+            stats["queries"] += profile.queries
+            stats["dbTime"] += profile.dbTime
+            stats["templateTime"] += profile.templateTime
+            stats["totalTime"] += totalTime
+            stats["times"].append(totalTime)
+
+    def report(self):
+        """
+        returns: dict, the mean queries and mean/percentile times (in ms) of
+        each URL name.
+        """
+        with self.lock:
+            urls = {urlName: dict(stats, times=sorted(stats["times"]))
+                for urlName, stats in self.urls.items()}
+
+        report = {}
+        for urlName, stats in urls.items():
+            requests = stats["requests"]
+            times = stats["times"]
+
+            def percentile(fraction):
+                return round(times[min(len(times) - 1, int(len(times) * fraction))] * 1000, 2)
+
+            report[urlName] = {
+                "requests": requests,
+                "queries": round(stats["queries"] / requests, 1),
+                "dbMs": round(stats["dbTime"] / requests * 1000, 2),
+                "templateMs": round(stats["templateTime"] / requests * 1000, 2),
+                "totalMs": round(stats["totalTime"] / requests * 1000, 2),
+                "p50Ms": percentile(0.5),
+                "p95Ms": percentile(0.95),
+                "p99Ms": percentile(0.99),
+            }
+        return report
+
+    def reset(self):
+        with self.lock:
+            self.urls = {}
+
+stats = ProfileStats()
+
+def get_profile_stats():
+    """
+    Returns the report of the profiled requests of this process, by URL name.
+    """
+    return stats.report()
+
+def _gen_server_timing(profile, totalTime):
+    return ", ".join([
+        f'db;dur={profile.dbTime * 1000:.2f};desc="{profile.queries} queries"',
+        f"tpl;dur={profile.templateTime * 1000:.2f}",
+        f"total;dur={totalTime * 1000:.2f}",
+    ])
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of requests (see the top of this file). Not used at all
+    unless PROFILING_ENABLED is set.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sampleRate = settings.PROFILING_SAMPLE_RATE
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if random.random() >= self.sampleRate:
+            return self.get_response(request)
+
+        _install_query_timer()
+        profile = Profile()
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sampleRate:
+            return await self.get_response(request)
+
+        # The async ORM makes its queries on the connection of the thread
+        # sync_to_async runs it in.
+        await sync_to_async(_install_query_timer)()
+        profile = Profile()
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        # Streamed responses are timed until they start, not until they
+        # finish.
+        totalTime = time.perf_counter() - profile.start
+        response["Server-Timing"] = _gen_server_timing(profile, totalTime)
+
+        resolverMatch = request.resolver_match
+        urlName = resolverMatch.url_name if resolverMatch != None else None
+        stats.add(urlName or "unknown", profile, totalTime)
+        return response
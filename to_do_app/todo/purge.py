@@ -0,0 +1,184 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+import collections
+import time
+
+from .cache import invalidate_todo
+from .events import gen_task_event, publish
+from .jobs import enqueue
+from .models import ToDo, Task, SharedWith, UserStats
+
+# Removing deleted todos (and users) a chunk at a time (see the
+# purge_deleted command).
+#
+# Deleting a todo only hides it (see ToDo.softDelete), as deleting its row
+# makes Django load every task and share of it into memory, and deletes them
+# all in one transaction holding the write lock. Here, the rows are deleted
+# at most chunkSize rows at a time, each chunk committed on its own, so the
+# write lock is never held for longer than one chunk takes. Tasks go first
+# (nothing listens for them being deleted, so Django deletes them without
+# loading them), then shares, and then the todos that have nothing left
+# pointing at them (both loaded a chunk at a time for their signals, see
+# signals.py).
+#
+# Deleted todos are purged by a background job queued when they are deleted
+# (see delete_todo and jobs.py), and any left over by the purge_deleted
+# command.
+
+# How many rows are deleted at a time.
+PURGE_CHUNK_SIZE = 1000
+
+# How long to wait between chunks (in seconds), letting requests waiting for
+# the write lock go first.
+PURGE_PAUSE = 0.01
+
+def _delete_chunk(queryset, chunkSize):
+    """
+    Deletes up to chunkSize rows of a queryset.
+
+    returns: int, the number of rows deleted.
+    """
+    model = queryset.model
+    ids = list(queryset.order_by().values_list("id", flat=True)[:chunkSize])
+    numDeleted, numDeletedByModel = model._base_manager.filter(id__in=ids).delete()
+    return numDeletedByModel.get(model._meta.label, 0)
+
+def _delete_in_chunks(queryset, chunkSize, pause):
+    """
+    Deletes every row of a queryset, a chunk at a time.
+
+    returns: int, the number of rows deleted.
+    """
+    numDeleted = 0
+    while True:
+        numDeletedInChunk = _delete_chunk(queryset, chunkSize)
+        numDeleted += numDeletedInChunk
+        if numDeletedInChunk < chunkSize:
+            return numDeleted
+        time.sleep(pause)
+
+def purge_deleted(chunkSize=PURGE_CHUNK_SIZE, pause=PURGE_PAUSE, userId=None):
+    """
+    Used to remove the deleted todos (of one user or everyone), with their
+    tasks and shares.
+
+    Params:
+        - chunkSize: int, how many rows are deleted at a time
+        - pause: float, how long to wait between chunks (in seconds)
+        - userId: int, to only remove the deleted todos of one user, or None
+
+    returns: dict, the number of todos, tasks and shares removed.
+    """
+    deletedToDos = ToDo.allObjects.filter(deletedAt__isnull=False)
+    if userId != None:
+        deletedToDos = deletedToDos.filter(user=userId)
+
+    result = {"toDos": 0, "tasks": 0, "shares": 0}
+    result["tasks"] = _delete_in_chunks(Task.objects.filter(belongsTo__in=deletedToDos),
+        chunkSize, pause)
+    result["shares"] = _delete_in_chunks(SharedWith.objects.filter(todo__in=deletedToDos),
+        chunkSize, pause)
+
+    # Todos given a task while they were being deleted are left for next
+    # time, rather than deleting their row from under the task.
+    emptyToDos = (deletedToDos
+        .exclude(Exists(Task.objects.filter(belongsTo=OuterRef("pk"))))
+        .exclude(Exists(SharedWith.objects.filter(todo=OuterRef("pk")))))
+    result["toDos"] = _delete_in_chunks(emptyToDos, chunkSize, pause)
+    return result
+
+def delete_todo(toDo):
+    """
+    Used by views to delete a todo. It is hidden straight away (see
+    ToDo.softDelete), and purged by a background job.
+    """
+    with transaction.atomic():
+        if toDo.softDelete():
+            enqueue(purge_deleted, userId=toDo.user_id)
+
+def _soft_delete_user_todos(userId):
+    """
+    Deletes every todo a user owns at once (see ToDo.softDelete).
+    """
+    with transaction.atomic():
+        toDoIds = list(ToDo.objects.filter(user=userId).values_list("id", flat=True))
+        ToDo.objects.filter(user=userId).update(deletedAt=timezone.now())
+        UserStats.objects.filter(user=userId).update(numOfToDos=0, numOfTasks=0, numDone=0)
+        for toDoId in toDoIds:
+            publish(toDoId, {"type": "todo", "action": "deleted"})
+
+    for toDoId in toDoIds:
+        invalidate_todo(toDoId)
+
+def _delete_created_tasks_chunk(userId, chunkSize):
+    """
+    Deletes up to chunkSize of the tasks a user made in other users todos,
+    taking them off the counts of those todos.
+
+    returns: int, the number of tasks deleted.
+    """
+    with transaction.atomic():
+        tasks = list(Task.objects
+            .filter(createdBy=userId)
+            .only("id", "title", "done", "position", "belongsTo")[:chunkSize])
+        Task.objects.filter(id__in=[task.id for task in tasks]).delete()
+
+        numOfTasks = collections.Counter(task.belongsTo_id for task in tasks)
+        numDone = collections.Counter(task.belongsTo_id for task in tasks if task.done)
+        for toDoId, numOfToDoTasks in numOfTasks.items():
+            ToDo.updateCounts(toDoId, numOfTasks=-numOfToDoTasks, numDone=-numDone[toDoId],
+                lastModified=timezone.now())
+        for task in tasks:
+            publish(task.belongsTo_id, gen_task_event(task, "deleted"))
+
+    for toDoId in numOfTasks:
+        invalidate_todo(toDoId)
+    return len(tasks)
+
+def _delete_shares_chunk(userId, chunkSize):
+    """
+    Deletes up to chunkSize of the shares of other users todos with a user
+    (their signals let anyone viewing those todos know, see signals.py).
+
+    returns: int, the number of shares deleted.
+    """
+    return _delete_chunk(SharedWith.objects.filter(user=userId), chunkSize)
+
+def purge_user(userId, chunkSize=PURGE_CHUNK_SIZE, pause=PURGE_PAUSE):
+    """
+    Used to delete a user and everything they own, a chunk at a time (it
+    can be run as a background job). The user can't log in from the start,
+    and their todos are hidden straight away, like ToDo.softDelete.
+
+    Params:
+        - userId: int
+        - chunkSize: int, how many rows are deleted at a time
+        - pause: float, how long to wait between chunks (in seconds)
+
+    returns: dict, the number of todos, tasks and shares removed.
+    """
+    user = User.objects.filter(id=userId).first()
+    if user == None:
+        return {"toDos": 0, "tasks": 0, "shares": 0}
+
+    # Saved rather than updated, so the cached user is thrown away too (see
+    # accounts/signals.py).
+    user.is_active = False
+    user.save(update_fields=["is_active"])
+    _soft_delete_user_todos(user.id)
+
+    result = purge_deleted(chunkSize, pause, userId=user.id)
+    for key, deleteChunk in [("tasks", _delete_created_tasks_chunk), ("shares", _delete_shares_chunk)]:
+        while True:
+            numDeleted = deleteChunk(user.id, chunkSize)
+            result[key] += numDeleted
+            if numDeleted < chunkSize:
+                break
+            time.sleep(pause)
+
+    # Only the users own rows (like their UserStats) are left to cascade.
+    User.objects.filter(id=user.id).delete()
+    return result
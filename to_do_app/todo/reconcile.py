@@ -0,0 +1,173 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Greatest
+
+import collections
+
+from .models import ToDo, Task, UserStats
+
+# Fixing the denormalized counters (the numOfTasks, numDone and lastModified
+# of todos, and the UserStats of users) when they have drifted from the
+# tasks, e.g. after tasks were changed with bulk queries or in the admin
+# (see the reconcile_counters command).
+#
+# Users are checked a chunk at a time (by id). For each chunk, the tasks of
+# all of their todos are counted with one grouped aggregate query, and the
+# todos and UserStats that are wrong are fixed with one UPDATE per distinct
+# fix, in a transaction that locks the rows it reads (on SQLite, the
+# production profile takes the write lock at the start of it). The fixes add
+# the difference to the counters and only ever move lastModified forwards,
+# so writes made while the command runs are never overwritten.
+
+# How many users are checked at a time.
+RECONCILE_CHUNK_SIZE = 1000
+
+# How many rows are fixed by each UPDATE.
+FIX_BATCH_SIZE = 500
+
+COUNTER_FIELDS = ["numOfToDos", "numOfTasks", "numDone"]
+
+def _get_diff(stored, actual):
+    """
+    returns: dict, {field: (stored value, actual value)} of the fields that
+    are different.
+    """
+    return {field: (stored[field], value) for field, value in actual.items()
+        if stored[field] != value}
+
+def _reconcile_chunk(userIds, dryRun, report):
+    """
+    Checks (and fixes, unless dryRun) the todos and UserStats of some users.
+
+    returns: (number of todos checked, number of todos wrong, number of
+    users wrong)
+    """
+    lowId, highId = userIds[0], userIds[-1]
+    wrongToDos = []
+    wrongStats = []
+    newStats = []
+
+    with transaction.atomic():
+        toDos = list(ToDo.objects
+            .select_for_update()
+            .filter(user__gte=lowId, user__lte=highId)
+            .values("id", "user_id", "numOfTasks", "numDone", "lastModified"))
+        stats = {row["user_id"]: row for row in UserStats.objects
+            .select_for_update()
+            .filter(user__gte=lowId, user__lte=highId)
+            .values("user_id", *COUNTER_FIELDS)}
+
+        # The one grouped aggregate over the tasks of every todo in the chunk.
+        taskCounts = {row["belongsTo"]: row for row in Task.objects
+            .filter(belongsTo__user__gte=lowId, belongsTo__user__lte=highId)
+            .order_by()
+            .values("belongsTo")
+            .annotate(numOfTasks=Count("id"), numDone=Count("id", filter=Q(done=True)),
+                lastModified=Max("lastModified"))}
+
+        totals = {userId: dict.fromkeys(COUNTER_FIELDS, 0) for userId in userIds}
+        for toDo in toDos:
+            counts = taskCounts.get(toDo["id"], {"numOfTasks": 0, "numDone": 0, "lastModified": None})
+            diff = _get_diff(toDo, {"numOfTasks": counts["numOfTasks"], "numDone": counts["numDone"]})
+            # A todo is modified whenever its tasks are, so it is only wrong
+            # if a task was modified after it.
+            if counts["lastModified"] != None and counts["lastModified"] > toDo["lastModified"]:
+                diff["lastModified"] = (toDo["lastModified"], counts["lastModified"])
+            if diff:
+                report("todo", toDo["id"], diff)
+                wrongToDos.append((toDo["id"], diff))
+
+            # The users totals, from the tasks rather than the (maybe
+            # wrong) counters of their todos.
+            userTotals = totals.setdefault(toDo["user_id"], dict.fromkeys(COUNTER_FIELDS, 0))
+            userTotals["numOfToDos"] += 1
+            userTotals["numOfTasks"] += counts["numOfTasks"]
+            userTotals["numDone"] += counts["numDone"]
+
+        for userId, userTotals in totals.items():
+            if userId not in stats:
+                report("user", userId, {field: (None, value) for field, value in userTotals.items()})
+                newStats.append(UserStats(user_id=userId, **userTotals))
+                continue
+            diff = _get_diff(stats[userId], userTotals)
+            if diff:
+                report("user", userId, diff)
+                wrongStats.append((userId, diff))
+
+        if not dryRun:
+            _fix(ToDo, wrongToDos)
+            _fix(UserStats, wrongStats)
+            UserStats.objects.bulk_create(newStats, ignore_conflicts=True)
+
+    return (len(toDos), len(wrongToDos), len(wrongStats) + len(newStats))
+
+def _gen_last_modified_fix():
+    # The latest lastModified of the tasks of a todo, read by the UPDATE.
+    lastModified = (Task.objects
+        .filter(belongsTo=OuterRef("pk"))
+        .order_by()
+        .values("belongsTo")
+        .annotate(lastModified=Max("lastModified"))
+        .values("lastModified"))
+    return Greatest(F("lastModified"), Subquery(lastModified))
+
+def _fix(model, wrongRows):
+    """
+    Fixes the counters of todos or UserStats, adding the difference to each
+    wrong counter. Rows needing the same fix (usually most of them) are
+    fixed with one UPDATE.
+    """
+    fixes = collections.defaultdict(list)
+    for pk, diff in wrongRows:
+        fix = []
+        for field, (stored, actual) in sorted(diff.items()):
+            fix.append((field, None if field == "lastModified" else actual - stored))
+        fixes[tuple(fix)].append(pk)
+
+    for fix, pks in fixes.items():
+        updates = {}
+        for field, difference in fix:
+            if field == "lastModified":
+                updates[field] = _gen_last_modified_fix()
+            else:
+                updates[field] = F(field) + difference
+        for index in range(0, len(pks), FIX_BATCH_SIZE):
+            model.objects.filter(pk__in=pks[index:index + FIX_BATCH_SIZE]).update(**updates)
+
+def reconcile_counters(dryRun=False, chunkSize=RECONCILE_CHUNK_SIZE, report=None):
+    """
+    Used to check the counters of every todo and user against their tasks,
+    fixing the ones that are wrong (see the top of this file).
+
+    Params:
+        - dryRun: bool, only find the wrong counters without fixing them
+        - chunkSize: int, how many users are checked at a time
+        - report: function called with ("todo" or "user", id, {field:
+        (stored value, actual value)}) for each todo or user that is wrong,
+        or None
+
+    returns: dict, the number of todos and users checked, and how many of
+    them were wrong.
+    """
+    if report == None:
+        report = lambda model, id, diff: None
+
+    result = {"toDos": 0, "wrongToDos": 0, "users": 0, "wrongUsers": 0}
+    lastId = 0
+    while True:
+        userIds = list(User.objects
+            .filter(id__gt=lastId)
+            .order_by("id")
+            .values_list("id", flat=True)[:chunkSize])
+        if not userIds:
+            break
+
+        numOfToDos, numOfWrongToDos, numOfWrongUsers = _reconcile_chunk(userIds, dryRun, report)
+        result["toDos"] += numOfToDos
+        result["wrongToDos"] += numOfWrongToDos
+        result["users"] += len(userIds)
+        result["wrongUsers"] += numOfWrongUsers
+        lastId = userIds[-1]
+
+    return result
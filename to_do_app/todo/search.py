@@ -0,0 +1,199 @@
+from django.db import connection
+from django.db.models import Q
+from django.utils.http import urlencode
+
+import re
+
+from .models import ToDo, SharedWith
+from .pagination import get_page_size
+
+# Todos and tasks are searched with an SQLite FTS5 index (todo_search), which
+# triggers on the todo and task tables keep in sync on every write path
+# (save, delete, the bulk queries in batch.py and cascades). Todos are stored
+# at rowid 2 * id and tasks at rowid 2 * id + 1, so the triggers can find
+# their row without another index.
+#
+# Every row also has a toDoKey token ("t" followed by the id of its todo), so
+# a search can be limited to the todos a user can see inside the index,
+# rather than ranking the matches from every users todos and throwing most
+# of them away.
+#
+# Migrations that rebuild the todo or task table (which SQLite does for most
+# schema changes) drop its triggers, so they are created again after every
+# migrate (see signals.py).
+
+SEARCH_TABLE = "todo_search"
+
+SEARCH_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS todo_search_todo_insert AFTER INSERT ON todo_todo BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, title, body, toDoKey, kind, itemId, toDoId)
+        VALUES (new.id * 2, new.title, new."desc", 't' || new.id, 'todo', new.id, new.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS todo_search_todo_update AFTER UPDATE OF title, "desc" ON todo_todo BEGIN
+        UPDATE {SEARCH_TABLE} SET title = new.title, body = new."desc" WHERE rowid = new.id * 2;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS todo_search_todo_delete AFTER DELETE ON todo_todo BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS todo_search_task_insert AFTER INSERT ON todo_task BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, title, body, toDoKey, kind, itemId, toDoId)
+        VALUES (new.id * 2 + 1, new.title, '', 't' || new.belongsTo_id, 'task', new.id,
+            new.belongsTo_id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS todo_search_task_update AFTER UPDATE OF title, belongsTo_id ON todo_task BEGIN
+        UPDATE {SEARCH_TABLE} SET title = new.title, toDoKey = 't' || new.belongsTo_id,
+            toDoId = new.belongsTo_id WHERE rowid = new.id * 2 + 1;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS todo_search_task_delete AFTER DELETE ON todo_task BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id * 2 + 1;
+    END""",
+]
+
+# Matches in titles count for more than matches in descriptions.
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+MAX_SEARCH_TERMS = 10
+
+# Users who can see more todos than this are searched without limiting the
+# index to their todos (the query would get too long), their results are
+# still only the ones they can see.
+MAX_FILTERED_TODOS = 1000
+
+def install_search_triggers(using=connection):
+    """
+    Creates any of the triggers keeping the search index in sync that are
+    missing (post_migrate receiver, see signals.py).
+    """
+    if using.vendor != "sqlite":
+        return
+    with using.cursor() as cursor:
+        tables = using.introspection.table_names(cursor)
+        if SEARCH_TABLE not in tables:
+            return
+        for trigger in SEARCH_TRIGGERS:
+            cursor.execute(trigger)
+
+def gen_match_query(text, toDoIds=None):
+    """
+    Turns what the user typed into an FTS5 query matching every word in the
+    titles and descriptions, with the last word matched as a prefix (so
+    results show up while typing). Every word is quoted, so nothing typed can
+    be read as FTS5 syntax.
+
+    Params:
+        - text: str
+        - toDoIds: list of int, only match rows in these todos (optional)
+
+    returns: (matchQuery, errorMessage)
+    """
+    words = re.findall(r"\w+", text)[:MAX_SEARCH_TERMS]
+    if not words:
+        return (None, "Please enter something to search for.")
+
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    matchQuery = f"{{title body}} : ({' '.join(terms)})"
+
+    if toDoIds != None:
+        toDoKeys = " OR ".join(f'"t{toDoId}"' for toDoId in toDoIds)
+        matchQuery += f" AND toDoKey : ({toDoKeys})"
+
+    return (matchQuery, None)
+
+def _decode_search_cursor(cursor):
+    try:
+        score, rowid = cursor.split("_")
+        return ((float(score), int(rowid)), None)
+    except ValueError:
+        return (None, f"Invalid page cursor {cursor}.")
+
+def search_todos(userId, text, request):
+    """
+    Used to search the todos and tasks a user can see (the todos they own or
+    that are shared with them, and their tasks), best matches first. Pages
+    of results follow each other with a cursor (the score and rowid of the
+    last result) in the "after" GET parameter, like get_keyset_page.
+
+    Params:
+        - userId: int
+        - text: str, what the user searched for
+        - request: HttpRequest
+
+    returns: (results, nextPageQuery, errorMessage)
+        - results
+            - A list of dictionaries with the kind ("todo" or "task"), id,
+            toDoId, title and toDoTitle of each result.
+        - nextPageQuery
+            - The query string for the next page, None if this is the last.
+        - errorMessage
+            - A string with the error message if the search is invalid.
+            - None otherwise.
+    """
+    # Getting the todos the user can see, to limit the search to them (with
+    # a subquery rather than a join, so a todo isn't listed once per share).
+    sharedToDoIds = SharedWith.objects.filter(user=userId).values("todo")
+    toDoIds = list(ToDo.objects
+        .filter(Q(user=userId) | Q(id__in=sharedToDoIds))
+        .values_list("id", flat=True)[:MAX_FILTERED_TODOS + 1])
+    if not toDoIds:
+        return ([], None, None)
+    if len(toDoIds) > MAX_FILTERED_TODOS:
+        toDoIds = None
+
+    matchQuery, errorMessage = gen_match_query(text, toDoIds)
+    if errorMessage != None:
+        return ([], None, errorMessage)
+
+    pageSize = get_page_size(request)
+    params = [TITLE_WEIGHT, BODY_WEIGHT, matchQuery, userId, userId]
+    afterFilter = ""
+    cursor = request.GET.get("after")
+    if cursor:
+        afterKey, errorMessage = _decode_search_cursor(cursor)
+        if errorMessage != None:
+            return ([], None, errorMessage)
+        score, rowid = afterKey
+        afterFilter = "AND (found.score > %s OR (found.score = %s AND found.rowid > %s))"
+        params += [score, score, rowid]
+
+    # Only keeping the matches in todos the user can see, fetching one extra
+    # result to find out if there is another page.
+    sql = f"""
+        SELECT found.kind, found.itemId, found.toDoId, found.title, toDo.title,
+            found.score, found.rowid
+        FROM (
+            SELECT rowid, kind, itemId, toDoId, title,
+                bm25({SEARCH_TABLE}, %s, %s, 0) AS score
+            FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s
+        ) AS found
+        JOIN todo_todo AS toDo ON toDo.id = found.toDoId AND toDo.deletedAt IS NULL
+        WHERE (toDo.user_id = %s OR EXISTS (
+            SELECT 1 FROM todo_sharedwith AS sharedWith
+            WHERE sharedWith.todo_id = toDo.id AND sharedWith.user_id = %s))
+        {afterFilter}
+        ORDER BY found.score, found.rowid
+        LIMIT %s
+    """
+    params.append(pageSize + 1)
+
+    with connection.cursor() as dbCursor:
+        dbCursor.execute(sql, params)
+        rows = dbCursor.fetchall()
+
+    nextPageQuery = None
+    if len(rows) > pageSize:
+        rows = rows[:pageSize]
+        lastScore, lastRowid = rows[-1][5:]
+        nextPageQuery = urlencode({"q": text, "after": f"{lastScore!r}_{lastRowid}",
+            "pageSize": pageSize})
+
+    results = [{
+        "kind": kind,
+        "id": itemId,
+        "toDoId": toDoId,
+        "title": title,
+        "toDoTitle": toDoTitle,
+    } for kind, itemId, toDoId, title, toDoTitle, score, rowid in rows]
+
+    return (results, nextPageQuery, None)
@@ -0,0 +1,146 @@
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+import random
+
+from .models import ToDo, Task, SharedWith, AccessLevel, UserStats
+from .ordering import POSITION_GAP
+
+# Fills the database with synthetic users, todos, tasks and shares, for
+# benchmarks (see the seed_data and bench_endpoints commands) and tests that
+# need more than a handful of rows. The sizes are skewed like real accounts:
+# most users have a few todos with a few tasks, and a few have a lot.
+
+# Every seeded user has this password, so they can log in to a local server.
+SEED_PASSWORD = "password"
+
+# How many rows are inserted at a time.
+SEED_BATCH_SIZE = 2000
+
+WORDS = ["buy", "milk", "call", "mum", "fix", "bike", "book", "flights", "pay", "rent", "clean",
+    "kitchen", "write", "report", "plan", "party", "water", "plants", "walk", "dog", "read",
+    "chapter", "email", "boss", "renew", "passport", "cook", "dinner", "review", "code", "tidy",
+    "garage", "order", "groceries", "wash", "car", "update", "budget", "send", "invoice"]
+
+def _gen_count(rng, mean):
+    # A lognormal count with the given mean (roughly), which has the long
+    # tail of accounts/todos much bigger than the rest.
+    if mean <= 0:
+        return 0
+    return max(0, round(rng.lognormvariate(0, 1) * mean / 1.6487))
+
+def _gen_title(rng, index):
+    # The index keeps titles unique within a todo/user.
+    return f"{' '.join(rng.choices(WORDS, k=rng.randint(1, 4)))} {index}"
+
+def seed_data(numOfUsers, toDosPerUser=10, tasksPerToDo=20, shareFraction=0.2,
+        doneFraction=0.4, prefix="seed", randomSeed=0):
+    """
+    Used to create users (named "<prefix>-<index>") with todos, tasks and
+    shares, inserting them in batches.
+
+    Params:
+        - numOfUsers: int
+        - toDosPerUser: float, the mean number of todos each user has
+        - tasksPerToDo: float, the mean number of tasks in each todo
+        - shareFraction: float, the fraction of todos shared with other users
+        (with one to three of them, mostly with read access)
+        - doneFraction: float, the fraction of tasks that are done
+        - prefix: str, the start of the usernames
+        - randomSeed: int, the same seed makes the same data
+
+    returns: dict, the seeded users and the number of todos, tasks and
+    shares.
+    """
+    rng = random.Random(randomSeed)
+    now = timezone.now()
+
+    # Hashing the password once, rather than for every user.
+    password = make_password(SEED_PASSWORD)
+    users = User.objects.bulk_create([User(username=f"{prefix}-{index}", password=password)
+        for index in range(numOfUsers)], batch_size=SEED_BATCH_SIZE)
+
+    # The todos and how many tasks each one will have, so that numOfTasks
+    # can be inserted with them.
+    toDos = []
+    for user in users:
+        for index in range(_gen_count(rng, toDosPerUser)):
+            desc = " ".join(rng.choices(WORDS, k=rng.randint(3, 12)))
+            toDos.append(ToDo(title=_gen_title(rng, index), desc=desc, descHash=ToDo.hashDesc(desc),
+                user=user, position=(index + 1) * POSITION_GAP, lastModified=now,
+                numOfTasks=_gen_count(rng, tasksPerToDo)))
+    toDos = ToDo.objects.bulk_create(toDos, batch_size=SEED_BATCH_SIZE)
+
+    # Inserting the tasks a batch at a time, rather than keeping them all.
+    numOfTasks = 0
+    tasks = []
+    for toDo in toDos:
+        for index in range(toDo.numOfTasks):
+            tasks.append(Task(title=_gen_title(rng, index), belongsTo=toDo, createdBy_id=toDo.user_id,
+                done=rng.random() < doneFraction, position=(index + 1) * POSITION_GAP,
+                lastModified=now))
+        if len(tasks) >= SEED_BATCH_SIZE:
+            Task.objects.bulk_create(tasks)
+            numOfTasks += len(tasks)
+            tasks = []
+    Task.objects.bulk_create(tasks)
+    numOfTasks += len(tasks)
+
+    # Counting the done tasks of each todo in the database (and making the
+    # todos at least as new as their tasks, which bulk_create gave the time
+    # they were inserted), then the totals of each user (bulk_create doesn't
+    # make their UserStats).
+    toDosQuery = ToDo.objects.filter(user__username__startswith=f"{prefix}-")
+    doneTasks = (Task.objects
+        .filter(belongsTo=OuterRef("pk"), done=True)
+        .order_by()
+        .values("belongsTo")
+        .annotate(count=Count("id"))
+        .values("count"))
+    toDosQuery.update(numDone=Coalesce(Subquery(doneTasks), 0), lastModified=timezone.now())
+    totals = {row["user"]: row for row in toDosQuery
+        .order_by()
+        .values("user")
+        .annotate(numOfToDos=Count("id"), numOfTasks=Sum("numOfTasks"), numDone=Sum("numDone"))}
+    stats = []
+    for user in users:
+        row = totals.get(user.id, {})
+        stats.append(UserStats(user=user, numOfToDos=row.get("numOfToDos", 0),
+            numOfTasks=row.get("numOfTasks", 0), numDone=row.get("numDone", 0)))
+    UserStats.objects.bulk_create(stats, batch_size=SEED_BATCH_SIZE)
+
+    shares = []
+    if len(users) > 1:
+        for toDo in toDos:
+            if rng.random() >= shareFraction:
+                continue
+            others = [user for user in rng.sample(users, min(len(users), 4)) if user.id != toDo.user_id]
+            for user in others[:rng.randint(1, 3)]:
+                access = AccessLevel.WRITE if rng.random() < 0.2 else AccessLevel.READ
+                shares.append(SharedWith(user=user, todo=toDo, access=access))
+    SharedWith.objects.bulk_create(shares, batch_size=SEED_BATCH_SIZE)
+
+    return {
+        "users": users,
+        "toDos": len(toDos),
+        "tasks": numOfTasks,
+        "shares": len(shares),
+    }
+
+def clear_seed_data(prefix="seed"):
+    """
+    Removes the users created by seed_data with a prefix, and everything
+    they own.
+
+    returns: int, the number of users removed.
+    """
+    users = User.objects.filter(username__startswith=f"{prefix}-")
+
+    # Deleting the tasks with one query first (nothing is cascaded from
+    # tasks), rather than having the user deletes collect them all.
+    Task.objects.filter(belongsTo__user__in=users).delete()
+    _, numDeleted = users.delete()
+    return numDeleted.get("auth.User", 0)
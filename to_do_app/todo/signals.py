@@ -0,0 +1,86 @@
+from django.db import connections
+from django.db.models import F, Subquery
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import invalidate_todo
+from .events import publish
+from .metrics import count_writes
+from .models import ToDo, Task, User, SharedWith, UserStats
+from .search import install_search_triggers
+
+# Keeping the fragment cache (see cache.py) up to date whenever a todo, its 
+# tasks or who it is shared with change.
+# NOTE: there is deliberately no post_delete receiver for Task, as that would
+# make Django load every task of a todo into memory to send the signal when 
+# the todo is deleted. Task.delete invalidates the cache itself instead.
+
+@receiver(post_save, sender=ToDo)
+@receiver(post_delete, sender=ToDo)
+def invalidate_todo_cache(sender, instance, **kwargs):
+    invalidate_todo(instance.id)
+
+@receiver(post_save, sender=Task)
+def invalidate_task_todo_cache(sender, instance, **kwargs):
+    invalidate_todo(instance.belongsTo_id)
+
+@receiver(post_save, sender=SharedWith)
+@receiver(post_delete, sender=SharedWith)
+def invalidate_shared_todo_cache(sender, instance, **kwargs):
+    invalidate_todo(instance.todo_id)
+
+# Letting anyone viewing a todo know when who it is shared with changes (the
+# user it was unshared with loses access, see async_views.todo_events), or
+# when it is deleted. Task events are published by Task.save/Task.delete,
+# and soft deleted todos by ToDo.softDelete (so they are skipped here).
+
+@receiver(post_save, sender=SharedWith)
+def publish_share_saved(sender, instance, **kwargs):
+    publish(instance.todo_id, {"type": "share", "action": "changed", 
+        "userId": instance.user_id, "access": instance.access})
+
+@receiver(post_delete, sender=SharedWith)
+def publish_share_deleted(sender, instance, **kwargs):
+    publish(instance.todo_id, {"type": "share", "action": "deleted", 
+        "userId": instance.user_id})
+
+@receiver(post_delete, sender=ToDo)
+def publish_todo_deleted(sender, instance, **kwargs):
+    if instance.deletedAt == None:
+        publish(instance.id, {"type": "todo", "action": "deleted"})
+
+# Counting deleted todos with the other writes (see metrics.py), ToDo.save,
+# ToDo.softDelete and Task.save/Task.delete count the rest.
+@receiver(post_delete, sender=ToDo)
+def count_todo_deleted(sender, instance, **kwargs):
+    if instance.deletedAt == None:
+        count_writes("todo", "deleted")
+
+# Keeping the UserStats of each user (see models.py) up to date. A todo's
+# counts are taken off its owner's totals before it is deleted (in the same
+# transaction), with the tasks it still has then.
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    # Users loaded from fixtures come with their own stats.
+    if created and not raw:
+        UserStats.objects.create(user=instance)
+
+@receiver(pre_delete, sender=ToDo)
+def remove_todo_stats(sender, instance, **kwargs):
+    # Deleted todos were taken off when they were deleted (see 
+    # ToDo.softDelete), and aren't in ToDo.objects.
+    if instance.deletedAt != None:
+        return
+    toDo = ToDo.objects.filter(id=instance.id)
+    UserStats.objects.filter(user=instance.user_id).update(
+        numOfToDos=F("numOfToDos") - 1,
+        numOfTasks=F("numOfTasks") - Subquery(toDo.values("numOfTasks")),
+        numDone=F("numDone") - Subquery(toDo.values("numDone")))
+
+# Creating the triggers that keep the search index in sync again after 
+# migrations that rebuild the todo or task tables (see search.py).
+@receiver(post_migrate)
+def install_search_index_triggers(sender, using, **kwargs):
+    if sender.name == "todo":
+        install_search_triggers(connections[using])
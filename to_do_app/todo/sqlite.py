@@ -0,0 +1,57 @@
+from django.conf import settings
+
+# The SQLite pragmas set on every new connection for each database profile
+# (see DATABASE_PROFILE in settings.py). The production profile is meant for
+# several threads/processes reading and writing at once:
+#   - journal_mode=WAL lets readers carry on while a write is happening.
+#   - synchronous=NORMAL only syncs to disk at WAL checkpoints, which is safe
+#   in WAL mode (a power cut can lose the last commits, but not corrupt it).
+#   - mmap_size and cache_size keep more of the database in memory.
+#   - busy_timeout makes a writer wait for the lock rather than failing with
+#   "database is locked" straight away.
+PROFILE_PRAGMAS = {
+    "development": {},
+    "production": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 * 1024 * 1024,
+        # Negative sizes are in KiB, so this is 64MiB.
+        "cache_size": -64 * 1024,
+        "busy_timeout": 20000,
+    },
+}
+
+def get_pragmas(profile=None):
+    """
+    Used to get the pragmas of a database profile.
+
+    Params:
+        - profile: str, defaults to the DATABASE_PROFILE setting
+
+    returns: dict
+    """
+    if profile == None:
+        profile = getattr(settings, "DATABASE_PROFILE", "development")
+    return PROFILE_PRAGMAS[profile]
+
+def apply_pragmas(cursor, pragmas):
+    """
+    Sets the given pragmas on the connection of a (DB-API) cursor.
+    """
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+
+def configure_connection(sender, connection, **kwargs):
+    """
+    connection_created receiver that sets the pragmas of the current database
+    profile on each new SQLite connection. With persistent connections
+    (CONN_MAX_AGE) this only happens once per connection rather than once
+    per request.
+    """
+    if connection.vendor != "sqlite":
+        return
+
+    pragmas = get_pragmas()
+    if pragmas:
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, pragmas)
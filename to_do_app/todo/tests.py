@@ -1,3 +1,1654 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.signals import post_delete, pre_delete
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, include, path
+from django.utils import timezone
+from django.utils.http import http_date
 
-# Create your tests here.
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
+from . import api_urls, async_views, metrics, profiling, urls
+from .cache import get_cache_stats
+from .events import hub
+from .jobs import Worker, claim_jobs, enqueue, enqueue_many, retry_failed_jobs, run_job
+from .management.commands.bench_endpoints import SKIPPED_URLS
+from .models import ToDo, Task, SharedWith, AccessLevel, UserStats, Job, JobStatus
+from .ordering import POSITION_GAP
+from .pagination import MAX_PAGE_SIZE, get_keyset_page, get_page_size
+from .seeding import clear_seed_data, seed_data
+from .writer import WriteQueue
+
+class OrderingTests(TestCase):
+    """
+    Tests for reordering todos and tasks with sparse positions, in
+    ordering.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.writer = User.objects.create_user("writer", password="password")
+        cls.reader = User.objects.create_user("reader", password="password")
+        cls.toDos = []
+        for index, title in enumerate(["Chores", "Garden", "Shopping"]):
+            toDo = ToDo(title=title, desc=title, position=(index + 1) * POSITION_GAP, user=cls.owner)
+            toDo.save()
+            cls.toDos.append(toDo)
+        cls.toDo = cls.toDos[0]
+        SharedWith.objects.create(user=cls.writer, todo=cls.toDo, access=AccessLevel.WRITE)
+        SharedWith.objects.create(user=cls.reader, todo=cls.toDo, access=AccessLevel.READ)
+
+        cls.tasks = []
+        for index in range(4):
+            task = Task(title=f"Task {index}", position=(index + 1) * POSITION_GAP,
+                belongsTo=cls.toDo, createdBy=cls.owner)
+            task.save()
+            cls.tasks.append(task)
+        cls.otherTask = Task(title="Weed", position=POSITION_GAP, belongsTo=cls.toDos[1],
+            createdBy=cls.owner)
+        cls.otherTask.save()
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def move_task(self, task, after):
+        return self.client.post(f"/view_todo/reorder_task/{task.id}",
+            {"after": "" if after == None else after.id})
+
+    def move_todo(self, toDo, after):
+        return self.client.post(f"/reorder_todo/{toDo.id}",
+            {"after": "" if after == None else after.id})
+
+    def get_task_order(self):
+        return list(Task.objects.filter(belongsTo=self.toDo).order_by("position", "id")
+            .values_list("title", flat=True))
+
+    def test_move_to_start_and_after(self):
+        positions = dict(Task.objects.values_list("id", "position"))
+        self.assertEqual(self.move_task(self.tasks[3], None).status_code, 200)
+        self.assertEqual(self.get_task_order(), ["Task 3", "Task 0", "Task 1", "Task 2"])
+
+        response = self.move_task(self.tasks[0], self.tasks[1])
+        self.assertEqual(self.get_task_order(), ["Task 3", "Task 1", "Task 0", "Task 2"])
+        self.assertEqual(response.json()["position"], (2 * POSITION_GAP + 3 * POSITION_GAP) // 2)
+        # Only the moved tasks were written.
+        unmoved = {task.id for task in self.tasks[1:3]}
+        self.assertEqual({taskId: position for taskId, position
+            in Task.objects.filter(id__in=unmoved).values_list("id", "position")},
+            {taskId: positions[taskId] for taskId in unmoved})
+
+        self.assertEqual(self.move_todo(self.toDos[2], self.toDos[0]).status_code, 200)
+        self.assertEqual(list(ToDo.objects.filter(user=self.owner).order_by("position", "id")
+            .values_list("title", flat=True)), ["Chores", "Shopping", "Garden"])
+
+    def test_rebalance(self):
+        # No gap left between the first three tasks.
+        for index, task in enumerate(self.tasks[:3]):
+            Task.objects.filter(id=task.id).update(position=index + 1)
+
+        self.assertEqual(self.move_task(self.tasks[3], self.tasks[0]).status_code, 200)
+        self.assertEqual(self.get_task_order(), ["Task 0", "Task 3", "Task 1", "Task 2"])
+        positions = list(Task.objects.filter(belongsTo=self.toDo).order_by("position")
+            .values_list("position", flat=True))
+        self.assertGreaterEqual(min(b - a for a, b in zip(positions, positions[1:])),
+            POSITION_GAP // 2)
+
+        # The command spreads out lists whose gaps are running out.
+        Task.objects.filter(id=self.tasks[1].id).update(position=positions[0] + 1)
+        output = io.StringIO()
+        call_command("rebalance_positions", stdout=output)
+        self.assertIn("Rebalanced 1 Task lists.", output.getvalue())
+        self.assertEqual(list(Task.objects.filter(belongsTo=self.toDo).order_by("position")
+            .values_list("position", flat=True)), [POSITION_GAP * (index + 1) for index in range(4)])
+
+    def test_other_lists(self):
+        # Items can only be moved after items in the same list.
+        response = self.move_task(self.tasks[0], self.otherTask)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(f"no item with id {self.otherTask.id}", response.json()["errorMessage"])
+        self.assertEqual(self.move_task(self.tasks[0], self.tasks[0]).status_code, 400)
+
+        strangerToDo = ToDo(title="Theirs", desc="Theirs", position=POSITION_GAP, user=self.writer)
+        strangerToDo.save()
+        self.assertEqual(self.move_todo(self.toDos[1], strangerToDo).status_code, 400)
+        self.assertEqual(self.get_task_order(), [f"Task {index}" for index in range(4)])
+
+    def test_access_checks(self):
+        # Only the owner can reorder a todo, as todos are ordered per owner.
+        self.client.force_login(self.writer)
+        self.assertEqual(self.move_todo(self.toDo, None).status_code, 403)
+        # Tasks can be reordered with write access.
+        self.assertEqual(self.move_task(self.tasks[3], None).status_code, 200)
+
+        self.client.force_login(self.reader)
+        self.assertEqual(self.move_todo(self.toDo, None).status_code, 403)
+        self.assertEqual(self.move_task(self.tasks[0], None).status_code, 403)
+        self.assertEqual(self.move_task(self.otherTask, None).status_code, 403)
+        self.assertEqual(self.client.post("/view_todo/reorder_task/999999", {"after": ""})
+            .status_code, 404)
+        self.assertEqual(self.get_task_order(), ["Task 3", "Task 0", "Task 1", "Task 2"])
+
+class PaginationTests(TestCase):
+    """
+    Tests for the keyset pagination in pagination.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.toDo = ToDo(title="Chores", desc="Chores", position=POSITION_GAP, user=cls.owner)
+        cls.toDo.save()
+        # Runs of tasks with the same position, so pages have to be split
+        # between them by id.
+        for index in range(11):
+            Task(title=f"Task {index}", position=(index // 4 + 1) * POSITION_GAP,
+                belongsTo=cls.toDo, createdBy=cls.owner).save()
+        cls.taskIds = list(Task.objects.filter(belongsTo=cls.toDo).order_by("position", "id")
+            .values_list("id", flat=True))
+
+    def get_page(self, query):
+        request = RequestFactory().get(f"/?{query}")
+        return get_keyset_page(Task.objects.filter(belongsTo=self.toDo), request)
+
+    def test_follow_pages(self):
+        for pageSize in (1, 2, 3, 4, 5):
+            taskIds = []
+            query = f"pageSize={pageSize}"
+            while query:
+                tasks, nextPageQuery, errorMessage = self.get_page(query)
+                self.assertEqual(errorMessage, None)
+                self.assertLessEqual(len(tasks), pageSize)
+                taskIds += [task.id for task in tasks]
+                query = nextPageQuery
+
+            self.assertEqual(taskIds, self.taskIds)
+
+    def test_invalid_cursor(self):
+        firstPage = [task.id for task in self.get_page("pageSize=3")[0]]
+        for cursor in ("abc", "1_x", "1_2_3", "_", f"{POSITION_GAP}"):
+            tasks, nextPageQuery, errorMessage = self.get_page(f"after={cursor}&pageSize=3")
+            self.assertEqual([task.id for task in tasks], firstPage)
+            self.assertNotEqual(nextPageQuery, None)
+            self.assertEqual(errorMessage, f"Invalid page cursor {cursor}.")
+
+        # The task list shows the first page with the error, while the API
+        # rejects the cursor.
+        self.client.force_login(self.owner)
+        response = self.client.get(f"/view_todo/{self.toDo.id}?after=abc&pageSize=3")
+        self.assertContains(response, "Invalid page cursor abc.")
+        self.assertContains(response, "Task 2")
+        self.assertNotContains(response, "Task 3")
+        response = self.client.get(f"/api/v1/todos/{self.toDo.id}/tasks?after=abc")
+        self.assertEqual(response.status_code, 400)
+
+    def test_page_size(self):
+        for pageSize, expected in [("0", 1), ("-5", 1), ("3", 3), ("10000", MAX_PAGE_SIZE),
+                ("nope", 50), ("", 50)]:
+            request = RequestFactory().get("/", {"pageSize": pageSize})
+            self.assertEqual(get_page_size(request), expected)
+
+        tasks, nextPageQuery, errorMessage = self.get_page("pageSize=0")
+        self.assertEqual(len(tasks), 1)
+        tasks, nextPageQuery, errorMessage = self.get_page("pageSize=10000")
+        self.assertEqual(len(tasks), 11)
+        self.assertEqual(nextPageQuery, None)
+
+class BatchTests(TestCase):
+    """
+    Tests for applying a batch of task operations to a todo at once, in
+    batch.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.writer = User.objects.create_user("writer", password="password")
+        cls.reader = User.objects.create_user("reader", password="password")
+        cls.toDo = ToDo(title="Chores", desc="Around the house", position=POSITION_GAP,
+            user=cls.owner)
+        cls.toDo.save()
+        SharedWith.objects.create(user=cls.writer, todo=cls.toDo, access=AccessLevel.WRITE)
+        SharedWith.objects.create(user=cls.reader, todo=cls.toDo, access=AccessLevel.READ)
+        cls.tasks = []
+        for index, title in enumerate(["Dishes", "Laundry", "Sweep"]):
+            task = Task(title=title, position=(index + 1) * POSITION_GAP, done=index == 0,
+                belongsTo=cls.toDo, createdBy=cls.owner)
+            task.save()
+            cls.tasks.append(task)
+        cls.otherToDo = ToDo(title="Garden", desc="Outside", position=POSITION_GAP, user=cls.writer)
+        cls.otherToDo.save()
+        cls.otherTask = Task(title="Weed", position=POSITION_GAP, belongsTo=cls.otherToDo,
+            createdBy=cls.writer)
+        cls.otherTask.save()
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def post_batch(self, operations, toDo=None):
+        return self.client.post(f"/view_todo/{(toDo or self.toDo).id}/batch",
+            json.dumps({"operations": operations}), content_type="application/json")
+
+    def assertCounts(self, numOfTasks, numDone):
+        toDo = ToDo.objects.get(id=self.toDo.id)
+        self.assertEqual((toDo.numOfTasks, toDo.numDone), (numOfTasks, numDone))
+        self.assertEqual(Task.objects.filter(belongsTo=self.toDo).count(), numOfTasks)
+        self.assertEqual(Task.objects.filter(belongsTo=self.toDo, done=True).count(), numDone)
+
+    def test_operations(self):
+        dishes, laundry, sweep = self.tasks
+        response = self.post_batch([
+            {"op": "add", "title": "Mop"},
+            {"op": "complete", "id": laundry.id},
+            {"op": "complete", "id": dishes.id, "done": True},
+            {"op": "retitle", "id": sweep.id, "title": "Sweep the hall"},
+            {"op": "remove", "id": dishes.id},
+        ])
+        # Removing a task that is also completed isn't allowed.
+        self.assertEqual(response.status_code, 400)
+        self.assertCounts(3, 1)
+
+        response = self.post_batch([
+            {"op": "add", "title": "Mop"},
+            {"op": "add", "title": "Dust"},
+            {"op": "complete", "id": laundry.id},
+            {"op": "complete", "id": sweep.id, "done": False},
+            {"op": "retitle", "id": sweep.id, "title": "Sweep the hall"},
+            {"op": "remove", "id": dishes.id},
+        ])
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        added = Task.objects.filter(title__in=["Mop", "Dust"]).order_by("position")
+        self.assertEqual(result["added"], [task.id for task in added])
+        self.assertEqual({key: value for key, value in result.items() if key != "added"},
+            {"completed": 2, "removed": 1, "retitled": 1, "numOfTasks": 4, "numDone": 1})
+        self.assertCounts(4, 1)
+
+        self.assertFalse(Task.objects.filter(id=dishes.id).exists())
+        self.assertTrue(Task.objects.get(id=laundry.id).done)
+        sweep = Task.objects.get(id=sweep.id)
+        self.assertEqual((sweep.title, sweep.done), ("Sweep the hall", False))
+        # New tasks go after the others, in the order they are in the batch.
+        self.assertEqual([task.title for task in added], ["Mop", "Dust"])
+        self.assertGreater(added[0].position, sweep.position)
+
+        # Completing a task without a done value toggles it.
+        response = self.post_batch([{"op": "complete", "id": laundry.id}])
+        self.assertEqual(response.json()["numDone"], 0)
+        self.assertCounts(4, 0)
+
+    def test_complete_keeps_title(self):
+        # Only the titles of retitled tasks are written, so completing a
+        # task can't put back an old title.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_batch([{"op": "complete", "id": self.tasks[1].id}])
+        self.assertEqual(response.status_code, 200)
+        updates = [query["sql"] for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "todo_task"')]
+        self.assertTrue(updates)
+        self.assertFalse(any('"title"' in sql for sql in updates))
+        self.assertEqual(Task.objects.get(id=self.tasks[1].id).title, "Laundry")
+
+    def test_missing_task(self):
+        for operations in ([{"op": "complete", "id": 999999}],
+                [{"op": "add", "title": "Mop"}, {"op": "remove", "id": self.otherTask.id}]):
+            response = self.post_batch(operations)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("There is no Task with id", response.json()["errorMessage"])
+
+        # Nothing in the batch is applied.
+        self.assertFalse(Task.objects.filter(title="Mop").exists())
+        self.assertTrue(Task.objects.filter(id=self.otherTask.id).exists())
+        self.assertCounts(3, 1)
+
+    def test_invalid_batches(self):
+        url = f"/view_todo/{self.toDo.id}/batch"
+        self.assertEqual(self.client.post(url, "not json", content_type="application/json")
+            .status_code, 400)
+        self.assertEqual(self.client.post(url, "[]", content_type="application/json")
+            .status_code, 400)
+        for operations in ([], "add", [{"op": "fly"}], [{"op": "add"}], [{"op": "add", "title": ""}],
+                [{"op": "add", "title": "x" * 1000}], [{"op": "remove"}],
+                [{"op": "remove", "id": "1"}], [{"op": "complete", "id": True}],
+                [{"op": "complete", "id": self.tasks[0].id, "done": "yes"}],
+                [{"op": "add", "title": "Mop"}, {"op": "add", "title": "Mop"}],
+                [{"op": "add", "title": "Dishes"}],
+                [{"op": "add", "title": "Mop"}] * 501):
+            response = self.post_batch(operations)
+            self.assertEqual(response.status_code, 400, operations)
+            self.assertIn("errorMessage", response.json())
+        self.assertCounts(3, 1)
+
+    def test_access(self):
+        operations = [{"op": "add", "title": "Mop"}]
+        self.client.force_login(self.reader)
+        # Completing only needs access to the todo, anything else needs write
+        # access.
+        self.assertEqual(self.post_batch(operations).status_code, 403)
+        self.assertEqual(self.post_batch([{"op": "retitle", "id": self.tasks[1].id,
+            "title": "Fold"}]).status_code, 403)
+        response = self.post_batch([{"op": "complete", "id": self.tasks[1].id}])
+        self.assertEqual(response.status_code, 200)
+        self.assertCounts(3, 2)
+
+        self.client.force_login(self.writer)
+        self.assertEqual(self.post_batch(operations).status_code, 200)
+        self.assertCounts(4, 2)
+
+        # Users the todo isn't shared with can't see it.
+        self.client.force_login(self.owner)
+        self.assertEqual(self.post_batch(operations, self.otherToDo).status_code, 403)
+        self.assertEqual(self.client.post("/view_todo/999999/batch", json.dumps({"operations":
+            operations}), content_type="application/json").status_code, 404)
+
+class ApiTests(TestCase):
+    """
+    Tests for the JSON API in api.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.reader = User.objects.create_user("reader", password="password")
+        cls.stranger = User.objects.create_user("stranger", password="password")
+
+        cls.toDo = ToDo(title="Shopping", desc="Things to buy " * 100, position=1024, user=cls.owner)
+        cls.toDo.save()
+        SharedWith.objects.create(user=cls.reader, todo=cls.toDo, access=AccessLevel.READ)
+
+        for index in range(30):
+            Task(title=f"Task {index}", position=(index + 1) * 1024, belongsTo=cls.toDo,
+                createdBy=cls.owner).save()
+
+    def post_json(self, url, data, method="post"):
+        return getattr(self.client, method)(url, json.dumps(data), content_type="application/json")
+
+    def test_login_required(self):
+        response = self.client.get("/api/v1/todos")
+        self.assertEqual(response.status_code, 401)
+
+    def test_list_todos(self):
+        self.client.force_login(self.reader)
+        response = self.client.get("/api/v1/todos")
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]["owner"], "owner")
+        self.assertEqual(results[0]["accessLevel"], AccessLevel.READ)
+
+    def test_sparse_fields(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(f"/api/v1/todos/{self.toDo.id}/tasks?fields=id,done")
+
+        self.assertEqual(response.status_code, 200)
+        for task in response.json()["results"]:
+            self.assertEqual(set(task), {"id", "done"})
+
+        response = self.client.get("/api/v1/todos?fields=id,nope")
+        self.assertEqual(response.status_code, 400)
+
+    def test_sparse_fields_size_and_time(self):
+        """
+        Measures the response size and serialization time of the full and
+        sparse task lists, the sparse one should be smaller.
+        """
+        self.client.force_login(self.owner)
+        measurements = {}
+        for fields in ("", "id,title"):
+            start = time.perf_counter()
+            response = self.client.get(f"/api/v1/todos/{self.toDo.id}/tasks?fields={fields}")
+            measurements[fields] = (len(response.content), time.perf_counter() - start)
+
+        fullSize, fullTime = measurements[""]
+        sparseSize, sparseTime = measurements["id,title"]
+        self.assertLess(sparseSize, fullSize / 2)
+        self.assertGreater(fullTime, 0)
+        self.assertGreater(sparseTime, 0)
+
+    def test_task_pages(self):
+        self.client.force_login(self.owner)
+        url = f"/api/v1/todos/{self.toDo.id}/tasks?fields=title&pageSize=7"
+        titles = []
+        while url:
+            response = self.client.get(url).json()
+            titles += [task["title"] for task in response["results"]]
+            url = response["next"] and f"/api/v1/todos/{self.toDo.id}/tasks?fields=title&{response['next']}"
+
+        self.assertEqual(titles, [f"Task {index}" for index in range(30)])
+
+    def test_bulk_add_tasks(self):
+        self.client.force_login(self.owner)
+        response = self.post_json(f"/api/v1/todos/{self.toDo.id}/tasks",
+            {"tasks": [{"title": "New 1"}, {"title": "New 2"}]})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()["results"]), 2)
+        self.assertEqual(ToDo.objects.get(id=self.toDo.id).numOfTasks, 32)
+
+    def test_access_checks(self):
+        task = Task.objects.filter(belongsTo=self.toDo).first()
+
+        # Readers can complete tasks but not change them.
+        self.client.force_login(self.reader)
+        self.assertEqual(self.post_json(f"/api/v1/tasks/{task.id}", {"done": True}, "patch").status_code, 200)
+        self.assertEqual(self.post_json(f"/api/v1/tasks/{task.id}", {"title": "x"}, "patch").status_code, 403)
+        self.assertEqual(self.client.delete(f"/api/v1/todos/{self.toDo.id}").status_code, 403)
+        self.assertEqual(self.client.get(f"/api/v1/todos/{self.toDo.id}/shares").status_code, 403)
+
+        # Strangers can't see the todo at all.
+        self.client.force_login(self.stranger)
+        self.assertEqual(self.client.get(f"/api/v1/todos/{self.toDo.id}").status_code, 403)
+        self.assertEqual(self.client.get(f"/api/v1/tasks/{task.id}").status_code, 403)
+        self.assertEqual(self.client.get("/api/v1/todos/999999").status_code, 404)
+
+    def test_shares(self):
+        self.client.force_login(self.owner)
+        response = self.post_json(f"/api/v1/todos/{self.toDo.id}/shares",
+            {"username": "stranger", "access": AccessLevel.WRITE})
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get(f"/api/v1/todos/{self.toDo.id}/shares?fields=username")
+        self.assertEqual(response.json()["results"], [{"username": "reader"}, {"username": "stranger"}])
+
+        response = self.client.delete(f"/api/v1/todos/{self.toDo.id}/shares/{self.stranger.id}")
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(SharedWith.objects.filter(user=self.stranger).exists())
+
+class ConditionalGetTests(TestCase):
+    """
+    Tests for the ETag support of home and view_todo in conditional.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.other = User.objects.create_user("other", password="password")
+        cls.toDo = ToDo(title="Chores", desc="Around the house", position=1024, user=cls.owner)
+        cls.toDo.save()
+        cls.task = Task(title="Dishes", position=1024, belongsTo=cls.toDo, createdBy=cls.owner)
+        cls.task.save()
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+        # Getting the CSRF cookie the home page sets, which is part of its ETag.
+        self.client.get("/")
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in ["/", f"/view_todo/{self.toDo.id}"]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304)
+
+    def test_changes_invalidate_etags(self):
+        homeETag = self.client.get("/")["ETag"]
+        toDoETag = self.client.get(f"/view_todo/{self.toDo.id}")["ETag"]
+
+        # Completing a task changes both pages.
+        self.client.get(f"/view_todo/{self.toDo.id}_complete{self.task.id}")
+        self.assertEqual(self.client.get("/", HTTP_IF_NONE_MATCH=homeETag).status_code, 200)
+        response = self.client.get(f"/view_todo/{self.toDo.id}", HTTP_IF_NONE_MATCH=toDoETag)
+        self.assertEqual(response.status_code, 200)
+
+        # Sharing the todo changes the home page.
+        homeETag = self.client.get("/")["ETag"]
+        SharedWith.objects.create(user=self.other, todo=self.toDo, access=AccessLevel.READ)
+        self.assertEqual(self.client.get("/", HTTP_IF_NONE_MATCH=homeETag).status_code, 200)
+
+    def test_home_changes_without_newer_todos(self):
+        newerToDo = ToDo(title="Garden", desc="Outside", position=2048, user=self.owner)
+        newerToDo.save()
+        response = self.client.get("/")
+        # Only the ETag is used, as the newest lastModified doesn't change
+        # for everything on the page.
+        self.assertFalse(response.has_header("Last-Modified"))
+        homeETag = response["ETag"]
+
+        # Moving a todo, then deleting the newest one, changes the page.
+        self.client.post(f"/reorder_todo/{newerToDo.id}", {"after": ""})
+        response = self.client.get("/", HTTP_IF_NONE_MATCH=homeETag)
+        self.assertEqual(response.status_code, 200)
+        homeETag = response["ETag"]
+        self.client.get(f"/_remove{newerToDo.id}")
+        self.assertEqual(self.client.get("/", HTTP_IF_NONE_MATCH=homeETag).status_code, 200)
+
+    def test_access_changes_without_newer_todo(self):
+        SharedWith.objects.create(user=self.other, todo=self.toDo, access=AccessLevel.READ)
+        self.client.force_login(self.other)
+        url = f"/view_todo/{self.toDo.id}"
+        response = self.client.get(url)
+        self.assertFalse(response.has_header("Last-Modified"))
+        self.assertNotContains(response, "Add Task")
+        toDoETag = response["ETag"]
+
+        # Changing the users access level doesn't bump the todo's
+        # lastModified, but changes the page (within the same second too).
+        SharedWith.objects.filter(user=self.other).update(access=AccessLevel.WRITE)
+        ifModifiedSince = http_date(time.time() + 60)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=ifModifiedSince)
+        self.assertContains(response, "Add Task")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=toDoETag)
+        self.assertContains(response, "Add Task")
+
+    def test_no_etag_without_access(self):
+        self.client.force_login(self.other)
+        response = self.client.get(f"/view_todo/{self.toDo.id}")
+        self.assertFalse(response.has_header("ETag"))
+
+class FragmentCacheTests(TestCase):
+    """
+    Tests for the cached todo cards and task lists in cache.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.other = User.objects.create_user("other", password="password")
+        cls.toDo = ToDo(title="Chores", desc="Around the house", position=1024, user=cls.owner)
+        cls.toDo.save()
+        Task(title="Dishes", position=1024, belongsTo=cls.toDo, createdBy=cls.owner).save()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.owner)
+
+    def test_cards_are_cached(self):
+        statsBefore = get_cache_stats()
+        self.client.get("/")
+        self.client.get("/")
+        statsAfter = get_cache_stats()
+
+        self.assertEqual(statsAfter["misses"] - statsBefore["misses"], 1)
+        self.assertEqual(statsAfter["hits"] - statsBefore["hits"], 1)
+
+    def test_sharing_invalidates_card(self):
+        self.assertNotContains(self.client.get("/"), "other <a")
+        SharedWith.objects.create(user=self.other, todo=self.toDo, access=AccessLevel.READ)
+        self.assertContains(self.client.get("/"), "other <a")
+
+        SharedWith.objects.filter(user=self.other).delete()
+        self.assertNotContains(self.client.get("/"), "other <a")
+
+    def change_in_other_process(self, change):
+        # The generation a todo has in this process isn't thrown away when
+        # another process invalidates it, so it is put back after the change.
+        generationKey = f"todo:{self.toDo.id}:generation"
+        generation = cache.get(generationKey)
+        change()
+        cache.set(generationKey, generation)
+
+    def test_sharing_in_other_process_changes_card(self):
+        self.assertNotContains(self.client.get("/"), "other <a")
+        self.change_in_other_process(lambda: SharedWith.objects.create(user=self.other,
+            todo=self.toDo, access=AccessLevel.READ))
+        self.assertContains(self.client.get("/"), "other <a")
+
+        self.client.force_login(self.other)
+        self.assertNotContains(self.client.get("/"), "_remove")
+        self.change_in_other_process(lambda: SharedWith.objects.filter(user=self.other)
+            .update(access=AccessLevel.WRITE))
+        self.assertContains(self.client.get("/"), "_remove")
+
+        self.client.force_login(self.owner)
+        self.change_in_other_process(lambda: SharedWith.objects.filter(user=self.other).delete())
+        self.assertNotContains(self.client.get("/"), "other <a")
+
+    def test_task_changes_invalidate_task_list(self):
+        self.assertContains(self.client.get(f"/view_todo/{self.toDo.id}"), "Dishes")
+        Task.objects.get(title="Dishes").delete()
+        self.assertNotContains(self.client.get(f"/view_todo/{self.toDo.id}"), "Dishes")
+
+    def test_access_level_is_part_of_key(self):
+        SharedWith.objects.create(user=self.other, todo=self.toDo, access=AccessLevel.READ)
+        self.assertContains(self.client.get(f"/view_todo/{self.toDo.id}"), "/view_todo/edit_task/")
+
+        self.client.force_login(self.other)
+        self.assertNotContains(self.client.get(f"/view_todo/{self.toDo.id}"), "/view_todo/edit_task/")
+
+class UniquenessTests(TestCase):
+    """
+    Tests for the unique constraints on todos, tasks and shares, which the 
+    views rely on instead of looking for duplicates first.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.other = User.objects.create_user("other", password="password")
+        cls.toDo = ToDo(title="Chores", desc=("Around the house " * 100).strip(), position=1024, user=cls.owner)
+        cls.toDo.save()
+        Task(title="Dishes", position=1024, belongsTo=cls.toDo, createdBy=cls.owner).save()
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def test_query_plans(self):
+        """
+        Captures the query plans of the lookups the views used to make to find
+        duplicates (before) and the ones the unique constraints are checked 
+        with (after). Only the after lookups can find a duplicate from the
+        index alone, the before todo lookup still has to compare the whole
+        description of every todo with the same title.
+        """
+        desc = self.toDo.desc
+        plans = {
+            "todoBefore": ToDo.objects.filter(user=self.owner, title="Chores", desc=desc),
+            "todoAfter": ToDo.objects.filter(user=self.owner, title="Chores",
+                descHash=ToDo.hashDesc(desc)),
+            "task": Task.objects.filter(belongsTo=self.toDo, title="Dishes"),
+            "share": SharedWith.objects.filter(user=self.other, todo=self.toDo),
+        }
+        plans = {name: queryset.explain() for name, queryset in plans.items()}
+
+        self.assertNotIn("descHash=?", plans["todoBefore"])
+        self.assertIn("(user_id=? AND title=? AND descHash=?)", plans["todoAfter"])
+        self.assertIn("(belongsTo_id=? AND title=?)", plans["task"])
+        self.assertIn("(user_id=? AND todo_id=?)", plans["share"])
+        for plan in plans.values():
+            self.assertIn("USING INDEX", plan)
+
+    def test_duplicate_todo(self):
+        response = self.client.post("/add_todo", {"title": "Chores", "desc": self.toDo.desc})
+        self.assertContains(response, "You already have a TODO")
+        self.assertEqual(ToDo.objects.filter(user=self.owner).count(), 1)
+
+        # The same title with a different description is fine.
+        response = self.client.post("/add_todo", {"title": "Chores", "desc": "Garden"})
+        self.assertEqual(response.status_code, 302)
+
+    def test_duplicate_task(self):
+        response = self.client.post(f"/view_todo/add_task/{self.toDo.id}", {"title": "Dishes"})
+        self.assertContains(response, "You already have a Task")
+        self.assertEqual(ToDo.objects.get(id=self.toDo.id).numOfTasks, 1)
+
+    def test_duplicate_share(self):
+        url = f"/share_todo/{self.toDo.id}"
+        self.client.post(url, {"username": "other", "access": AccessLevel.READ})
+        response = self.client.post(url, {"username": "other", "access": AccessLevel.READ})
+        self.assertContains(response, "already been shared with other")
+        self.assertEqual(SharedWith.objects.filter(todo=self.toDo).count(), 1)
+
+    def test_duplicate_batch_is_rolled_back(self):
+        response = self.client.post(f"/view_todo/{self.toDo.id}/batch",
+            json.dumps({"operations": [{"op": "add", "title": "Sweep"}, {"op": "add", "title": "Dishes"}]}),
+            content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Task.objects.filter(title="Sweep").exists())
+
+class WriteQueueTests(TransactionTestCase):
+    """
+    Tests for the group committing write queue in writer.py.
+    """
+
+    def test_group_commit(self):
+        owner = User.objects.create_user("owner", password="password")
+        toDo = ToDo(title="Chores", desc="Around the house", position=1024, user=owner)
+        toDo.save()
+
+        # A long latency budget, so all of the writes are committed together.
+        writeQueue = WriteQueue(maxDelay=0.5)
+        titles = ["Dishes", "Sweep", "Dishes", "Laundry"]
+        futures = [writeQueue.submit(Task(title=title, position=1024, belongsTo=toDo,
+            createdBy=owner).save) for title in titles]
+        writeQueue.stop()
+
+        # Only the duplicate task fails.
+        self.assertIsInstance(futures[2].exception(), IntegrityError)
+        for index in (0, 1, 3):
+            self.assertEqual(futures[index].exception(), None)
+
+        self.assertEqual(writeQueue.stats, {"writes": 4, "commits": 1})
+        self.assertEqual(ToDo.objects.get(id=toDo.id).numOfTasks, 3)
+
+# The async views in front of the rest of the site, for AsyncViewTests (and
+# the event stream, which is only routed when served through asgi.py, for
+# EventTests).
+urlpatterns = [
+    path("", async_views.home),
+    path("view_todo/<int:toDoId>", async_views.view_todo),
+    path("view_todo/add_task/<int:toDoId>", async_views.add_task),
+    path("view_todo/<int:toDoId>_complete<int:taskId>", async_views.complete_task),
+    path("view_todo/<int:toDoId>/events", async_views.todo_events, name="todo_events"),
+    path("", include("to_do_app.urls")),
+]
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(TestCase):
+    """
+    Tests for the async views in async_views.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.other = User.objects.create_user("other", password="password")
+        cls.toDo = ToDo(title="Chores", desc="Around the house", position=1024, user=cls.owner)
+        cls.toDo.save()
+        cls.task = Task(title="Dishes", position=1024, belongsTo=cls.toDo, createdBy=cls.owner)
+        cls.task.save()
+
+    async def test_pages(self):
+        await self.async_client.aforce_login(self.owner)
+        response = await self.async_client.get("/")
+        self.assertContains(response, "Chores")
+
+        response = await self.async_client.get(f"/view_todo/{self.toDo.id}")
+        self.assertContains(response, "Dishes")
+        response = await self.async_client.get(f"/view_todo/{self.toDo.id}",
+            headers={"if-none-match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_add_and_complete_task(self):
+        await self.async_client.aforce_login(self.owner)
+        response = await self.async_client.post(f"/view_todo/add_task/{self.toDo.id}",
+            {"title": "Sweep"})
+        self.assertEqual(response.status_code, 302)
+        response = await self.async_client.post(f"/view_todo/add_task/{self.toDo.id}",
+            {"title": "Sweep"})
+        self.assertContains(response, "You already have a Task")
+
+        await self.async_client.get(f"/view_todo/{self.toDo.id}_complete{self.task.id}")
+        self.assertTrue((await Task.objects.aget(id=self.task.id)).done)
+        self.assertEqual((await ToDo.objects.aget(id=self.toDo.id)).numOfTasks, 2)
+
+    async def test_no_access(self):
+        await self.async_client.aforce_login(self.other)
+        response = await self.async_client.get(f"/view_todo/{self.toDo.id}")
+        self.assertContains(response, "You don&#x27;t have access")
+        await self.async_client.get(f"/view_todo/{self.toDo.id}_complete{self.task.id}")
+        self.assertFalse((await Task.objects.aget(id=self.task.id)).done)
+
+@override_settings(ROOT_URLCONF=__name__, LIVE_EVENTS_ENABLED=True)
+class EventTests(TestCase):
+    """
+    Tests for the live task updates in events.py and async_views.todo_events.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.reader = User.objects.create_user("reader", password="password")
+        cls.stranger = User.objects.create_user("stranger", password="password")
+        cls.toDo = ToDo(title="Chores", desc="Around the house", position=1024, user=cls.owner)
+        cls.toDo.save()
+        SharedWith.objects.create(user=cls.reader, todo=cls.toDo, access=AccessLevel.READ)
+        cls.task = Task(title="Dishes", position=1024, belongsTo=cls.toDo, createdBy=cls.owner)
+        cls.task.save()
+
+    async def open_stream(self, user):
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.get(f"/view_todo/{self.toDo.id}/events")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+        return stream
+
+    async def commit(self, change):
+        """
+        Makes a change, running its on commit callbacks (which publish the 
+        events) as if it had been committed.
+        """
+        def run():
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+        await sync_to_async(run)()
+
+    async def read_event(self, stream):
+        eventType, data = (await anext(stream)).decode().strip().split("\n")
+        return (eventType.removeprefix("event: "), json.loads(data.removeprefix("data: ")))
+
+    async def test_task_events(self):
+        stream = await self.open_stream(self.reader)
+
+        def complete():
+            task = Task.objects.get(id=self.task.id)
+            task.done = True
+            task.save()
+        await self.commit(complete)
+        eventType, event = await self.read_event(stream)
+        self.assertEqual(eventType, "task")
+        self.assertEqual((event["action"], event["id"], event["done"]), ("changed", self.task.id, True))
+
+        await self.commit(lambda: Task.objects.get(id=self.task.id).delete())
+        eventType, event = await self.read_event(stream)
+        self.assertEqual((event["action"], event["id"]), ("deleted", self.task.id))
+
+    async def test_unsharing_ends_stream(self):
+        stream = await self.open_stream(self.reader)
+        self.assertEqual(hub.count(), 1)
+
+        await self.commit(lambda: SharedWith.objects.filter(user=self.reader).delete())
+        eventType, event = await self.read_event(stream)
+        self.assertEqual(eventType, "revoked")
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+        self.assertEqual(hub.count(), 0)
+
+    async def test_no_access(self):
+        await self.async_client.aforce_login(self.stranger)
+        response = await self.async_client.get(f"/view_todo/{self.toDo.id}/events")
+        self.assertEqual(response.status_code, 403)
+
+    async def test_page_opens_stream(self):
+        await self.async_client.aforce_login(self.reader)
+        response = await self.async_client.get(f"/view_todo/{self.toDo.id}")
+        self.assertContains(response, f'data-events-url="/view_todo/{self.toDo.id}/events"')
+        self.assertContains(response, "todo_events.js")
+
+    @override_settings(ROOT_URLCONF="to_do_app.urls", LIVE_EVENTS_ENABLED=False)
+    def test_turned_off(self):
+        # Without asgi.py the page doesn't open a stream, which would hold a
+        # worker thread forever.
+        self.client.force_login(self.reader)
+        response = self.client.get(f"/view_todo/{self.toDo.id}")
+        self.assertContains(response, "Dishes")
+        self.assertNotContains(response, "data-events-url")
+        self.assertNotContains(response, "todo_events.js")
+        self.assertEqual(self.client.get(f"/view_todo/{self.toDo.id}/events").status_code, 404)
+
+        with override_settings(ROOT_URLCONF=__name__):
+            response = self.client.get(f"/view_todo/{self.toDo.id}/events")
+            self.assertEqual(response.status_code, 404)
+            self.assertFalse(response.streaming)
+
+class SearchTests(TestCase):
+    """
+    Tests for the full-text search in search.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.reader = User.objects.create_user("reader", password="password")
+        cls.stranger = User.objects.create_user("stranger", password="password")
+        cls.toDo = ToDo(title="Garden", desc="Weeding and watering the tomatoes", position=1024,
+            user=cls.owner)
+        cls.toDo.save()
+        cls.otherToDo = ToDo(title="Tomatoes", desc="Recipes", position=2048, user=cls.owner)
+        cls.otherToDo.save()
+        SharedWith.objects.create(user=cls.reader, todo=cls.toDo, access=AccessLevel.READ)
+        cls.task = Task(title="Water tomatoes", position=1024, belongsTo=cls.toDo, createdBy=cls.owner)
+        cls.task.save()
+
+    def search(self, user, query):
+        self.client.force_login(user)
+        return self.client.get("/api/v1/search", {"q": query}).json()
+
+    def test_ranked_results(self):
+        results = self.search(self.owner, "tomato")["results"]
+        # Title matches come before description matches, and the last word
+        # is matched as a prefix.
+        self.assertEqual([(result["kind"], result["id"]) for result in results][-1],
+            ("todo", self.toDo.id))
+        self.assertEqual(len(results), 3)
+
+    def test_visibility(self):
+        results = self.search(self.reader, "tomatoes")["results"]
+        self.assertEqual({(result["kind"], result["id"]) for result in results},
+            {("todo", self.toDo.id), ("task", self.task.id)})
+        self.assertEqual(self.search(self.stranger, "tomatoes")["results"], [])
+
+    def test_shared_todos_filtered_once(self):
+        # Sharing a todo with more users doesn't repeat it in the filter.
+        for index in range(3):
+            user = User.objects.create_user(f"user{index}", password="password")
+            SharedWith.objects.create(user=user, todo=self.toDo, access=AccessLevel.READ)
+        self.client.force_login(self.owner)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/api/v1/search", {"q": "tomatoes"})
+
+        matchQueries = [query["sql"] for query in queries.captured_queries if "toDoKey" in query["sql"]]
+        self.assertEqual(len(matchQueries), 1)
+        self.assertEqual(matchQueries[0].count(f'"t{self.toDo.id}"'), 1)
+        self.assertEqual(matchQueries[0].count(f'"t{self.otherToDo.id}"'), 1)
+
+    def test_index_follows_changes(self):
+        task = Task.objects.get(id=self.task.id)
+        task.title = "Prune roses"
+        task.save()
+        Task.objects.bulk_create([Task(title="Plant roses", position=2048, belongsTo=self.toDo,
+            createdBy=self.owner)])
+        titles = [result["title"] for result in self.search(self.owner, "roses")["results"]]
+        self.assertEqual(sorted(titles), ["Plant roses", "Prune roses"])
+
+        self.toDo.delete()
+        self.assertEqual(self.search(self.owner, "roses")["results"], [])
+
+    def test_pages_and_syntax(self):
+        for index in range(5):
+            Task(title=f"Compost {index}", position=(index + 2) * 1024, belongsTo=self.toDo,
+                createdBy=self.owner).save()
+        self.client.force_login(self.owner)
+        titles = []
+        query = "q=compost&pageSize=2"
+        while query:
+            response = self.client.get(f"/api/v1/search?{query}").json()
+            titles += [result["title"] for result in response["results"]]
+            query = response["next"]
+        self.assertEqual(sorted(titles), [f"Compost {index}" for index in range(5)])
+
+        # FTS5 syntax is treated as plain words.
+        self.assertEqual(self.search(self.owner, 'compost" OR NEAR(')["results"], [])
+        self.assertEqual(self.client.get("/api/v1/search", {"q": "!!"}).status_code, 400)
+        self.assertContains(self.client.get("/search", {"q": "compost"}), "Compost 4")
+
+class TransferTests(TestCase):
+    """
+    Tests for exporting and importing todos in transfer.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.reader = User.objects.create_user("reader", password="password")
+        cls.newUser = User.objects.create_user("newUser", password="password")
+        for index in range(3):
+            toDo = ToDo(title=f"ToDo {index}", desc=f"Desc, with \"quotes\"\n{index}",
+                position=(3 - index) * 1024, user=cls.owner)
+            toDo.save()
+            for taskIndex in range(index + 1):
+                Task(title=f"Task {taskIndex}", position=(index + 1 - taskIndex) * 1024,
+                    done=taskIndex == 0, belongsTo=toDo, createdBy=cls.owner).save()
+        SharedWith.objects.create(user=cls.reader, todo=toDo, access=AccessLevel.WRITE)
+
+    def export(self, format):
+        self.client.force_login(self.owner)
+        response = self.client.get("/api/v1/export", {"format": format})
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def import_file(self, content, format):
+        self.client.force_login(self.newUser)
+        return self.client.post(f"/api/v1/import?format={format}", content,
+            content_type="application/octet-stream")
+
+    def check_imported(self):
+        toDos = list(ToDo.objects.filter(user=self.newUser).order_by("position"))
+        # The order is kept, and the counters match the tasks.
+        self.assertEqual([toDo.title for toDo in toDos], ["ToDo 2", "ToDo 1", "ToDo 0"])
+        self.assertEqual([toDo.numOfTasks for toDo in toDos], [3, 2, 1])
+        self.assertEqual([toDo.numDone for toDo in toDos], [1, 1, 1])
+        self.assertEqual(UserStats.objects.filter(user=self.newUser).values_list(
+            "numOfToDos", "numOfTasks", "numDone").get(), (3, 6, 3))
+        self.assertEqual(toDos[0].desc, "Desc, with \"quotes\"\n2")
+        tasks = Task.objects.filter(belongsTo=toDos[0]).order_by("position")
+        self.assertEqual([(task.title, task.done) for task in tasks],
+            [("Task 2", False), ("Task 1", False), ("Task 0", True)])
+        self.assertTrue(SharedWith.objects.filter(todo=toDos[0], user=self.reader,
+            access=AccessLevel.WRITE).exists())
+
+    def test_ndjson_round_trip(self):
+        content = self.export("ndjson")
+        self.assertEqual(len(content.splitlines()), 3 + 6 + 1)
+        response = self.import_file(content, "ndjson")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"toDos": 3, "tasks": 6, "shares": 1, "skippedShares": 0})
+        self.check_imported()
+
+    def test_csv_round_trip(self):
+        response = self.import_file(self.export("csv"), "csv")
+        self.assertEqual(response.status_code, 201)
+        self.check_imported()
+
+    def test_import_is_all_or_nothing(self):
+        content = self.export("ndjson")
+        bad = content + b'{"type": "task", "toDo": 12345, "title": "Lost"}\n'
+        response = self.import_file(bad, "ndjson")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Line 11", response.json()["errorMessage"])
+        self.assertEqual(self.import_file(b"not json\n", "ndjson").status_code, 400)
+        self.assertFalse(ToDo.objects.filter(user=self.newUser).exists())
+
+        # Importing the same todos twice would duplicate them.
+        self.assertEqual(self.import_file(content, "ndjson").status_code, 201)
+        self.assertEqual(self.import_file(content, "ndjson").status_code, 400)
+        self.assertEqual(ToDo.objects.filter(user=self.newUser).count(), 3)
+
+    def test_duplicate_shares(self):
+        content = self.export("ndjson")
+        share = content.splitlines()[-1]
+        response = self.import_file(content + share + b"\n" + share + b"\n", "ndjson")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"toDos": 3, "tasks": 6, "shares": 1, "skippedShares": 2})
+        self.assertEqual(SharedWith.objects.filter(todo__user=self.newUser).count(), 1)
+
+    def test_import_page(self):
+        content = self.export("csv")
+        self.client.force_login(self.newUser)
+        upload = SimpleUploadedFile("todos.csv", content)
+        response = self.client.post("/import", {"file": upload, "format": "csv"})
+        self.assertContains(response, "Imported 3 ToDos, 6 Tasks and 1 shares.")
+        self.check_imported()
+
+class SeedingTests(TestCase):
+    """
+    Tests for the synthetic data in seeding.py and the bench_endpoints
+    command.
+    """
+
+    def test_seed_data(self):
+        seeded = seed_data(20, toDosPerUser=5, tasksPerToDo=5, prefix="test-seed")
+        self.assertEqual(len(seeded["users"]), 20)
+        self.assertEqual(Task.objects.count(), seeded["tasks"])
+        self.assertEqual(SharedWith.objects.count(), seeded["shares"])
+        # The counters match the tasks that were made.
+        for toDo in ToDo.objects.annotate(numOfRows=Count("task"),
+                numOfDoneRows=Count("task", filter=Q(task__done=True))):
+            self.assertEqual(toDo.numOfTasks, toDo.numOfRows)
+            self.assertEqual(toDo.numDone, toDo.numOfDoneRows)
+        self.assertEqual(UserStats.objects.aggregate(Sum("numDone"))["numDone__sum"],
+            Task.objects.filter(done=True).count())
+
+        self.assertEqual(clear_seed_data("test-seed"), 20)
+        self.assertFalse(ToDo.objects.exists())
+
+    # The command makes its requests as localhost, like bench_asgi.
+    @override_settings(ALLOWED_HOSTS=["localhost"], METRICS_ENABLED=True)
+    def test_bench_endpoints(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, "results.json")
+            call_command("bench_endpoints", users=5, todos=4, tasks=4, repeat=1, output=output,
+                stdout=io.StringIO())
+            with open(output) as file:
+                endpoints = json.load(file)["endpoints"]
+
+        # Every URL is measured, and none of them fail.
+        names = [pattern.name for pattern in urls.urlpatterns + api_urls.urlpatterns
+            if isinstance(pattern, URLPattern) and pattern.name not in SKIPPED_URLS]
+        self.assertEqual(sorted(endpoints), sorted(names))
+        for name, result in endpoints.items():
+            self.assertTrue(all(status < 400 for status in result["status"]), name)
+        self.assertFalse(User.objects.filter(username__startswith="bench-endpoints-").exists())
+
+class CompletionStatsTests(TestCase):
+    """
+    Tests for the numDone of todos and the UserStats of users, which are
+    kept up to date as tasks change rather than counted.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.toDo = ToDo(title="Chores", desc="Around the house", position=1024, user=cls.owner)
+        cls.toDo.save()
+        cls.tasks = []
+        for index, title in enumerate(["Dishes", "Sweep", "Laundry"]):
+            task = Task(title=title, position=(index + 1) * 1024, done=index == 0,
+                belongsTo=cls.toDo, createdBy=cls.owner)
+            task.save()
+            cls.tasks.append(task)
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def assertCounts(self, numOfTasks, numDone, numOfToDos=1):
+        """
+        Checks the counters of the todo and its owner, and that they match
+        the tasks.
+        """
+        toDo = ToDo.objects.get(id=self.toDo.id)
+        self.assertEqual((toDo.numOfTasks, toDo.numDone), (numOfTasks, numDone))
+        self.assertEqual(Task.objects.filter(belongsTo=toDo, done=True).count(), numDone)
+        self.assertEqual(UserStats.objects.filter(user=self.owner).values_list(
+            "numOfToDos", "numOfTasks", "numDone").get(), (numOfToDos, numOfTasks, numDone))
+
+    def test_save_and_delete(self):
+        self.assertCounts(3, 1)
+        Task.objects.get(id=self.tasks[1].id).toggleDone()
+        self.assertCounts(3, 2)
+
+        # Saving without changing done doesn't count it again.
+        task = Task.objects.get(id=self.tasks[1].id)
+        task.title = "Mop"
+        task.save()
+        self.assertCounts(3, 2)
+
+        Task.objects.get(id=self.tasks[0].id).delete()
+        self.assertCounts(2, 1)
+        Task.objects.get(id=self.tasks[2].id).delete()
+        self.assertCounts(1, 1)
+
+        ToDo.objects.get(id=self.toDo.id).delete()
+        self.assertEqual(UserStats.objects.filter(user=self.owner).values_list(
+            "numOfToDos", "numOfTasks", "numDone").get(), (0, 0, 0))
+
+    def test_stale_deletes(self):
+        # Two requests that both loaded the task before either deleted it
+        # only take it off the counts once.
+        first = Task.objects.get(id=self.tasks[1].id)
+        second = Task.objects.get(id=self.tasks[1].id)
+        self.assertEqual(first.delete()[0], 1)
+        self.assertEqual(second.delete()[0], 0)
+        toDo = ToDo.objects.get(id=self.toDo.id)
+        self.assertEqual(toDo.numOfTasks, Task.objects.filter(belongsTo=toDo).count())
+        self.assertEqual(toDo.numOfTasks, 2)
+
+    def test_stale_done_deletes(self):
+        # The same for the done counts, including a task removed by a batch
+        # while an API delete of it is in flight.
+        stale = Task.objects.get(id=self.tasks[0].id)
+        Task.objects.get(id=self.tasks[0].id).delete()
+        stale.delete()
+        self.assertCounts(2, 0)
+
+        Task.objects.get(id=self.tasks[1].id).toggleDone()
+        stale = Task.objects.get(id=self.tasks[1].id)
+        response = self.client.post(f"/view_todo/{self.toDo.id}/batch", json.dumps({"operations": [
+            {"op": "remove", "id": self.tasks[1].id},
+        ]}), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        stale.delete()
+        self.assertCounts(1, 0)
+
+    def test_concurrent_toggles(self):
+        # Two requests that both loaded the task before either toggled it
+        # only change it (and the counts) once.
+        first = Task.objects.get(id=self.tasks[1].id)
+        second = Task.objects.get(id=self.tasks[1].id)
+        first.toggleDone()
+        second.toggleDone()
+        self.assertTrue(Task.objects.get(id=self.tasks[1].id).done)
+        self.assertCounts(3, 2)
+
+        # The same for a stale copy being deleted.
+        stale = Task.objects.get(id=self.tasks[0].id)
+        Task.objects.get(id=self.tasks[0].id).toggleDone()
+        self.assertCounts(3, 1)
+        stale.delete()
+        self.assertCounts(2, 1)
+
+    def test_views(self):
+        self.client.get(f"/view_todo/{self.toDo.id}_complete{self.tasks[1].id}")
+        self.assertCounts(3, 2)
+
+        response = self.client.post(f"/view_todo/{self.toDo.id}/batch", json.dumps({"operations": [
+            {"op": "complete", "id": self.tasks[1].id, "done": False},
+            {"op": "complete", "id": self.tasks[2].id},
+            {"op": "remove", "id": self.tasks[0].id},
+            {"op": "add", "title": "Mop"},
+        ]}), content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertCounts(3, 1)
+
+        response = self.client.get("/")
+        self.assertContains(response, "Done: 1/3")
+        self.assertContains(response, "You have done 1 of the 3 Tasks in your 1 ToDos.")
+
+    def test_api(self):
+        response = self.client.patch(f"/api/v1/tasks/{self.tasks[2].id}", {"done": True},
+            content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertCounts(3, 2)
+
+        response = self.client.get("/api/v1/todos", {"fields": "id,numOfTasks,numDone"})
+        self.assertEqual(response.json()["results"],
+            [{"id": self.toDo.id, "numOfTasks": 3, "numDone": 2}])
+        response = self.client.get("/api/v1/stats")
+        self.assertEqual(response.json(), {"numOfToDos": 1, "numOfTasks": 3, "numDone": 2})
+
+class ReconcileTests(TestCase):
+    """
+    Tests for fixing counters that have drifted, in reconcile.py.
+    """
+
+    def reconcile(self, *args):
+        output = io.StringIO()
+        call_command("reconcile_counters", *args, stdout=output)
+        return output.getvalue()
+
+    def test_reconcile(self):
+        seed_data(6, toDosPerUser=4, tasksPerToDo=6, prefix="test-seed")
+        self.assertIn("Found 0 of", self.reconcile("--dry-run"))
+
+        # Changes that bypass Task.save/Task.delete.
+        toDo = ToDo.objects.filter(numOfTasks__gt=1).first()
+        Task.objects.filter(belongsTo=toDo).update(done=True, lastModified=timezone.now())
+        Task.objects.filter(id=Task.objects.filter(belongsTo=toDo).first().id).delete()
+        UserStats.objects.filter(user=toDo.user_id).delete()
+        before = ToDo.objects.get(id=toDo.id)
+
+        output = self.reconcile("--dry-run", "--chunk-size", "2")
+        self.assertRegex(output, rf"todo {toDo.id}: .*lastModified")
+        self.assertIn(f"numDone {before.numDone} -> {before.numOfTasks - 1}", output)
+        self.assertIn(f"user {toDo.user_id}: numOfToDos None -> ", output)
+        self.assertIn("Found 1 of", output)
+        # Nothing is fixed in a dry run.
+        self.assertEqual(ToDo.objects.get(id=toDo.id).numDone, before.numDone)
+
+        self.assertIn("Fixed 1 of", self.reconcile("--chunk-size", "2"))
+        toDo = ToDo.objects.get(id=toDo.id)
+        self.assertEqual((toDo.numOfTasks, toDo.numDone), (before.numOfTasks - 1, before.numOfTasks - 1))
+        self.assertGreater(toDo.lastModified, before.lastModified)
+        stats = UserStats.objects.get(user=toDo.user_id)
+        self.assertEqual(stats.numDone, Task.objects.filter(belongsTo__user=toDo.user_id, done=True).count())
+        self.assertIn("Found 0 of", self.reconcile("--dry-run"))
+
+class PurgeTests(TestCase):
+    """
+    Tests for deleting todos and users, which hides them straight away and
+    removes their rows a chunk at a time (see purge.py).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.other = User.objects.create_user("other", password="password")
+        cls.toDo = ToDo(title="Garden", desc="Weeding", position=1024, user=cls.owner)
+        cls.toDo.save()
+        for index in range(5):
+            Task(title=f"Weed bed {index}", position=(index + 1) * 1024, done=index == 0,
+                belongsTo=cls.toDo, createdBy=cls.owner).save()
+        SharedWith.objects.create(user=cls.other, todo=cls.toDo, access=AccessLevel.WRITE)
+
+        # A todo of the other user, which the owner added to.
+        cls.otherToDo = ToDo(title="Shopping", desc="Groceries", position=1024, user=cls.other)
+        cls.otherToDo.save()
+        for index, createdBy in enumerate([cls.owner, cls.owner, cls.other]):
+            Task(title=f"Item {index}", position=(index + 1) * 1024, done=index == 0,
+                belongsTo=cls.otherToDo, createdBy=createdBy).save()
+        SharedWith.objects.create(user=cls.owner, todo=cls.otherToDo, access=AccessLevel.WRITE)
+
+    def purge(self, *args):
+        output = io.StringIO()
+        call_command("purge_deleted", *args, stdout=output)
+        return output.getvalue()
+
+    def reconcile(self):
+        output = io.StringIO()
+        call_command("reconcile_counters", "--dry-run", stdout=output)
+        return output.getvalue()
+
+    def test_soft_delete(self):
+        self.client.force_login(self.owner)
+        task = Task.objects.filter(belongsTo=self.toDo).first()
+        # However many tasks the todo has (with queueing the job purging it).
+        with self.assertNumQueries(8):
+            self.client.get(f"/_remove{self.toDo.id}")
+        self.assertEqual(Job.objects.get().kwargs, {"userId": self.owner.id})
+
+        # Hidden from everyone straight away, but the rows are still there.
+        self.assertFalse(ToDo.objects.filter(id=self.toDo.id).exists())
+        self.assertEqual(Task.objects.filter(belongsTo=self.toDo).count(), 5)
+        self.assertEqual(self.client.get(f"/api/v1/todos/{self.toDo.id}").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/v1/tasks/{task.id}").status_code, 404)
+        self.assertEqual(self.client.get("/api/v1/search", {"q": "weed"}).json()["results"], [])
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(f"/api/v1/todos/{self.toDo.id}").status_code, 404)
+        self.assertEqual(UserStats.objects.filter(user=self.owner).values_list(
+            "numOfToDos", "numOfTasks", "numDone").get(), (0, 0, 0))
+        self.assertFalse(ToDo.allObjects.get(id=self.toDo.id).softDelete())
+
+        # A todo just like it can be made again.
+        ToDo(title="Garden", desc="Weeding", position=2048, user=self.owner).save()
+
+        self.assertIn("Removed 1 todos, 5 tasks and 1 shares", self.purge("--chunk-size", "2"))
+        self.assertFalse(ToDo.allObjects.filter(id=self.toDo.id).exists())
+        self.assertFalse(Task.objects.filter(belongsTo=self.toDo.id).exists())
+        self.assertIn("Removed 0 todos", self.purge())
+        self.assertIn("Found 0 of", self.reconcile())
+
+    def test_tasks_deleted_without_loading(self):
+        # Purging relies on Django deleting tasks with one DELETE a chunk,
+        # which it only does while nothing listens for them being deleted.
+        self.assertFalse(pre_delete.has_listeners(Task))
+        self.assertFalse(post_delete.has_listeners(Task))
+        self.toDo.softDelete()
+        with CaptureQueriesContext(connection) as queries:
+            self.purge("--chunk-size", "10")
+        taskSelects = [query["sql"] for query in queries.captured_queries
+            if query["sql"].startswith('SELECT "todo_task"."id", "todo_task"."title"')]
+        self.assertEqual(taskSelects, [])
+
+    def test_purge_user(self):
+        output = self.purge("--user", "owner", "--chunk-size", "2")
+        self.assertIn("Removed 1 todos, 7 tasks and 2 shares", output)
+        self.assertFalse(User.objects.filter(username="owner").exists())
+
+        # Only the other users own task is left in their todo.
+        otherToDo = ToDo.objects.get(id=self.otherToDo.id)
+        self.assertEqual((otherToDo.numOfTasks, otherToDo.numDone), (1, 0))
+        self.assertEqual(list(Task.objects.values_list("title", flat=True)), ["Item 2"])
+        self.assertFalse(SharedWith.objects.exists())
+        self.assertIn("Found 0 of", self.reconcile())
+
+# The jobs run by JobTests.
+ranJobs = []
+
+def record_job(value):
+    ranJobs.append(value)
+
+def failing_job():
+    raise ValueError("Job failed")
+
+@override_settings(JOB_MAX_ATTEMPTS=2, JOB_RETRY_DELAY=60)
+class JobTests(TransactionTestCase):
+    """
+    Tests for the background jobs in jobs.py, and their throughput.
+    """
+
+    def setUp(self):
+        ranJobs.clear()
+
+    def test_run_and_retry(self):
+        enqueue(record_job, "first")
+        enqueue(failing_job)
+        enqueue(record_job, "later", delay=60)
+
+        jobs = claim_jobs(10)
+        self.assertEqual([job.name for job in jobs], ["todo.tests.record_job", "todo.tests.failing_job"])
+        # Claimed jobs aren't given to anyone else.
+        self.assertEqual(claim_jobs(10), [])
+        with self.assertLogs("todo.jobs", "ERROR"):
+            self.assertEqual([run_job(job) for job in jobs], [True, False])
+        self.assertEqual(ranJobs, ["first"])
+
+        # The failed job is retried later, and failed for good after its
+        # last attempt.
+        job = Job.objects.get(name="todo.tests.failing_job")
+        self.assertIn("ValueError: Job failed", job.lastError)
+        self.assertGreater(job.runAt, timezone.now())
+        Job.objects.update(runAt=timezone.now())
+        with self.assertLogs("todo.jobs", "ERROR"):
+            self.assertEqual([run_job(job) for job in claim_jobs(10)], [False, True])
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (JobStatus.FAILED, 2))
+        self.assertEqual(claim_jobs(10), [])
+
+        self.assertEqual(retry_failed_jobs(), 1)
+        self.assertEqual(claim_jobs(10)[0].attempts, 1)
+
+    def test_visibility_timeout(self):
+        enqueue(record_job, "once")
+        # The first worker dies without finishing the job.
+        stale = claim_jobs(1, visibilityTimeout=0)[0]
+        job = claim_jobs(1)[0]
+        self.assertEqual((job.id, job.attempts), (stale.id, 2))
+
+        # The first worker finishing late doesn't finish it for the second
+        # (so jobs can run more than once).
+        run_job(stale)
+        self.assertTrue(Job.objects.exists())
+        run_job(job)
+        self.assertEqual(ranJobs, ["once", "once"])
+        self.assertFalse(Job.objects.exists())
+
+    def test_only_committed_jobs(self):
+        owner = User.objects.create_user("owner", password="password")
+        toDo = ToDo(title="Garden", desc="Weeding", position=1024, user=owner)
+        toDo.save()
+        Task(title="Weed", position=1024, belongsTo=toDo, createdBy=owner).save()
+
+        try:
+            with transaction.atomic():
+                enqueue(record_job, "rolled back")
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertFalse(Job.objects.exists())
+
+        # Deleting a todo hands purging it to a job.
+        self.client.force_login(owner)
+        self.assertEqual(self.client.delete(f"/api/v1/todos/{toDo.id}").status_code, 204)
+        self.assertTrue(ToDo.allObjects.filter(id=toDo.id).exists())
+        self.assertEqual(Worker(burst=True).run(), {"succeeded": 1, "failed": 0})
+        self.assertFalse(ToDo.allObjects.filter(id=toDo.id).exists())
+        self.assertFalse(Task.objects.exists())
+
+    def test_throughput(self):
+        numOfJobs = 2000
+
+        start = time.perf_counter()
+        for index in range(100):
+            enqueue(record_job, index)
+        enqueue_many(record_job, [(index,) for index in range(100, numOfJobs)])
+        enqueueSeconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        stats = Worker(threads=4, batchSize=50, pollInterval=0.01, burst=True).run()
+        runSeconds = time.perf_counter() - start
+
+        # Every job ran exactly once.
+        self.assertEqual(stats, {"succeeded": numOfJobs, "failed": 0})
+        self.assertEqual(sorted(ranJobs), list(range(numOfJobs)))
+        self.assertFalse(Job.objects.exists())
+
+        # Far below what they manage, so this only fails if something is
+        # badly wrong (like a query per job when claiming).
+        self.assertGreater(numOfJobs / enqueueSeconds, 500)
+        self.assertGreater(numOfJobs / runSeconds, 200)
+
+class QueryCountTests(TestCase):
+    """
+    Tests that the number of queries each view makes doesn't grow with the
+    number of todos, tasks or shares (no queries per row), and stays under
+    a bound.
+    """
+
+    # The fixtures: (todos, tasks per todo, users each todo is shared with).
+    SIZES = [(1, 1, 1), (8, 15, 3), (30, 60, 6)]
+
+    # The most queries each view may make (the session and user of each
+    # request are read from the shared cache, see accounts/backends.py).
+    # Adding, completing and removing tasks also update the UserStats.
+    MAX_QUERIES = {
+        "home": 3,
+        "view_todo": 3,
+        "add_task": 9,
+        "edit_task": 7,
+        "complete_task": 9,
+        "remove_task": 8,
+        "share_todo": 5,
+        "unshare_todo": 3,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixtures = [cls.seed(index, *size) for index, size in enumerate(cls.SIZES)]
+
+    @classmethod
+    def seed(cls, index, numOfToDos, tasksPerToDo, sharesPerToDo):
+        """
+        Makes a user with todos, tasks and shares, with todos of the users
+        they are shared with shared back with them.
+        """
+        owner = User.objects.create_user(f"owner-{index}", password="password")
+        friends = [User.objects.create_user(f"friend-{index}-{friendIndex}", password="password")
+            for friendIndex in range(sharesPerToDo)]
+        now = timezone.now()
+
+        toDos = ToDo.objects.bulk_create([
+            ToDo(title=f"ToDo {toDoIndex}", desc="Desc", descHash=ToDo.hashDesc("Desc"), user=user,
+                position=(toDoIndex + 1) * 1024, lastModified=now, numOfTasks=tasksPerToDo)
+            for user in [owner] + friends for toDoIndex in range(numOfToDos)])
+        Task.objects.bulk_create([
+            Task(title=f"Task {taskIndex}", belongsTo=toDo, createdBy=toDo.user, done=taskIndex % 2 == 0,
+                position=(taskIndex + 1) * 1024, lastModified=now)
+            for toDo in toDos for taskIndex in range(tasksPerToDo)])
+        SharedWith.objects.bulk_create(
+            [SharedWith(user=friend, todo=toDo, access=AccessLevel.WRITE)
+                for toDo in toDos if toDo.user_id == owner.id for friend in friends] +
+            [SharedWith(user=owner, todo=toDo, access=AccessLevel.WRITE)
+                for toDo in toDos if toDo.user_id != owner.id])
+
+        toDo = toDos[0]
+        return {
+            "owner": owner,
+            "friend": friends[0],
+            "toDo": toDo,
+            "task": Task.objects.filter(belongsTo=toDo).first(),
+            "newFriend": User.objects.create_user(f"new-friend-{index}", password="password"),
+        }
+
+    def count_queries(self, fixture, method, url, data=None):
+        # Clearing the fragment cache, so every view renders everything.
+        cache.clear()
+        self.client.force_login(fixture["owner"])
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data)
+        self.assertLess(response.status_code, 400, url)
+        return len(queries)
+
+    def check_queries(self, view, gen_request):
+        counts = [self.count_queries(fixture, *gen_request(fixture)) for fixture in self.fixtures]
+        self.assertEqual(len(set(counts)), 1,
+            f"The queries made by {view} grow with the fixture size: {counts}")
+        self.assertLessEqual(counts[0], self.MAX_QUERIES[view])
+
+    def test_home(self):
+        self.check_queries("home", lambda fixture: ("get", "/"))
+
+    def test_view_todo(self):
+        self.check_queries("view_todo", lambda fixture: ("get", f"/view_todo/{fixture['toDo'].id}"))
+
+    def test_add_task(self):
+        self.check_queries("add_task", lambda fixture: ("post",
+            f"/view_todo/add_task/{fixture['toDo'].id}", {"title": "New task"}))
+
+    def test_edit_task(self):
+        self.check_queries("edit_task", lambda fixture: ("post",
+            f"/view_todo/edit_task/{fixture['task'].id}", {"title": "Edited task"}))
+
+    def test_complete_task(self):
+        self.check_queries("complete_task", lambda fixture: ("get",
+            f"/view_todo/{fixture['toDo'].id}_complete{fixture['task'].id}"))
+
+    def test_remove_task(self):
+        self.check_queries("remove_task", lambda fixture: ("get",
+            f"/view_todo/{fixture['toDo'].id}_remove{fixture['task'].id}"))
+
+    def test_share_todo(self):
+        self.check_queries("share_todo", lambda fixture: ("post",
+            f"/share_todo/{fixture['toDo'].id}",
+            {"username": fixture["newFriend"].username, "access": AccessLevel.READ}))
+
+    def test_unshare_todo(self):
+        self.check_queries("unshare_todo", lambda fixture: ("get",
+            f"/_unshare{fixture['toDo'].id}_{fixture['friend'].id}"))
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0)
+class ProfilingTests(TestCase):
+    """
+    Tests for the profiling middleware in profiling.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password", is_staff=True)
+        cls.toDo = ToDo(title="Chores", desc="Around the house", position=1024, user=cls.owner)
+        cls.toDo.save()
+
+    def setUp(self):
+        profiling.stats.reset()
+
+    def get_timings(self, response):
+        timings = {}
+        for metric in response["Server-Timing"].split(", "):
+            name, duration = metric.split(";")[:2]
+            timings[name] = float(duration.removeprefix("dur="))
+        return timings
+
+    def test_server_timing(self):
+        self.client.force_login(self.owner)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/view_todo/{self.toDo.id}")
+        numOfQueries = len(queries)
+        self.assertIn(f'desc="{numOfQueries} queries"', response["Server-Timing"])
+        timings = self.get_timings(response)
+        self.assertGreater(timings["tpl"], 0)
+        self.assertGreaterEqual(timings["total"], timings["db"] + timings["tpl"])
+
+        report = self.client.get("/api/v1/profile_stats").json()
+        self.assertEqual(report["view_todo"]["requests"], 1)
+        self.assertEqual(report["view_todo"]["queries"], numOfQueries)
+
+    @override_settings(PROFILING_SAMPLE_RATE=0.0)
+    def test_unsampled_requests(self):
+        self.client.force_login(self.owner)
+        response = self.client.get("/")
+        self.assertFalse(response.has_header("Server-Timing"))
+        self.assertEqual(profiling.get_profile_stats(), {})
+
+    @override_settings(ROOT_URLCONF=__name__)
+    async def test_async_views(self):
+        await self.async_client.aforce_login(self.owner)
+        response = await self.async_client.get(f"/view_todo/{self.toDo.id}")
+        self.assertContains(response, "Chores")
+        self.assertGreater(self.get_timings(response)["db"], 0)
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsTests(TestCase):
+    """
+    Tests for the Prometheus metrics in metrics.py.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner", password="password")
+        cls.toDo = ToDo(title="Chores", desc="Around the house", position=1024, user=cls.owner)
+        cls.toDo.save()
+
+    def get_metric(self, line):
+        # The value of a metric (its name and labels), 0 if it is missing.
+        for metricLine in self.client.get("/metrics").content.decode().splitlines():
+            if metricLine.startswith(line + " "):
+                return float(metricLine.split()[-1])
+        return 0
+
+    def test_requests_and_writes(self):
+        self.client.force_login(self.owner)
+        homeRequests = 'todo_http_requests_total{view="home",method="GET",status="200"}'
+        homeLatency = 'todo_http_request_duration_seconds_count{view="home"}'
+        addedTasks = 'todo_model_writes_total{model="task",action="added"}'
+        before = [self.get_metric(line) for line in (homeRequests, homeLatency, addedTasks)]
+
+        self.client.get("/")
+        self.client.post(f"/view_todo/add_task/{self.toDo.id}", {"title": "Dishes"})
+
+        after = [self.get_metric(line) for line in (homeRequests, homeLatency, addedTasks)]
+        self.assertEqual([value - old for value, old in zip(after, before)], [1, 1, 1])
+        self.assertGreater(self.get_metric('todo_db_queries_total{view="home"}'), 0)
+        self.assertGreaterEqual(
+            self.get_metric('todo_http_request_duration_seconds_bucket{view="home",le="+Inf"}'),
+            after[1])
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        self.assertContains(response, "# TYPE todo_http_requests_total counter")
+
+    def test_threads(self):
+        before = metrics.get_value("todo_fragment_cache_hits_total")
+        threads = [threading.Thread(target=lambda: [metrics.inc("todo_fragment_cache_hits_total")
+            for _ in range(1000)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(metrics.get_value("todo_fragment_cache_hits_total") - before, 8000)
+
+    def test_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # The metrics another worker process wrote.
+            with open(os.path.join(directory, "metrics-1.json"), "w") as file:
+                json.dump({"counters": [["todo_model_writes_total",
+                    [["model", "todo"], ["action", "deleted"]], 5]], "histograms": []}, file)
+            line = 'todo_model_writes_total{model="todo",action="deleted"}'
+            before = self.get_metric(line)
+
+            with override_settings(METRICS_DIR=directory):
+                self.assertEqual(self.get_metric(line), before + 5)
+                self.assertTrue(os.path.exists(os.path.join(directory, f"metrics-{os.getpid()}.json")))
@@ -0,0 +1,376 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+import codecs
+import collections
+import csv
+import json
+
+from .forms import ToDoForm, TaskForm
+from .metrics import count_writes
+from .models import ToDo, Task, SharedWith, AccessLevel, UserStats
+from .ordering import POSITION_GAP, next_position
+
+# Exporting all of a users todos, their tasks and who they are shared with,
+# and importing them again (into the same or another account). Both work a
+# chunk of rows at a time, so memory stays flat however big the account is.
+#
+# An export is a stream of records, one per line, in this order: the todos,
+# then their tasks, then their shares. Each record has a "type" ("todo",
+# "task" or "share") and the "toDo" it belongs to (the id of the todo in the
+# account it was exported from, which only links the records together).
+# Imports create new todos, keeping the order of the todos and tasks in the
+# file, and need each todo to come before its tasks and shares.
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# The columns of a CSV export, records only fill in the ones they have.
+EXPORT_COLUMNS = ["type", "toDo", "title", "desc", "done", "position", "createdBy",
+    "username", "access", "dateCreated", "lastModified"]
+
+# How many rows are fetched from the database at a time by exports, and
+# inserted at a time by imports.
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_CHUNK_SIZE = 500
+
+# Exports are sent in pieces of about this many bytes, rather than a line
+# at a time.
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+def gen_export_records(userId):
+    """
+    Generates the records of every todo a user owns, their tasks and their
+    shares, reading the rows from the database in chunks.
+    """
+    toDos = (ToDo.objects
+        .filter(user=userId)
+        .order_by("position", "id")
+        .values("id", "title", "desc", "position", "dateCreated", "lastModified"))
+    for toDo in toDos.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        toDo["toDo"] = toDo.pop("id")
+        yield {"type": "todo", **toDo}
+
+    tasks = (Task.objects
+        .filter(belongsTo__user=userId, belongsTo__deletedAt__isnull=True)
+        .order_by("belongsTo", "position", "id")
+        .values("belongsTo_id", "title", "done", "position", "createdBy__username",
+            "dateCreated", "lastModified"))
+    for task in tasks.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        task["toDo"] = task.pop("belongsTo_id")
+        task["createdBy"] = task.pop("createdBy__username")
+        yield {"type": "task", **task}
+
+    shares = (SharedWith.objects
+        .filter(todo__user=userId, todo__deletedAt__isnull=True)
+        .order_by("todo", "id")
+        .values("todo_id", "user__username", "access"))
+    for share in shares.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield {"type": "share", "toDo": share["todo_id"], "username": share["user__username"],
+            "access": share["access"]}
+
+class _Echo:
+    """
+    A file-like object returning what is written to it, so that csv.writer
+    can format rows without storing them.
+    """
+
+    def write(self, value):
+        return value
+
+def _gen_ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + "\n"
+
+def _gen_csv_lines(records):
+    writer = csv.DictWriter(_Echo(), EXPORT_COLUMNS)
+    yield writer.writeheader()
+    for record in records:
+        yield writer.writerow(record)
+
+def _buffer(lines):
+    # Joining lines into bigger pieces, so the server isn't writing to the
+    # connection for every row.
+    pieces = []
+    size = 0
+    for line in lines:
+        pieces.append(line)
+        size += len(line)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield "".join(pieces)
+            pieces = []
+            size = 0
+    if pieces:
+        yield "".join(pieces)
+
+def gen_export(userId, format):
+    """
+    Used to stream an export of a users todos (for a StreamingHttpResponse).
+
+    Params:
+        - userId: int
+        - format: str, one of EXPORT_FORMATS
+
+    returns: a generator of strings.
+    """
+    records = gen_export_records(userId)
+    if format == "csv":
+        return _buffer(_gen_csv_lines(records))
+    return _buffer(_gen_ndjson_lines(records))
+
+class _InvalidRecord(Exception):
+    """
+    Raised while importing to stop the import, with the error message for
+    the user (and the line it is on, if the record couldn't be read).
+    """
+
+    def __init__(self, message, lineNumber=None):
+        super().__init__(message)
+        self.lineNumber = lineNumber
+
+def _gen_ndjson_records(lines):
+    for lineNumber, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise _InvalidRecord("Invalid JSON.", lineNumber)
+        if not isinstance(record, dict):
+            raise _InvalidRecord("Each line must be a JSON object.", lineNumber)
+        yield (lineNumber, record)
+
+def _gen_csv_records(lines):
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield (reader.line_num, record)
+
+def _clean(form, fieldName, value, errorMessage):
+    # Validating a value with the field of a form (the same way the form
+    # would), without making a form for every row.
+    try:
+        return form.base_fields[fieldName].clean(value)
+    except ValidationError:
+        raise _InvalidRecord(errorMessage)
+
+def _parse_done(done):
+    # CSV exports write booleans as True/False.
+    if isinstance(done, bool):
+        return done
+    if done in (None, "", "False", "false", "0"):
+        return False
+    if done in ("True", "true", "1"):
+        return True
+    raise _InvalidRecord(f"Invalid done value {done!r}.")
+
+class _Importer:
+    """
+    Builds the rows of an import up in chunks, inserting each chunk with one
+    bulk_create. The numOfTasks and numDone of the todos are updated once
+    per chunk of tasks (rather than once per task, like Task.save does), the
+    users UserStats once at the end, and the todos and tasks get positions
+    in the order they are in the file.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.now = timezone.now()
+        # The todos in the file, by their "toDo" key. Todos that haven't been
+        # inserted yet are kept until they are, then only their id.
+        self.toDos = {}
+        self.pendingToDos = []
+        self.pendingTasks = []
+        self.pendingShares = []
+        # The (todo id, user id) of the shares inserted so far.
+        self.sharePairs = set()
+        self.position = next_position(ToDo.objects.filter(user=user))
+        self.taskPositions = collections.defaultdict(int)
+        self.result = {"toDos": 0, "tasks": 0, "shares": 0, "skippedShares": 0}
+        self.numDone = 0
+
+    def add(self, record):
+        recordType = record.get("type")
+        key = str(record.get("toDo"))
+
+        if recordType == "todo":
+            self.add_todo(key, record)
+            return
+
+        if recordType not in ("task", "share"):
+            raise _InvalidRecord(f"Unknown record type {recordType!r}.")
+        if key not in self.toDos:
+            raise _InvalidRecord(f"There is no ToDo {key} before this {recordType}.")
+        toDoId = self.get_todo_id(key)
+
+        if recordType == "task":
+            self.add_task(toDoId, record)
+        else:
+            self.add_share(toDoId, record)
+
+    def get_todo_id(self, key):
+        toDo = self.toDos[key]
+        if isinstance(toDo, ToDo):
+            # Tasks and shares need the id of their todo.
+            self.flush_todos()
+            toDo = self.toDos[key]
+        return toDo
+
+    def add_todo(self, key, record):
+        if key in self.toDos:
+            raise _InvalidRecord(f"There is more than one ToDo {key}.")
+
+        title = _clean(ToDoForm, "title", record.get("title"), "Invalid ToDo title.")
+        desc = _clean(ToDoForm, "desc", record.get("desc"), "Invalid ToDo description.")
+
+        # Setting what ToDo.save would, as bulk_create doesn't call it.
+        toDo = ToDo(title=title, desc=desc, descHash=ToDo.hashDesc(desc), user=self.user,
+            position=self.position, lastModified=self.now)
+        self.position += POSITION_GAP
+        self.toDos[key] = toDo
+        self.pendingToDos.append(key)
+        if len(self.pendingToDos) >= IMPORT_CHUNK_SIZE:
+            self.flush_todos()
+
+    def add_task(self, toDoId, record):
+        title = _clean(TaskForm, "title", record.get("title"), "Invalid Task title.")
+
+        self.taskPositions[toDoId] += POSITION_GAP
+        self.pendingTasks.append(Task(title=title,
+            done=_parse_done(record.get("done")), position=self.taskPositions[toDoId],
+            lastModified=self.now, belongsTo_id=toDoId, createdBy=self.user))
+        if len(self.pendingTasks) >= IMPORT_CHUNK_SIZE:
+            self.flush_tasks()
+
+    def add_share(self, toDoId, record):
+        access = record.get("access") or AccessLevel.READ
+        if access not in AccessLevel.values:
+            raise _InvalidRecord(f"Invalid access level {access!r}.")
+
+        self.pendingShares.append((toDoId, record.get("username"), access))
+        if len(self.pendingShares) >= IMPORT_CHUNK_SIZE:
+            self.flush_shares()
+
+    def flush_todos(self):
+        if not self.pendingToDos:
+            return
+        toDos = ToDo.objects.bulk_create([self.toDos[key] for key in self.pendingToDos])
+        for key, toDo in zip(self.pendingToDos, toDos):
+            self.toDos[key] = toDo.id
+        self.result["toDos"] += len(toDos)
+        self.pendingToDos = []
+
+    def flush_tasks(self):
+        if not self.pendingTasks:
+            return
+        Task.objects.bulk_create(self.pendingTasks)
+
+        # The tasks of a todo are together in exports, so this is usually
+        # one or two updates.
+        numOfNewTasks = collections.Counter(task.belongsTo_id for task in self.pendingTasks)
+        numOfNewDone = collections.Counter(task.belongsTo_id for task in self.pendingTasks
+            if task.done)
+        for toDoId, numOfTasks in numOfNewTasks.items():
+            ToDo.objects.filter(id=toDoId).update(numOfTasks=F("numOfTasks") + numOfTasks,
+                numDone=F("numDone") + numOfNewDone[toDoId])
+        self.result["tasks"] += len(self.pendingTasks)
+        self.numDone += sum(numOfNewDone.values())
+        self.pendingTasks = []
+
+    def flush_shares(self):
+        if not self.pendingShares:
+            return
+        usernames = {username for toDoId, username, access in self.pendingShares}
+        userIds = dict(User.objects.filter(username__in=usernames).values_list("username", "id"))
+
+        # Skipping users that don't exist here (or the user importing), and
+        # shares that are in the file twice. The todos were all made by this
+        # import, so nothing else can be shared with them and every share
+        # left is inserted.
+        shares = []
+        for toDoId, username, access in self.pendingShares:
+            userId = userIds.get(username)
+            if userId == None or userId == self.user.id or (toDoId, userId) in self.sharePairs:
+                continue
+            self.sharePairs.add((toDoId, userId))
+            shares.append(SharedWith(todo_id=toDoId, user_id=userId, access=access))
+        SharedWith.objects.bulk_create(shares)
+        self.result["shares"] += len(shares)
+        self.result["skippedShares"] += len(self.pendingShares) - len(shares)
+        self.pendingShares = []
+
+    def finish(self):
+        self.flush_todos()
+        self.flush_tasks()
+        self.flush_shares()
+
+        # Adding everything imported to the users totals at once.
+        UserStats.objects.filter(user=self.user).update(
+            numOfToDos=F("numOfToDos") + self.result["toDos"],
+            numOfTasks=F("numOfTasks") + self.result["tasks"],
+            numDone=F("numDone") + self.numDone)
+        return self.result
+
+def import_records(user, lines, format):
+    """
+    Used to import an export (see gen_export) into a users account, reading
+    it a line at a time. Either all of it is imported, or none of it: the
+    rows are inserted a chunk at a time, but in one transaction, so a bad
+    line can't leave half an import behind. The trade-off is that the
+    write lock is held until the whole file has been imported, so big
+    imports hold up other writes for that long.
+
+    Params:
+        - user: User importing the todos
+        - lines: iterable of bytes, the lines of the file (e.g. an
+        UploadedFile or the HttpRequest itself)
+        - format: str, one of EXPORT_FORMATS
+
+    returns: (result, errorMessage)
+        - result
+            - A dictionary with the number of todos, tasks and shares
+            imported, and the number of shares skipped because their user
+            doesn't exist (or they are in the file more than once).
+            - None if the file could not be imported.
+        - errorMessage
+            - A string with the error message if the file could not be
+            imported.
+            - None otherwise.
+    """
+    if format not in EXPORT_FORMATS:
+        return (None, f"Unknown format {format}.")
+
+    lines = codecs.iterdecode(lines, "utf-8-sig")
+    if format == "csv":
+        records = _gen_csv_records(lines)
+    else:
+        records = _gen_ndjson_records(lines)
+
+    lineNumber = 0
+    try:
+        with transaction.atomic():
+            importer = _Importer(user)
+            for lineNumber, record in records:
+                importer.add(record)
+            result = importer.finish()
+    except _InvalidRecord as error:
+        return (None, f"Line {error.lineNumber or lineNumber}: {error}")
+    except UnicodeDecodeError:
+        return (None, "The file must be UTF-8 encoded.")
+    except csv.Error as error:
+        return (None, f"Invalid CSV: {error}.")
+    # The database makes sure the user doesn't end up with two identical
+    # todos, or a todo with two tasks with the same title.
+    except IntegrityError:
+        return (None, "You already have a ToDo in this file, or it has a ToDo with two Tasks with "
+            "the same title.")
+
+    count_writes("todo", "added", result["toDos"])
+    count_writes("task", "added", result["tasks"])
+
+    return (result, None)
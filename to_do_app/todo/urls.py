@@ -1,18 +1,37 @@
+from django.conf import settings
 from django.urls import path, include
 from django.views.generic.base import TemplateView
 
-from . import views
+from . import async_views, views
+
+# Using the async versions of the busiest views if they are turned on.
+hotViews = views
+if settings.ASYNC_VIEWS:
+    hotViews = async_views
 
 urlpatterns = [
-    path("", views.home, name="home"),
+    path("", hotViews.home, name="home"),
     path("_remove<int:toDoId>", views.remove_todo, name="remove_todo"),
     path("_unshare<int:toDoId>_<int:sharedUserId>", views.unshare_todo, name="unshare_todo"),
     path("add_todo", views.add_todo, name="add_todo"),
     path("edit_todo/<int:toDoId>", views.edit_todo, name="edit_todo"),
-    path("view_todo/<int:toDoId>", views.view_todo, name="view_todo"),
-    path("view_todo/add_task/<int:toDoId>", views.add_task, name="add_task"),
-    path("view_todo/<int:toDoId>_complete<int:taskId>", views.complete_task, name="complete_task"),
+    path("view_todo/<int:toDoId>", hotViews.view_todo, name="view_todo"),
+    path("view_todo/add_task/<int:toDoId>", hotViews.add_task, name="add_task"),
+    path("view_todo/<int:toDoId>_complete<int:taskId>", hotViews.complete_task, name="complete_task"),
     path("view_todo/<int:toDoId>_remove<int:taskId>", views.remove_task, name="remove_task"),
     path("view_todo/edit_task/<int:taskId>", views.edit_task, name="edit_task"),
+    path("view_todo/<int:toDoId>/batch", views.batch_tasks, name="batch_tasks"),
+    path("reorder_todo/<int:toDoId>", views.reorder_todo, name="reorder_todo"),
+    path("view_todo/reorder_task/<int:taskId>", views.reorder_task, name="reorder_task"),
     path("share_todo/<int:toDoId>", views.share_todo, name="share_todo"),
+    path("search", views.search, name="search"),
+    path("export", views.export_todos, name="export_todos"),
+    path("import", views.import_todos, name="import_todos"),
+    path("metrics", views.metrics, name="metrics"),
+    path("api/v1/", include("todo.api_urls")),
 ]
+
+# Only streaming events when served through asgi.py (see LIVE_EVENTS_ENABLED).
+if settings.LIVE_EVENTS_ENABLED:
+    urlpatterns.append(
+        path("view_todo/<int:toDoId>/events", async_views.todo_events, name="todo_events"))
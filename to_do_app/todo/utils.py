@@ -1,119 +1,247 @@
+from django.db.models import OuterRef, Subquery
+
 from .models import ToDo, Task, SharedWith, AccessLevel
 
-def validate_user_todo(userId, toDoId):
+def shared_access_subquery(userId, toDoRef):
+    """
+    Builds a subquery selecting the access level a todo has been shared with
+    a user at, so it can be fetched in the same query as the todo.
+    """
+    sharedWith = SharedWith.objects.filter(todo=toDoRef, user=userId)
+    return Subquery(sharedWith.values("access")[:1])
+
+def _gen_access(toDo, userId):
+    """
+    Works out the owner flag and access level of a todo fetched with a
+    sharedAccess annotation, updating the accessLevel of the todo to match.
+
+    returns: (isOwner, accessLevel, errorMessage)
+    """
+    errorMessage = None
+    isOwner = userId == toDo.user_id
+    accessLevel = None
+
+    if isOwner:
+        accessLevel = AccessLevel.WRITE
+    elif toDo.sharedAccess != None:
+        accessLevel = AccessLevel(toDo.sharedAccess)
+    else:
+        errorMessage = f"""
+        You don't have access to this ToDo.
+        Please go back to the home page and try a different one.
+        """
+
+    if accessLevel != None:
+        toDo.accessLevel = accessLevel
+
+    return (isOwner, accessLevel, errorMessage)
+
+def _get_access_cache(request):
     """
-    Used to validate whether a user should have access to a given todo.
+    Returns the dictionary used to memoize access checks for the rest of a
+    request.
+    """
+    accessCache = getattr(request, "_todoAccessCache", None)
+    if accessCache == None:
+        accessCache = {}
+        request._todoAccessCache = accessCache
+    return accessCache
+
+def resolve_todo_access(request, toDoId):
+    """
+    Used to resolve whether the user making a request should have access to a
+    given todo, and at what access level.
     Prevents users from accessing other todos by specifying their id in the
     url.
+    The todo, its owner and the users shared access level are all fetched in
+    one query, and the result is memoized on the request so checking the same
+    todo again costs nothing.
 
     Params:
-        - userId: int
+        - request: HttpRequest
         - toDoId: int
 
-    returns: (toDo, errorMessage)
+    returns: (toDo, isOwner, accessLevel, errorMessage)
         - toDo
-            - models.ToDo if the todo esixts
+            - models.ToDo if the todo exists, with its accessLevel updated
             - None if it doesn't
+        - isOwner
+            - True if the user owns the todo, False otherwise.
+        - accessLevel
+            - The models.AccessLevel the user has to the todo.
+            - None if the user cannot access the todo.
         - errorMessage
             - A string with the error message if the user cannot access the 
             todo.
             - None if the user should be able to access the todo.
     """
+    accessCache = _get_access_cache(request)
+    cacheKey = ("todo", toDoId)
+    if cacheKey in accessCache:
+        return accessCache[cacheKey]
+
+    userId = request.user.id
 
-    errorMessage = None
-    toDo = None
-    
     # Making sure a todo with the id specified exists.
     try:
-        toDo = ToDo.objects.get(id=toDoId)
+        toDo = _todo_access_queryset(userId).get(id=toDoId)
+    except ToDo.DoesNotExist:
+        toDo = None
+
+    accessCache[cacheKey] = _gen_todo_access(toDo, toDoId, userId)
+    return accessCache[cacheKey]
+
+async def aresolve_todo_access(request, toDoId):
+    """
+    Async version of resolve_todo_access, sharing the same memoized results.
+    """
+    accessCache = _get_access_cache(request)
+    cacheKey = ("todo", toDoId)
+    if cacheKey in accessCache:
+        return accessCache[cacheKey]
+
+    userId = (await request.auser()).id
+
+    # Making sure a todo with the id specified exists.
+    try:
+        toDo = await _todo_access_queryset(userId).aget(id=toDoId)
+    except ToDo.DoesNotExist:
+        toDo = None
+
+    accessCache[cacheKey] = _gen_todo_access(toDo, toDoId, userId)
+    return accessCache[cacheKey]
+
+def _todo_access_queryset(userId):
+    return (ToDo.objects
+        .select_related("user")
+        .annotate(sharedAccess=shared_access_subquery(userId, OuterRef("pk"))))
+
+def _gen_todo_access(toDo, toDoId, userId):
+    """
+    Works out the result of resolve_todo_access from the todo it fetched.
+    """
     # If the id passed via the url is invalid, raise an error.
-    except:
+    if toDo == None:
         errorMessage = f"""
         There is no ToDo with id {toDoId}.
         Please go back to the home page and try again.
         """
-    else:
-        # Making sure the user has access to the todo.
-        userIdFromToDo = toDo.user.id
-        # - Checking they either own the todo or...
-        userOwnsToDo = userId == userIdFromToDo
-        # - ... have the todo shared with them.
-        sharedWith = SharedWith.objects.filter(todo=toDoId, user=userId)
-        toDoSharedWithUser = sharedWith.exists()
-
-        if (not userOwnsToDo) and (not toDoSharedWithUser):
-            errorMessage = f"""
-            You don't have access to this ToDo.
-            Please go back to the home page and try a different one.
-            """
-    
-    return (toDo, errorMessage)
-
-def validate_user_task(userId, taskId):
-    """
-    Used to validate whether a user should have access to a given task.
-    Prevents users from accessing other tasks by specifying their id in the
-    url.
+        return (None, False, None, errorMessage)
+
+    # Making sure the user either owns the todo or has it shared with them.
+    isOwner, accessLevel, errorMessage = _gen_access(toDo, userId)
+    return (toDo, isOwner, accessLevel, errorMessage)
+
+def resolve_task_access(request, taskId):
+    """
+    Used to resolve whether the user making a request should have access to a
+    given task, and at what access level.
+    Every task shares the same access level as its parent todo, so the task,
+    its todo, the todos owner and the users shared access level are all fetched
+    in one query. The result (for both the task and its todo) is memoized on
+    the request.
 
     Params:
-        - userId: int
+        - request: HttpRequest
         - taskId: int
 
-    returns: (task, errorMessage)
+    returns: (task, isOwner, accessLevel, errorMessage)
         - task
-            - models.Task if the task esixts
+            - models.Task if the task exists, with its todo (task.belongsTo)
+            loaded and the todos accessLevel updated
             - None if it doesn't
+        - isOwner
+            - True if the user owns the tasks todo, False otherwise.
+        - accessLevel
+            - The models.AccessLevel the user has to the tasks todo.
+            - None if the user cannot access the task.
         - errorMessage
             - A string with the error message if the user cannot access the 
             task.
             - None if the user should be able to access the task.
     """
+    accessCache = _get_access_cache(request)
+    cacheKey = ("task", taskId)
+    if cacheKey in accessCache:
+        return accessCache[cacheKey]
 
-    errorMessage = None
-    task = None
+    userId = request.user.id
 
     # Making sure a task with the id specified exists.
     try:
-        task = Task.objects.get(id=taskId)
+        task = _task_access_queryset(userId).get(id=taskId)
+    except Task.DoesNotExist:
+        task = None
+
+    accessCache[cacheKey] = _gen_task_access(accessCache, task, taskId, userId)
+    return accessCache[cacheKey]
+
+async def aresolve_task_access(request, taskId):
+    """
+    Async version of resolve_task_access, sharing the same memoized results.
+    """
+    accessCache = _get_access_cache(request)
+    cacheKey = ("task", taskId)
+    if cacheKey in accessCache:
+        return accessCache[cacheKey]
+
+    userId = (await request.auser()).id
+
+    # Making sure a task with the id specified exists.
+    try:
+        task = await _task_access_queryset(userId).aget(id=taskId)
+    except Task.DoesNotExist:
+        task = None
+
+    accessCache[cacheKey] = _gen_task_access(accessCache, task, taskId, userId)
+    return accessCache[cacheKey]
+
+def _task_access_queryset(userId):
+    # Tasks of deleted todos are gone as far as anyone can tell.
+    return (Task.objects
+        .filter(belongsTo__deletedAt__isnull=True)
+        .select_related("belongsTo__user")
+        .annotate(sharedAccess=shared_access_subquery(userId, OuterRef("belongsTo"))))
+
+def _gen_task_access(accessCache, task, taskId, userId):
+    """
+    Works out the result of resolve_task_access from the task it fetched,
+    memoizing the access to the tasks todo as well.
+    """
     # If the id passed via the url is invalid, raise an error.
-    except:
+    if task == None:
         errorMessage = f"""
         There is no Task with id {taskId}.
         Please go back to the home page and try again.
         """
-    else:
-        # Making sure the user has access to the task.
-        # Every task shares the same access level as its parent todo, 
-        # so we can just call validate_user_todo.
-        todo_id = task.belongsTo.id
-        _, errorMessage = validate_user_todo(userId, todo_id)
-    
-    return (task, errorMessage)
-
-def validate_write_access(userId, toDoId):
-    """
-    Used to validate whether a user has write access to a given todo and its
-    tasks.
+        return (None, False, None, errorMessage)
+
+    # Making sure the user has access to the todo the task belongs to.
+    toDo = task.belongsTo
+    toDo.sharedAccess = task.sharedAccess
+    isOwner, accessLevel, errorMessage = _gen_access(toDo, userId)
+    accessCache[("todo", toDo.id)] = (toDo, isOwner, accessLevel, errorMessage)
+
+    return (task, isOwner, accessLevel, errorMessage)
+
+def check_write_access(accessLevel):
+    """
+    Used to validate whether an access level (from resolve_todo_access or
+    resolve_task_access) allows writing to a todo and its tasks.
     NOTE: todos and their tasks share access levels, so we only need to check
     the users access to the todo.
 
     Params:
-        - userId: int
-        - taskId: int
+        - accessLevel: models.AccessLevel or None
 
-    returns: (todo, errorMessage)
-        - todo
-            - the todo with write access updated.
-        - errorMessage
-            - A string with the error message if the user does not have write 
-            access to the todo.
-            - None otherwise.
+    returns: errorMessage
+        - A string with the error message if the user does not have write 
+        access to the todo.
+        - None otherwise.
     """
-    todo = ToDo.objects.get(id=toDoId)
     errorMessage = None
 
-    todo.updateSharedAccessLevel(userId)
-    if (todo.accessLevel != AccessLevel.WRITE):
+    if (accessLevel != AccessLevel.WRITE):
         errorMessage = "You do not have write access to this ToDo."
 
-    return (todo, errorMessage)
\ No newline at end of file
+    return errorMessage
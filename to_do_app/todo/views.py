@@ -1,36 +1,99 @@
+from django.contrib.auth.decorators import login_required
 from django.shortcuts import render
 from django.shortcuts import redirect
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Prefetch, Q, prefetch_related_objects
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_POST
+from django.utils import timezone
 
 import datetime
-
-from .forms import ToDoForm, TaskForm, ShareForm
+import json
+
+from .batch import parse_task_batch, batch_needs_write, apply_task_batch
+from .cache import get_cached_fragments
+from .conditional import get_home_metadata, home_etag, share_digest_subquery, todo_etag
+from .forms import ToDoForm, TaskForm, ShareForm, ImportForm
+from .ordering import next_position, move_item
+from .pagination import get_keyset_page
+from .purge import delete_todo
+from .search import search_todos
+from .metrics import gen_metrics_text
 from .models import ToDo, Task, User, SharedWith
-from .utils import validate_user_todo, validate_user_task, validate_write_access
-
+from .transfer import EXPORT_FORMATS, gen_export, import_records
+from .utils import resolve_todo_access, resolve_task_access, check_write_access, shared_access_subquery
+from .writer import run_write
+
+DUPLICATE_TODO_MESSAGE = """
+You already have a TODO with this title and combination, 
+please alter at least one of these values and try again.
+"""
+
+DUPLICATE_TASK_MESSAGE = """
+You already have a Task with this title and combination, 
+please alter at least one of these values and try again.
+"""
+
+def gen_home_todos(id):
+    """
+    Builds the queryset of the todos on the home page of a user (the ones
+    they own or that are shared with them), with their owners, the users
+    shared access level to each and a digest of who each is shared with
+    (part of the key of their cached cards, see cache.py).
+    """
+    return (ToDo.objects
+        .filter(Q(user=id) | Q(sharedwith__user=id))
+        .distinct()
+        .select_related("user")
+        .annotate(
+            sharedAccess=shared_access_subquery(id, OuterRef("pk")),
+            shareDigest=share_digest_subquery(OuterRef("pk"))))
+
+def set_shared_access(toDos):
+    """
+    Sets the accessLevel of the todos from gen_home_todos that are shared 
+    with the user.
+    """
+    for toDo in toDos:
+        if toDo.sharedAccess != None:
+            toDo.accessLevel = toDo.sharedAccess
+
+def gen_shares_prefetch():
+    """
+    The prefetch of who todos are shared with that ToDo.genShareDetails 
+    needs.
+    """
+    sharedWithQuery = SharedWith.objects.select_related("user")
+    return Prefetch("sharedwith_set", queryset=sharedWithQuery)
+
+# Unchanged pages are answered with a 304 (see conditional.py).
+@condition(etag_func=home_etag)
 def home(request):
     id = request.user.id
-    toDos = None
 
-    # Getting all the ToDos that belong to this user.
-    toDos = ToDo.objects.filter(user=id)
+    # Getting a page of the ToDos that belong to this user or are shared with
+    # them, along with their owners and the users access level to each.
+    toDos, nextPageQuery, errorMessage = get_keyset_page(gen_home_todos(id), request)
+    set_shared_access(toDos)
 
-    # Getting all the ToDos that are shared with this user.
-    sharedWithUser = SharedWith.objects.filter(user=id)
-    sharedToDoIds = list(sharedWithUser.values_list("todo", flat=True))
-    sharedToDos = ToDo.objects.filter(pk__in=sharedToDoIds)
+    def gen_card_context(missedToDos):
+        # If this is the owner of the todo, generate a list of users
+        # the todo is shared with (for all of the cards that need rendering
+        # at once, so the number of queries doesn't grow with the todos).
+        prefetch_related_objects(missedToDos, gen_shares_prefetch())
+        ToDo.genShareDetails(missedToDos, id)
 
-    # Combining both query sets.
-    toDos = toDos | sharedToDos
+        return lambda toDo: {"toDo": toDo, "user": request.user}
 
-    # If this is the owner of the todo, generate a list of users
-    # the todo is shared with.
-    for toDo in toDos:
-        if id == toDo.user.id:
-            toDo.genShareUserList()
-        else:
-            toDo.updateSharedAccessLevel(id)
+    # Only rendering the cards of todos that aren't already cached.
+    cards = get_cached_fragments(toDos, id, "card", "todo_card.html", gen_card_context)
     context = {
-        "toDos": toDos,
+        # The users totals come with the metadata of the page.
+        "stats": get_home_metadata(request),
+        "cards": cards,
+        "nextPageQuery": nextPageQuery,
+        "errorMessage": errorMessage,
     }
 
     return render(request, "home.html", context)
@@ -50,26 +113,20 @@ def add_todo(request):
             title = formData["title"]
             desc = formData["desc"]
 
-            toDos = ToDo.objects.filter(user=id)
-
-            # Check if an identical ToDo exists for this user.
-            matchingToDos = ToDo.objects.filter(user=id, title=title, desc=desc)
-            isToDoUnique = len(matchingToDos) == 0
-            # If the ToDo is unique then add it to the database.
-            if isToDoUnique:
-                position = len(toDos)
-                toDo = ToDo(title=title, desc=desc, position=position, user_id=id)
-                toDo.save()
+            # Add the ToDo to the database, the database makes sure there 
+            # isn't an identical ToDo for this user already.
+            position = next_position(ToDo.objects.filter(user=id))
+            toDo = ToDo(title=title, desc=desc, position=position, user_id=id)
+            try:
+                with transaction.atomic():
+                    toDo.save()
 
                 # Redirect back to home page.
                 return redirect("/")
             
             # Otherwise let the user know what the problem is.
-            else:
-                errorMessage = """
-                You already have a TODO with this title and combination, 
-                please alter at least one of these values and try again.
-                """
+            except IntegrityError:
+                errorMessage = DUPLICATE_TODO_MESSAGE
 
     # If a GET (or any other method) create a blank form.
     else:
@@ -87,11 +144,11 @@ def edit_todo(request, toDoId):
     id = request.user.id
 
     # Checking that the user has access to edit this todo.
-    toDo, errorMessage = validate_user_todo(id, toDoId)
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
 
     # Checking if the user has write access to the todo.
     if errorMessage == None:
-        toDo, errorMessage = validate_write_access(id, toDoId)
+        errorMessage = check_write_access(accessLevel)
    
     if errorMessage == None:
         # If this is a POST request, process the form data
@@ -108,10 +165,16 @@ def edit_todo(request, toDoId):
                 toDo.title = title
                 toDo.desc = desc
 
-                toDo.save()
+                try:
+                    with transaction.atomic():
+                        toDo.save()
 
-                # Redirect back to home page.
-                return redirect("/")
+                    # Redirect back to home page.
+                    return redirect("/")
+
+                # The user already has a todo with the new title and description.
+                except IntegrityError:
+                    errorMessage = DUPLICATE_TODO_MESSAGE
                 
         # If a GET (or any other method) create a form with the todo details.
         else:
@@ -129,22 +192,37 @@ def edit_todo(request, toDoId):
     else:
         return redirect("/")
     
+@condition(etag_func=todo_etag)
 def view_todo(request, toDoId):
     id = request.user.id
-    tasks = None
 
-    # Checking that the user has access to view this todo.
-    toDo, errorMessage = validate_user_todo(id, toDoId)
+    # Checking that the user has access to view this todo (this also updates
+    # the access level if the todo is shared).
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
+    taskList = None
     if errorMessage == None:
-        # Update the access level if the todo is shared.
-        toDo.updateSharedAccessLevel(id)
-
-        tasks = Task.objects.filter(belongsTo=toDoId)
+        def gen_task_list_context(missedToDos):
+            # Getting a page of the todos tasks.
+            tasks = Task.objects.filter(belongsTo=toDoId).select_related("createdBy")
+            tasks, nextPageQuery, pageErrorMessage = get_keyset_page(tasks, request)
+
+            return lambda toDo: {
+                "errorMessage": pageErrorMessage,
+                "toDo": toDo,
+                "tasks": tasks,
+                "nextPageQuery": nextPageQuery,
+                "after": request.GET.get("after"),
+            }
+
+        # Only rendering the page of tasks if it isn't already cached.
+        taskList, = get_cached_fragments([toDo], id, "tasks", "task_list.html",
+            gen_task_list_context, extra=request.GET.urlencode())
 
     context = {
         "errorMessage": errorMessage,
         "toDo": toDo,
-        "tasks": tasks,
+        "taskList": taskList,
+        "liveEvents": settings.LIVE_EVENTS_ENABLED,
     }
 
     return render(request, "view_todo.html", context)
@@ -153,15 +231,16 @@ def remove_todo(request, toDoId):
     id = request.user.id
     
     # Checking that the user has access to this todo.
-    toDo, errorMessage = validate_user_todo(id, toDoId)
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
 
     # Checking if the user has write access to the todo.
     if errorMessage == None:
-        toDo, errorMessage = validate_write_access(id, toDoId)
+        errorMessage = check_write_access(accessLevel)
 
+    # The todo is hidden straight away, and its tasks are purged by a
+    # background job (see purge.py).
     if errorMessage == None:
-        toDo = ToDo.objects.get(id=toDoId)
-        toDo.delete()
+        delete_todo(toDo)
 
     return redirect("/")
 
@@ -169,7 +248,7 @@ def share_todo(request, toDoId):
     id = request.user.id
 
      # Checking that the user has access to share this todo.
-    toDo, errorMessage = validate_user_todo(id, toDoId)
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
     if errorMessage == None:
         
         if request.method == "POST":
@@ -190,15 +269,14 @@ def share_todo(request, toDoId):
                     try:
                         shareUser = User.objects.get(username=shareUsername)
 
-                        # If the todo is already shared with this user, then do nothing
-                        sharedWithUser = SharedWith.objects.filter(user=shareUser.id, todo=toDo.id)
-
-                        if not sharedWithUser: # The query set is empty
-                            sharedWith = SharedWith(user=shareUser, todo=toDo, access=shareAccess)
+                        # If the todo is already shared with this user, then 
+                        # the database won't let it be shared again.
+                        sharedWith = SharedWith(user=shareUser, todo=toDo, access=shareAccess)
+                        with transaction.atomic():
                             sharedWith.save()
-                        else:
-                            errorMessage = f"This todo has already been shared with {shareUsername}"
 
+                    except IntegrityError:
+                        errorMessage = f"This todo has already been shared with {shareUsername}"
                     except (User.DoesNotExist):
                         errorMessage = f"There is no user with username {shareUsername}"
                 else:
@@ -224,7 +302,7 @@ def unshare_todo(request, toDoId, sharedUserId):
     id = request.user.id
 
     # Checking that the user has access to unshare this todo.
-    toDo, errorMessage = validate_user_todo(id, toDoId)
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
     if errorMessage == None:
 
         # Checking that the todo is shared with the specified user.
@@ -244,7 +322,7 @@ def add_task(request, toDoId):
     # TODO dont let user add task if they don't have write access.
 
     # Checking that the user has access to add to this todo.
-    toDo, errorMessage = validate_user_todo(id, toDoId)
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
     if errorMessage == None:
         # If this is a POST request, process the form data
         if request.method == "POST":
@@ -255,28 +333,21 @@ def add_task(request, toDoId):
                 formData = form.cleaned_data
                 title = formData["title"]
 
-                tasks = Task.objects.filter(belongsTo=toDoId)
-                # Check if an identical task exists for this todo.
-                matchingTasks = Task.objects.filter(belongsTo=toDoId, 
-                    title=title)
-                isTaskUnique = len(matchingTasks) == 0
-                # If the task is unique then add it to the database.
-                if isTaskUnique:
-                    position = len(tasks)
-                    user = User.objects.get(id=id)
-                    task = Task(title=title, position=position, 
-                        lastModified=datetime.datetime.now(), belongsTo=toDo, createdBy=user)
-                    task.save()
+                # Add the task to the database, the database makes sure 
+                # there isn't an identical task in this todo already.
+                position = next_position(Task.objects.filter(belongsTo=toDoId))
+                task = Task(title=title, position=position, 
+                    lastModified=datetime.datetime.now(), belongsTo=toDo, 
+                    createdBy=request.user)
+                try:
+                    run_write(task.save)
 
                     # Redirect back to view todo page.
                     return redirect(f"/view_todo/{toDoId}")
                 
                 # Otherwise let the user know what the problem is.
-                else:
-                    errorMessage = """
-                    You already have a Task with this title and combination, 
-                    please alter at least one of these values and try again.
-                    """
+                except IntegrityError:
+                    errorMessage = DUPLICATE_TASK_MESSAGE
 
         # If a GET (or any other method) create a blank form.
         else:
@@ -293,31 +364,26 @@ def add_task(request, toDoId):
 def remove_task(request, toDoId, taskId):
     id = request.user.id
 
-    # Checking if the user has write access to the todo.
-    toDo, errorMessage = validate_write_access(id, toDoId)
+    # Checking that the user has access to remove this task.
+    task, isOwner, accessLevel, errorMessage = resolve_task_access(request, taskId)
+
+    # Checking if the user has write access to the tasks todo.
     if errorMessage == None:
+        errorMessage = check_write_access(accessLevel)
 
-     # Checking that the user has access to complete this task.
-        task, errorMessage = validate_user_task(id, taskId)
-        if errorMessage == None:
-            task.delete()
+    if errorMessage == None:
+        run_write(task.delete)
 
     return redirect(f"/view_todo/{toDoId}")
 
 def complete_task(request, toDoId, taskId):
     id = request.user.id
-    tasks = None
 
-    # Checking that the user has access to view this todo.
-    toDo, errorMessage = validate_user_todo(id, toDoId)
+    # Checking that the user has access to complete this task.
+    task, isOwner, accessLevel, errorMessage = resolve_task_access(request, taskId)
     if errorMessage == None:
-
-        # Checking that the user has access to complete this task.
-        task, errorMessage = validate_user_task(id, taskId)
-        if errorMessage == None:
-            # Toggling the task as done/not done.
-            task.done = not task.done
-            task.save()
+        # Toggling the task as done/not done.
+        run_write(task.toggleDone)
 
     return redirect(f"/view_todo/{toDoId}")
 
@@ -325,15 +391,19 @@ def complete_task(request, toDoId, taskId):
 
 def edit_task(request, taskId):
     id = request.user.id
-    toDoId = Task.objects.get(id=taskId).belongsTo.id
     errorMessage = None
 
     # Checking that the user has access to this task (and that the task exists).
-    task, errorMessage = validate_user_task(id, taskId)
+    task, isOwner, accessLevel, errorMessage = resolve_task_access(request, taskId)
+
+    # If the task doesn't exist there is no todo to go back to.
+    if task == None:
+        return redirect("/")
+    toDoId = task.belongsTo_id
 
     # Checking if the user has write access to the todo.
     if errorMessage == None:
-        toDo, errorMessage = validate_write_access(id, toDoId)
+        errorMessage = check_write_access(accessLevel)
 
     if errorMessage == None:
         # If this is a POST request, process the form data
@@ -347,11 +417,15 @@ def edit_task(request, taskId):
 
                 # Edit relevant fields.
                 task.title = title
-                task.save()
+                try:
+                    run_write(task.save)
+
+                    # Redirect back to the view todo page.
+                    return redirect(f"/view_todo/{toDoId}")
 
-                # Redirect back to the view todo page.
-                toDoId = task.belongsTo.id
-                return redirect(f"/view_todo/{toDoId}")
+                # The todo already has a task with the new title.
+                except IntegrityError:
+                    errorMessage = DUPLICATE_TASK_MESSAGE
                 
         # If a GET (or any other method) create a form with the task details.
         else:
@@ -369,4 +443,178 @@ def edit_task(request, taskId):
 
     # If don't have access redirect to view todo page.
     else:
-        return redirect(f"/view_todo/{toDoId}")
\ No newline at end of file
+        return redirect(f"/view_todo/{toDoId}")
+
+@require_POST
+def batch_tasks(request, toDoId):
+    """
+    Applies a JSON list of task operations ({"operations": [...]}, see 
+    batch.parse_task_batch) to a todo in one go, checking the users access 
+    once for the whole batch.
+    """
+    # Checking that the user has access to this todo.
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
+    if errorMessage != None:
+        status = 404 if toDo == None else 403
+        return JsonResponse({"errorMessage": errorMessage.strip()}, status=status)
+
+    try:
+        operations = json.loads(request.body).get("operations")
+    except (ValueError, AttributeError):
+        return JsonResponse({"errorMessage": "Invalid JSON body."}, status=400)
+
+    # Checking the operations are valid.
+    operations, errorMessage = parse_task_batch(operations)
+    if errorMessage != None:
+        return JsonResponse({"errorMessage": errorMessage}, status=400)
+
+    # Checking if the user has write access to the todo, if the batch needs it.
+    if batch_needs_write(operations):
+        errorMessage = check_write_access(accessLevel)
+        if errorMessage != None:
+            return JsonResponse({"errorMessage": errorMessage}, status=403)
+
+    result, errorMessage = apply_task_batch(toDo, request.user, operations)
+    if errorMessage != None:
+        return JsonResponse({"errorMessage": errorMessage}, status=400)
+
+    return JsonResponse(result)
+
+def _get_after_id(request):
+    """
+    Gets the id of the item to move another item after from a reorder 
+    request, None meaning move it to the start.
+
+    returns: (afterId, errorMessage)
+    """
+    afterId = request.POST.get("after", "")
+    if afterId == "":
+        return (None, None)
+    try:
+        return (int(afterId), None)
+    except ValueError:
+        return (None, f"Invalid item id {afterId}.")
+
+@require_POST
+def reorder_todo(request, toDoId):
+    """
+    Moves one of the users todos on their home page so that it comes straight 
+    after the todo with the id in the "after" POST field (or first if it is 
+    empty).
+    """
+    # Checking that the user owns this todo, as todos are ordered per owner.
+    toDo, isOwner, accessLevel, errorMessage = resolve_todo_access(request, toDoId)
+    if errorMessage == None and not isOwner:
+        errorMessage = "Only the owner of a ToDo can reorder it."
+    if errorMessage != None:
+        status = 404 if toDo == None else 403
+        return JsonResponse({"errorMessage": errorMessage.strip()}, status=status)
+
+    afterId, errorMessage = _get_after_id(request)
+    if errorMessage == None:
+        errorMessage = move_item(toDo, ToDo.objects.filter(user=toDo.user_id), afterId)
+    if errorMessage != None:
+        return JsonResponse({"errorMessage": errorMessage}, status=400)
+
+    return JsonResponse({"position": toDo.position})
+
+@require_POST
+def reorder_task(request, taskId):
+    """
+    Moves a task within its todo so that it comes straight after the task with 
+    the id in the "after" POST field (or first if it is empty).
+    """
+    # Checking that the user has write access to the tasks todo.
+    task, isOwner, accessLevel, errorMessage = resolve_task_access(request, taskId)
+    if errorMessage == None:
+        errorMessage = check_write_access(accessLevel)
+    if errorMessage != None:
+        status = 404 if task == None else 403
+        return JsonResponse({"errorMessage": errorMessage.strip()}, status=status)
+
+    afterId, errorMessage = _get_after_id(request)
+    if errorMessage == None:
+        errorMessage = move_item(task, Task.objects.filter(belongsTo=task.belongsTo_id), afterId)
+    if errorMessage != None:
+        return JsonResponse({"errorMessage": errorMessage}, status=400)
+
+    # Reordering the tasks changes the todo, so its last modified is updated.
+    ToDo.objects.filter(id=task.belongsTo_id).update(lastModified=timezone.now())
+
+    return JsonResponse({"position": task.position})
+
+def search(request):
+    id = request.user.id
+    query = request.GET.get("q", "")
+    results = []
+    nextPageQuery = None
+    errorMessage = None
+
+    # Searching the todos and tasks the user can see (see search.py).
+    if query:
+        results, nextPageQuery, errorMessage = search_todos(id, query, request)
+
+    context = {
+        "query": query,
+        "results": results,
+        "nextPageQuery": nextPageQuery,
+        "errorMessage": errorMessage,
+    }
+
+    return render(request, "search.html", context)
+
+@login_required
+def export_todos(request):
+    """
+    Streams an export of all of the users todos, their tasks and shares, in
+    the format given by the "format" GET parameter (see transfer.py).
+    """
+    format = request.GET.get("format", "ndjson")
+    if format not in EXPORT_FORMATS:
+        return JsonResponse({"errorMessage": f"Unknown format {format}."}, status=400)
+
+    response = StreamingHttpResponse(gen_export(request.user.id, format),
+        content_type=EXPORT_FORMATS[format])
+    response["Content-Disposition"] = f'attachment; filename="todos.{format}"'
+    return response
+
+@login_required
+def import_todos(request):
+    errorMessage = None
+    result = None
+
+    # If this is a POST request, import the uploaded file.
+    if request.method == "POST":
+        form = ImportForm(request.POST, request.FILES)
+
+        if form.is_valid():
+            # The file is read a line at a time (see transfer.py).
+            result, errorMessage = import_records(request.user, form.cleaned_data["file"],
+                form.cleaned_data["format"])
+
+    # If a GET (or any other method) create a blank form.
+    else:
+        form = ImportForm()
+
+    context = {
+        "form": form,
+        "result": result,
+        "errorMessage": errorMessage,
+    }
+
+    return render(request, "import_todos.html", context)
+
+def metrics(request):
+    """
+    The metrics in the Prometheus text format (see metrics.py), for a 
+    Prometheus server to scrape.
+    """
+    if not settings.METRICS_ENABLED:
+        return HttpResponse("Metrics are turned off.", status=404, content_type="text/plain")
+
+    if settings.METRICS_TOKEN:
+        authorization = request.headers.get("Authorization", "")
+        if authorization != f"Bearer {settings.METRICS_TOKEN}":
+            return HttpResponse("Invalid metrics token.", status=401, content_type="text/plain")
+
+    return HttpResponse(gen_metrics_text(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,168 @@
+from asgiref.sync import sync_to_async
+from concurrent.futures import Future
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+import asyncio
+import queue
+import threading
+import time
+
+# An optional pipeline for the writes made by the task views (see
+# WRITE_QUEUE_ENABLED in settings.py). Rather than every request opening its
+# own write transaction (and queueing on SQLite's write lock), the writes are
+# handed to a single writer thread, which commits the writes of several
+# requests in one transaction (a group commit). Each write runs in its own
+# savepoint, so one failing (e.g. with an IntegrityError) only rolls back
+# that write, and its request gets the exception rather than a result.
+#
+# The writer waits at most WRITE_QUEUE_MAX_DELAY seconds after the first
+# write of a group for others to join it, and commits at most
+# WRITE_QUEUE_MAX_BATCH writes at once.
+
+class WriteQueue:
+    """
+    A queue of writes committed in groups by one writer thread.
+    """
+
+    def __init__(self, maxBatch=64, maxDelay=0.005):
+        self.maxBatch = maxBatch
+        self.maxDelay = maxDelay
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {"writes": 0, "commits": 0}
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues a write, starting the writer thread if it isn't running.
+
+        returns: concurrent.futures.Future, with the result of the function
+        once its group has been committed.
+        """
+        future = Future()
+        with self.lock:
+            if self.thread == None:
+                self.thread = threading.Thread(target=self._run, name="todo-writer", daemon=True)
+                self.thread.start()
+            self.jobs.put((function, args, kwargs, future))
+        return future
+
+    def stop(self):
+        """
+        Stops the writer thread once the writes already queued are committed.
+        """
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+            if thread != None:
+                self.jobs.put(None)
+        if thread != None:
+            thread.join()
+
+    def _get_group(self):
+        """
+        Waits for a write, then collects any more that are queued within the
+        latency budget.
+
+        returns: (group, stopping)
+        """
+        job = self.jobs.get()
+        if job == None:
+            return ([], True)
+
+        group = [job]
+        deadline = time.monotonic() + self.maxDelay
+        while len(group) < self.maxBatch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                job = self.jobs.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if job == None:
+                return (group, True)
+            group.append(job)
+
+        return (group, False)
+
+    def _commit_group(self, group):
+        """
+        Runs a group of writes in one transaction, each in its own savepoint,
+        and hands every request its result once the transaction is committed.
+        """
+        results = []
+        try:
+            with transaction.atomic():
+                for function, args, kwargs, future in group:
+                    try:
+                        with transaction.atomic():
+                            results.append((future, function(*args, **kwargs), None))
+                    except Exception as error:
+                        results.append((future, None, error))
+        except Exception as error:
+            # The commit itself failed, so none of the writes happened.
+            for function, args, kwargs, future in group:
+                future.set_exception(error)
+            return
+
+        self.stats["writes"] += len(group)
+        self.stats["commits"] += 1
+        for future, result, error in results:
+            if error != None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _run(self):
+        stopping = False
+        try:
+            while not stopping:
+                group, stopping = self._get_group()
+                if group:
+                    # Replacing the connection if it has gone away (like
+                    # Django does between requests).
+                    close_old_connections()
+                    self._commit_group(group)
+        finally:
+            connection.close()
+
+_writeQueue = None
+_writeQueueLock = threading.Lock()
+
+def get_write_queue():
+    """
+    returns: WriteQueue, the write queue of this process.
+    """
+    global _writeQueue
+    with _writeQueueLock:
+        if _writeQueue == None:
+            _writeQueue = WriteQueue(
+                maxBatch=getattr(settings, "WRITE_QUEUE_MAX_BATCH", 64),
+                maxDelay=getattr(settings, "WRITE_QUEUE_MAX_DELAY", 0.005))
+        return _writeQueue
+
+def run_write(function, *args, **kwargs):
+    """
+    Used by views to make a write, through the write queue if it is enabled,
+    otherwise straight away in its own transaction. Either way any exception
+    raised by the write is raised here.
+
+    returns: whatever the function returns
+    """
+    if getattr(settings, "WRITE_QUEUE_ENABLED", False):
+        return get_write_queue().submit(function, *args, **kwargs).result()
+
+    with transaction.atomic():
+        return function(*args, **kwargs)
+
+async def arun_write(function, *args, **kwargs):
+    """
+    Async version of run_write, which waits for the write queue without 
+    holding up a thread.
+    """
+    if getattr(settings, "WRITE_QUEUE_ENABLED", False):
+        return await asyncio.wrap_future(get_write_queue().submit(function, *args, **kwargs))
+
+    return await sync_to_async(run_write)(function, *args, **kwargs)